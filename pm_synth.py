@@ -7,24 +7,133 @@
 @purpose: Phase modulation synthesizer ala Yamaha DX7. 
 """
 import numpy as np
-import math
-import random
-from collections import deque
+import mmap
+import struct
+import time
 import pm_synth_defaults as default
 
 
 class Synthesizer(object):
-    """ Generic top-level parent class for synthesizers. """
-    def __init__(self, fs=10000):
+    """ 
+    Generic top-level parent class for synthesizers. 
+    
+    Buffers are allocated MAX_BLOCK_LEN samples long, but only the first
+    block_len samples are used in any given call to synthesize(). Real-time
+    playback always uses BUFFER_LEN, while offline rendering can ask for much
+    larger blocks to cut down on per-block overhead.
+    
+    The output is n_channels x block_len, one row per channel, even when 
+    n_channels is 1.
+    
+    Audio buffers (component buffers, delay lines, envelope tables, grain 
+    gains) are all of type dtype. float32 halves their memory (about 40% 
+    less for a whole synth, see speed_test.py), and is what sound cards 
+    take anyway, which is why it is the default. It is no faster in 
+    real-time blocks, where the time goes on per-block overhead rather than
+    arithmetic, and only a little faster in long offline blocks. Phases and
+    delay line positions are always float64, since they keep growing and 
+    need the precision.
+    
+    If delay_dir is set, delay lines are LONG_DELAY_LEN samples long and
+    kept in files in that directory instead of in RAM, see Delay_Line.
+    
+    All randomness in the synth comes from seed_sequence, so two synths made
+    with the same seed (and fed the same input) render the same audio.
+    """
+    def __init__(self, fs=10000, seed=None, n_channels=1, dtype=default.DTYPE,
+                 delay_dir=default.DELAY_DIR):
         self.fs = fs
-        self.curr_output = [0]*default.BUFFER_LEN
+        self.n_channels = n_channels
+        self.dtype = np.dtype(dtype)
+        self.delay_dir = delay_dir
+        self.seed_sequence = np.random.SeedSequence(seed)
+        self.curr_output = np.zeros((n_channels, default.MAX_BLOCK_LEN),
+                                    dtype=self.dtype)
+        self.curr_target = self.curr_output
+        self.block_len = default.BUFFER_LEN
         self.curr_inv = 0
+        self.curr_sample = 0
         
-    def synthesize(self):
+    def synthesize(self, n_frames=default.BUFFER_LEN, out=None):
         print("Do something here?")
         
+    def spawn_seed(self):
+        """ Returns a new, independent seed for a component's randomness. """
+        return(self.seed_sequence.spawn(1)[0])
+        
     def update_inv(self):
         self.curr_inv = self.curr_inv + 1
+        self.curr_sample = self.curr_sample + self.block_len
+        
+    def stream(self, block_frames=default.BUFFER_LEN, buffers=None,
+               n_blocks=None):
+        """
+        Generator which yields synthesized audio, block_frames samples at a
+        time.
+        
+        Arguments:
+            block_frames (int) -- length of each yielded block. Can be longer
+                than MAX_BLOCK_LEN, in which case each block is synthesized
+                in several pieces.
+            buffers (None, or list of arrays) -- n_channels x block_frames
+                arrays owned by the caller to synthesize into, used in turn.
+                The synth writes straight into them, so no copies are made,
+                but a buffer must not be held onto after it comes around 
+                again. If None, every block is a new array which the caller
+                is free to keep.
+            n_blocks (None, or int) -- number of blocks to yield before 
+                stopping. If None, never stops.
+        """
+        i = 0
+        while n_blocks is None or i < n_blocks:
+            if buffers is None:
+                block = np.empty((self.n_channels, block_frames),
+                                 dtype=self.dtype)
+            else:
+                block = buffers[i % len(buffers)]
+            self.synthesize_into(block[:, :block_frames])
+            yield(block[:, :block_frames])
+            i = i + 1
+            
+    async def astream(self, block_frames=default.BUFFER_LEN, buffers=None,
+                      n_blocks=None, realtime=False):
+        """
+        Asynchronous version of stream(), for use with "async for".
+        
+        Arguments:
+            block_frames, buffers, n_blocks -- see stream().
+            realtime (boolean) -- if True, blocks are yielded no faster than
+                real time. If False, blocks are yielded as fast as they are
+                consumed.
+                
+        A block is only synthesized when the consumer asks for the next one,
+        so a slow consumer simply slows the synth down (backpressure) instead
+        of piling up blocks. Control goes back to the event loop after every
+        block so that other tasks can run.
+        """
+        import asyncio
+        start = time.perf_counter()
+        block_dur = block_frames/self.fs
+        i = 0
+        for block in self.stream(block_frames, buffers, n_blocks):
+            if realtime:
+                await asyncio.sleep(max(0, start + i*block_dur - time.perf_counter()))
+            else:
+                await asyncio.sleep(0)
+            yield(block)
+            i = i + 1
+            
+    def synthesize_into(self, out):
+        """ 
+        Synthesizes out.shape[1] samples straight into out (n_channels rows), 
+        in pieces if needed. 
+        """
+        n_total = out.shape[1]
+        done = 0
+        while done < n_total:
+            n = min(n_total - done, default.MAX_BLOCK_LEN)
+            self.synthesize(n, out=out[:, done:done+n])
+            done = done + n
         
         
 class Phase_Mod_Synth(Synthesizer):
@@ -35,15 +144,65 @@ class Phase_Mod_Synth(Synthesizer):
         fs (int) -- sampling rate in Hz
         n_op (int) -- number of operators
         n_gen (int) -- number of grain generators
+        seed (None, or int) -- seed for the grain generators' random numbers,
+            see Synthesizer doc string. If None, every run is different.
+        n_channels (int) -- number of output channels. Grains are panned 
+            across them, see Grain_Generator doc string.
+        dtype (str) -- type of the audio buffers, see Synthesizer doc string.
+        delay_dir (None, or str) -- where to keep long delay lines, see 
+            Synthesizer doc string.
+        oversample (int) -- operators run at oversample times fs (1, 2, or
+            4), see run_ops().
+        op_cache (boolean) -- if True, operators whose settings don't 
+            change are played back from a table, see Operator_Cache.
+        governor (boolean) -- if True, quality is lowered when blocks take
+            too long to render, see Load_Governor.
         
     Attributes:
         curr_master_freq (list) -- current master frequency input. On a real
             synthesizer, would be the frequency input by the keyboard.
         midi (list) --
-        phase_incs (list) --
+        phase_incs (list) -- phase increment (at the operators' rate) for 
+            each MIDI frequency.
         ops (list) --
         gens (list) --
         output_module (object) --
+        pending_patch (None, or Prepared_Patch) -- patch waiting to be swapped
+            in at the start of the next block, see load_patch().
+        master_pitch (array) -- buffer containing the master frequency plus
+            pitch bend, on a MIDI scale, for each sample in the buffer (at 
+            the operators' rate).
+        curr_gain (array) -- buffer containing the output gain (note gate times
+            volume) for each sample in the buffer.
+        midi_scheduler (None, or Midi_Scheduler) -- if set, delivers MIDI
+            events to handle_midi() at the start of every block, see
+            pm_synth_midi.py.
+        control_queue (None, or Control_Queue) -- if set, parameter changes
+            from the GUI are applied from it at the start of every block, 
+            see pm_synth_controller.py.
+        sources (list) -- Sample_Sources added by load_sample(), run after
+            the operators and before the generators.
+        modulators (list) -- Envelopes and LFOs routed to operators with
+            route(), run before the operators.
+        gate (array) -- buffer containing the note gate (0 or 1) for each
+            sample in the buffer.
+        note_ons (list) -- offsets in the current block at which notes 
+            started, for retriggering Envelopes and LFOs.
+        control_steps (list) -- (offset, pitch, gain, gate) for each change
+            to master_pitch, curr_gain, and gate in the current block, see
+            step_controls().
+        activity_key (None, or tuple) -- what update_activity() last 
+            compiled the operator graph for, see run_ops().
+        op_cache (None, or Operator_Cache) -- see op_cache argument.
+        max_grains (int) -- most grains each generator may have playing.
+        lut_osc (boolean) -- if True, operators look their output up in 
+            cos_table (one cycle, LUT_OSC_LEN points long) instead of 
+            calling np.cos(), see Operator.render().
+        cos_slopes (array) -- difference between each point of cos_table 
+            and the next, for interpolating between them.
+        governor (None, or Load_Governor) -- see governor argument.
+        metrics (None, or Engine_Metrics) -- if set, updated after every 
+            block, see pm_synth_metrics.py.
         
     Phase_Mod_Synth first initializes attributes which store all the input
     arguments. Then, Phase_Mod_Synth creates lists which correspond to the
@@ -60,18 +219,35 @@ class Phase_Mod_Synth(Synthesizer):
         Need to make sure that since the switch to buffers things are done
         correctly...
     """    
-    def __init__(self, fs=10000, n_op=default.N_OP, n_gen=default.N_GEN):
-        Synthesizer.__init__(self, fs)
+    def __init__(self, fs=10000, n_op=default.N_OP, n_gen=default.N_GEN,
+                 seed=None, n_channels=default.N_CHANNELS, dtype=default.DTYPE,
+                 delay_dir=default.DELAY_DIR, oversample=default.OVERSAMPLE,
+                 op_cache=default.OP_CACHE, governor=default.GOVERNOR):
+        Synthesizer.__init__(self, fs, seed, n_channels, dtype, delay_dir)
+        self.oversample = oversample
+        self.op_fs = fs*oversample
         self.n_op = n_op
         self.n_gen = n_gen
         self.curr_master_freq = 68
+        self.pending_patch = None
+        
+        # Per-sample control buffers, written by MIDI events
+        self.curr_pitch_bend = 0
+        self.curr_volume = 1
+        self.gate_level = 1
+        self.held_notes = []
+        self.master_pitch = np.zeros(default.MAX_BLOCK_LEN*oversample)
+        self.curr_gain = np.zeros(default.MAX_BLOCK_LEN, dtype=self.dtype)
+        self.gate = np.zeros(default.MAX_BLOCK_LEN)
+        self.note_ons = []
+        self.control_steps = []
+        self.midi_scheduler = None
+        self.control_queue = None
+        self.cc_handlers = {7: self.change_volume}
         
         # Create MIDI table
-        self.midi = []
-        self.phase_incs = []
-        for i in range(128):
-            self.midi.append(2**((i-69)/12)*400)
-            self.phase_incs.append(self.midi[i]/self.fs*2*np.pi)
+        self.midi = 2**((np.arange(128)-69)/12)*400
+        self.phase_incs = self.midi/self.op_fs*2*np.pi
         
         # Initialize components
         self.ops = []
@@ -81,25 +257,380 @@ class Phase_Mod_Synth(Synthesizer):
         for op in range(self.n_gen):
             self.gens.append(Grain_Generator(master=self))
         self.output_module = Output(self)
+        self.sources = []
+        self.modulators = []
+        self.activity_key = None
+        self.op_cache = None
+        if op_cache and oversample == 1:
+            self.op_cache = Operator_Cache(self)
+        self.max_grains = default.MAX_GRAINS_PER_GEN
+        self.lut_osc = False
+        cos_table = np.cos(2*np.pi/default.LUT_OSC_LEN*
+                           np.arange(default.LUT_OSC_LEN + 1))
+        self.cos_table = cos_table[:-1].astype(self.dtype)
+        self.cos_slopes = np.diff(cos_table).astype(self.dtype)
+        self.governor = None
+        if governor:
+            self.governor = Load_Governor(self)
+        self.metrics = None
         
         # Choose algorithm
         self.algorithm = a1_2op_1gen(self.ops, self.gens, self.output_module)
         self.algorithm.implement()
+        self.set_decimators()
 
-    def synthesize(self):
+    def synthesize(self, n_frames=default.BUFFER_LEN, out=None):
         """
-        Runs the synthesizer.
+        Runs the synthesizer for n_frames samples (at most MAX_BLOCK_LEN).
+        
+        Arguments:
+            n_frames (int) -- number of samples to synthesize.
+            out (None, or array) -- if given, the output is written straight
+                into out (which must be n_channels x n_frames, but needn't be
+                contiguous, e.g. the transpose of an interleaved device 
+                buffer) instead of curr_output.
         
         Note, first runs the operators (in an order specified by the algorithm)
         and then the generators, running output_module last and returning the
-        result.
+        result (out, or a view of the first n_frames samples of curr_output). 
+        Generators the algorithm didn't connect to anything aren't run.
+        Since curr_output is reused every block, copy the result if you need
+        to keep it, or see stream(). If a patch has been queued with 
+        load_patch(), it is swapped in before anything is run, so that patch
+        changes only ever happen between blocks. If there is a governor or 
+        metrics, they are told how long the block took.
         """
-        for i in range(len(self.ops)):
-            self.ops[self.algorithm.order[i]].run()
-        for j in range(len(self.gens)):
-            self.gens[j].run()
+        timed = self.governor is not None or self.metrics is not None
+        if timed:
+            start = time.perf_counter()
+        self.block_len = n_frames
+        if out is None:
+            out = self.curr_output[:, :n_frames]
+        self.curr_target = out
+        if self.pending_patch is not None:
+            self.swap_patch()
+        self.note_ons = []
+        self.control_steps = []
+        if self.control_queue is not None:
+            self.control_queue.dispatch()
+        self.step_controls(0)
+        if self.midi_scheduler is not None:
+            self.midi_scheduler.dispatch(self)
+        self.fill_controls()
+        for modulator in self.modulators:
+            modulator.run()
+        self.run_ops()
+        for source in self.sources:
+            source.run()
+        for gen in self.gens:
+            if gen.input_connect is not None:
+                gen.run()
         self.output_module.run()
-        return(self.curr_output)
+        self.update_inv()
+        if timed:
+            elapsed = time.perf_counter() - start
+            if self.governor is not None:
+                self.governor.update(elapsed, n_frames)
+            if self.metrics is not None:
+                self.metrics.update(elapsed, n_frames)
+        return(out)
+        
+    def run_ops(self):
+        """
+        Runs the operators, in the order given by the algorithm.
+        
+        If oversample is more than 1, the operators run for oversample times
+        as many samples as the block (at op_fs), so that heavily modulated 
+        operators alias less. Then, only the operators whose output leaves 
+        the operators (into a delay line, generator or output module) are 
+        brought back down to fs, each by its own Decimator, before their 
+        delay lines are sampled. So everything after the operators, grains 
+        included, runs at fs as usual.
+        
+        Operators which can't be heard are idle (see update_activity()), and
+        are skipped: their outputs stay zeroed, and their delay lines are 
+        only told that the block was silent. An idle operator with a 
+        Decimator is still run (silently) until the end of the signal it 
+        had before has come out of the filter.
+        """
+        key = (self.algorithm, tuple(op.amp_amt == 0 for op in self.ops))
+        if key != self.activity_key:
+            self.update_activity()
+            self.activity_key = key
+        if self.op_cache is not None and self.op_cache.run(self.op_cache_key()):
+            for op in self.ops:
+                if op.has_delay_line:
+                    if op.active:
+                        op.delay_line.sample()
+                    else:
+                        op.delay_line.sample_silence()
+            return
+        if self.oversample == 1:
+            for i in range(len(self.ops)):
+                op = self.ops[self.algorithm.order[i]]
+                if op.active:
+                    op.run()
+                else:
+                    op.skip()
+                    if op.has_delay_line:
+                        op.delay_line.sample_silence()
+            return
+        n = self.block_len
+        running = [op.active or (op.decimator is not None and 
+                                 op.decimator.ringing()) for op in self.ops]
+        self.block_len = n*self.oversample
+        for i in range(len(self.ops)):
+            op = self.ops[self.algorithm.order[i]]
+            if running[self.algorithm.order[i]]:
+                op.pull()
+                op.process()
+            else:
+                op.skip()
+        self.block_len = n
+        for op, run in zip(self.ops, running):
+            if not run:
+                if op.decimator is not None:
+                    op.curr_output[:n] = 0
+                if op.has_delay_line:
+                    op.delay_line.sample_silence()
+                continue
+            if op.decimator is not None:
+                op.decimator.process(op.curr_output[:n*self.oversample],
+                                     op.curr_output[:n])
+            if op.has_delay_line:
+                op.delay_line.sample()
+                
+    def op_cache_key(self):
+        """
+        Everything about the operators that their output depends on, or None
+        if something is changing within the block (so it can't be cached).
+        
+        The key changes the moment curr_freq, amp_amt, integral_freq, or 
+        the master frequency (or pitch bend) of any operator changes, which 
+        makes the Operator_Cache drop its table. 
+        """
+        n = self.block_len
+        if self.master_pitch[0] != self.master_pitch[n - 1]:
+            return(None)
+        ops = []
+        for op in self.ops:
+            if (op.curr_freq[0] != op.curr_freq[n - 1] or 
+                    len(op.amp_connect) > 0 or len(op.pitch_connect) > 0):
+                return(None)
+            ops.append((int(op.curr_freq[0]), op.amp_amt, op.integral_freq,
+                        op.active))
+        return((self.algorithm, float(self.master_pitch[0]), tuple(ops)))
+        
+    def update_activity(self):
+        """
+        Works out which operators can be heard, and folds the rest out of 
+        the operator graph.
+        
+        An operator with amp_amt 0 only ever outputs zeros, and an operator
+        whose output only goes into idle operators is never heard. Going 
+        backwards through the algorithm's order (so every operator comes
+        after the ones it feeds), an operator is active if its amp_amt isn't
+        0 and its output is used outside of the operators, or by an active
+        operator. Active components then only pull from active operators, 
+        and idle operators have their outputs zeroed once, since they're not
+        run. Called by run_ops() whenever the routing changes or an amp_amt
+        goes to or from 0.
+        """
+        outside = self.outside_ops()
+        active = []
+        for i in reversed(self.algorithm.order):
+            op = self.ops[i]
+            used = (op.has_delay_line or op in outside or
+                    any(op in x.input_connect for x in active 
+                        if x.input_connect is not None))
+            if op.amp_amt != 0 and used:
+                active.append(op)
+        for op in self.ops:
+            if op in active:
+                op.active = True
+            elif op.active:
+                op.active = False
+                op.curr_output[:] = 0
+        for component in self.ops + [self.output_module]:
+            if component.input_connect is not None:
+                component.set_pull([x for x in component.input_connect 
+                                    if x in active or x not in self.ops])
+                
+    def outside_ops(self):
+        """ Operators whose outputs are used by anything but operators. """
+        outside = []
+        for component in [self.output_module] + self.gens + self.sources:
+            if component.input_connect is not None:
+                outside = outside + component.input_connect
+        return([op for op in self.ops if op in outside])
+        
+    def set_decimators(self):
+        """
+        Gives a Decimator to each operator whose output is used outside of
+        the operators, if oversampling. Called whenever the routing changes.
+        """
+        outside = self.outside_ops()
+        for op in self.ops:
+            op.decimator = None
+            if self.oversample > 1 and (op.has_delay_line or op in outside):
+                op.decimator = Decimator(self.oversample, dtype=self.dtype)
+        
+    def pitch_to_phase_inc(self, pitch):
+        """ Phase increments for an array of (fractional) MIDI pitches. """
+        return(2**((pitch-69)/12)*400/self.op_fs*2*np.pi)
+        
+    def handle_midi(self, status, data1, data2, offset):
+        """
+        Applies a single MIDI channel message, starting at sample offset.
+        
+        Arguments:
+            status (int) -- MIDI status byte (channel is ignored).
+            data1, data2 (int) -- MIDI data bytes.
+            offset (int) -- sample offset within the current buffer at which
+                the message takes effect.
+                
+        Note on/off set the master frequency (last note priority) and open or
+        close the gate, pitch bend shifts the master frequency by up to
+        PITCH_BEND_RANGE semitones, and control changes are passed on to the
+        function registered for that controller number in cc_handlers.
+        """
+        kind = status & 0xF0
+        if kind == 0x90 and data2 > 0:
+            if data1 in self.held_notes:
+                self.held_notes.remove(data1)
+            self.held_notes.append(data1)
+            self.curr_master_freq = data1
+            self.gate_level = 1
+            self.note_ons.append(offset)
+        elif kind == 0x80 or kind == 0x90:
+            if data1 in self.held_notes:
+                self.held_notes.remove(data1)
+            if len(self.held_notes) > 0:
+                self.curr_master_freq = self.held_notes[-1]
+            else:
+                self.gate_level = 0
+        elif kind == 0xE0:
+            bend = ((data2 << 7) | data1) - 8192
+            self.curr_pitch_bend = bend/8192*default.PITCH_BEND_RANGE
+        elif kind == 0xB0:
+            if data1 in self.cc_handlers:
+                self.cc_handlers[data1](data2)
+        self.step_controls(offset)
+        
+    def step_controls(self, offset):
+        """
+        Records that master_pitch, curr_gain, and gate take their current 
+        values from sample offset of the current block on.
+        
+        Both the control queue and the MIDI scheduler are dispatched before
+        the buffers are filled, so that a change from either is heard from 
+        the right sample of the very block it is dispatched in. The buffers
+        are filled afterwards, by fill_controls(), one step at a time.
+        """
+        self.control_steps.append((offset, self.curr_master_freq + self.curr_pitch_bend,
+                                   self.gate_level*self.curr_volume,
+                                   self.gate_level))
+        
+    def fill_controls(self):
+        """ Fills the per-sample control buffers from control_steps. """
+        n = self.block_len
+        for offset, pitch, gain, gate in self.control_steps:
+            self.master_pitch[offset*self.oversample:n*self.oversample] = pitch
+            self.curr_gain[offset:n] = gain
+            self.gate[offset:n] = gate
+        
+    def change_volume(self, value):
+        """ Default handler for CC 7 (channel volume). """
+        self.curr_volume = value/127
+
+    def load_sample(self, path, gens=None):
+        """
+        Makes generators take their grains from a WAV file instead.
+        
+        Arguments:
+            path (str) -- path to the WAV file, see Sample_Source.
+            gens (None, or list of Grain_Generators) -- generators to 
+                reconnect. If None, all of them.
+                
+        The generators are fused into one engine (see fuse_generators()), 
+        and the Sample_Source is returned. Swapping in a patch with a 
+        different routing connects the new generators to operators as usual.
+        """
+        source = Sample_Source(self, path)
+        if gens is None:
+            gens = self.gens
+        for gen in gens:
+            gen.input_connect = [source]
+            gen.set_pull()
+        self.algorithm.engines = fuse_generators(self.gens)
+        self.sources.append(source)
+        return(source)
+        
+    def route(self, modulator, op, target="amp"):
+        """
+        Routes an Envelope or LFO to an operator.
+        
+        Arguments:
+            modulator (Component) -- the Envelope or LFO.
+            op (Operator) -- operator to modulate.
+            target (str) -- "amp" to scale the operator's amplitude by the 
+                modulator's output, or "pitch" to shift its pitch by the 
+                modulator's output in semitones.
+        """
+        if target == "amp":
+            op.amp_connect.append(modulator)
+        elif target == "pitch":
+            op.pitch_connect.append(modulator)
+        else:
+            raise ValueError("Unknown target: " + str(target))
+        if modulator not in self.modulators:
+            modulator.set_pull()
+            self.modulators.append(modulator)
+        
+    def reseed(self, seed):
+        """ Restarts every generator's random numbers from seed. """
+        self.seed_sequence = np.random.SeedSequence(seed)
+        for gen in self.gens:
+            gen.seed(self.spawn_seed())
+            
+    def load_patch(self, prepared_patch):
+        """
+        Queues a Prepared_Patch to be swapped in before the next block.
+        
+        Arguments:
+            prepared_patch (Prepared_Patch object) -- see pm_synth_patch.py.
+        
+        All of the expensive work (building components, envelopes, and 
+        buffers) has already been done by the time a Prepared_Patch exists,
+        so this just hands over a reference, which is atomic. The audio thread
+        picks it up at the top of the next synthesize() call.
+        """
+        self.pending_patch = prepared_patch
+        
+    def swap_patch(self):
+        """ Swaps the pending patch into the synth. Only cheap assignments! """
+        prepared, self.pending_patch = self.pending_patch, None
+        if prepared.ops is not None:
+            # Keep the phase of operators that survive the swap to avoid clicks
+            for old_op, new_op in zip(self.ops, prepared.ops):
+                new_op.phase_delaylet[0] = old_op.phase_delaylet[0]
+            self.ops = prepared.ops
+            self.gens = prepared.gens
+            self.output_module = prepared.output_module
+            self.algorithm = prepared.algorithm
+            self.n_op = len(self.ops)
+            self.n_gen = len(self.gens)
+            self.set_decimators()
+        self.curr_master_freq = prepared.master_freq
+        for op, params in zip(self.ops, prepared.op_params):
+            op.curr_freq = params["curr_freq"]
+            op.amp_amt = params["amp_amt"]
+            op.integral_freq = params["integral_freq"]
+        for gen, params, envelope in zip(self.gens, prepared.gen_params,
+                                         prepared.gen_envelopes):
+            gen.envelope = envelope
+            for key, value in params.items():
+                setattr(gen, key, value)
         
         
 # ----- ALGORITHMS -----
@@ -114,19 +645,31 @@ class Algorithm(object):
     generators, and output modules. Each child class of this parent class 
     is a specific implementation of an algorithm. Each child class implements
     a custom run_wires() method, which is called by the universal implement()
-    method. 
+    method. implement() then fuses generators which read from the same delay
+    line into one Grain_Engine, see fuse_generators().
+    
+    Each child class also says how many operators it wires (n_op), and how
+    many generators it needs at least (min_gen), so that patches can be
+    checked before they are built.
     
     TODO -- clean up/organize algorithms
     TOOD -- add better doc strings
     """
+    uses_gens = False
+    n_op = 2
+    min_gen = 0
+    
     def __init__(self, ops=None, gens=None, output_module=None):
         self.ops = ops
         self.gens = gens
         self.output_module = output_module
         self.order = None
+        self.engines = []
         
     def implement(self):
         self.run_wires()
+        if self.gens is not None:
+            self.engines = fuse_generators(self.gens)
         
 
 class a1_2op(Algorithm):
@@ -145,6 +688,9 @@ class a1_2op(Algorithm):
 
         
 class a1_2op_1gen(Algorithm):
+    uses_gens = True
+    min_gen = 1
+    
     def __init__(self, ops, gens, output_module):
         Algorithm.__init__(self, ops=ops, gens=gens,
                            output_module=output_module)
@@ -164,6 +710,9 @@ class a1_2op_1gen(Algorithm):
         
         
 class a1_2op_Xgen(Algorithm):
+    uses_gens = True
+    min_gen = 1
+    
     def __init__(self, ops, gens, output_module):
         Algorithm.__init__(self, ops=ops, gens=gens,
                            output_module=output_module)
@@ -184,6 +733,7 @@ class a1_2op_Xgen(Algorithm):
         
 
 class a1_6op(Algorithm):
+    n_op = 6
     
     def __init__(self, ops, output_module):
         Algorithm.__init__(self, ops=ops, output_module=output_module)
@@ -196,9 +746,15 @@ class a1_6op(Algorithm):
                                             self.ops[3],
                                             self.ops[5]]
         self.order = [0, 2, 4, 1, 3, 5]
+        
+        [op.set_pull() for op in self.ops]
+        self.output_module.set_pull()
 
 
 class a2_6op_1gen(Algorithm):
+    uses_gens = True
+    n_op = 6
+    min_gen = 1
     
     def __init__(self, ops, gens, output_module):
         Algorithm.__init__(self, ops=ops, gens=gens,
@@ -219,6 +775,7 @@ class a2_6op_1gen(Algorithm):
 
 
 class a2_6op(Algorithm):
+    n_op = 6
     
     def __init__(self, ops, output_module):
         Algorithm.__init__(self, ops=ops, output_module=output_module)
@@ -230,6 +787,21 @@ class a2_6op(Algorithm):
         self.output_module.input_connect = [self.ops[0]]
         self.order = [5, 4, 3, 2, 1, 0]
         
+        [op.set_pull() for op in self.ops]
+        self.output_module.set_pull()
+
+
+ALGORITHMS = {algorithm.__name__: algorithm for algorithm in 
+              [a1_2op, a1_2op_1gen, a1_2op_Xgen, a1_6op, a2_6op_1gen, a2_6op]}
+
+
+def make_algorithm(name, ops, gens, output_module):
+    """ Builds the Algorithm called name, passing gens only if it uses any. """
+    algorithm = ALGORITHMS[name]
+    if algorithm.uses_gens:
+        return(algorithm(ops, gens, output_module))
+    return(algorithm(ops, output_module))
+        
 
 # ----- COMPONENTS -----
 
@@ -242,60 +814,83 @@ class Component(object):
         master (Phase_Mod_Synth object) -- master synth object, allows for
             reference to top-level synthesis parameters if necessary.
         input_connect (None, or list of Component(s)) -- see below
+        n_channels (None, or int) -- if None, the Component is mono and its
+            buffers are 1-D. Otherwise, its buffers have n_channels rows.
         
     Attributes:
-        curr_input (list) -- input buffer.
-        curr_output (list) -- output buffer.
+        curr_input (array) -- input buffer.
+        curr_output (array) -- output buffer.
         has_delay_line (boolean) -- whether or not Component has delay line.
         delay_line (None, or Delay_Line) -- contains delay line.
         pull (None) -- replaced by a pull() method when Algorithm is run.
+        pull_connect (None, or list) -- the Components pull() actually 
+            pulls from, see set_pull().
         
     A Component is a single audio processing unit, like an oscillator, filter,
     or grain generator. Every component has an input and output buffer, whose
-    lengths are determined by BUFFER_LEN in pm_synth_defaults.py. All
+    lengths are determined by MAX_BLOCK_LEN in pm_synth_defaults.py, of which
+    only the first master.block_len samples are used in each block, and 
+    whose type is master.dtype. All
     components also use the input_connect system. When a component is 
     initialized, other components can be connected by passing them inside a
     list to the component's input_connect argument. Then, when the component is
     run using its run() method, the component will call on its pull() method 
     to fill its input buffer with the output(s) of the components in its 
     input_connect. This allows for a perpetuation of the signal through 
-    components. 
+    components. A mono output pulled into a multichannel input is copied to
+    every channel.
     """    
-    def __init__(self, master, input_connect=None):
+    def __init__(self, master, input_connect=None, n_channels=None):
         self.master = master
-        self.curr_input = [0]*default.BUFFER_LEN
-        self.curr_output = [0]*default.BUFFER_LEN
+        if n_channels is None:
+            shape = default.MAX_BLOCK_LEN
+        else:
+            shape = (n_channels, default.MAX_BLOCK_LEN)
+        self.curr_input = np.zeros(shape, dtype=master.dtype)
+        self.curr_output = np.zeros(shape, dtype=master.dtype)
         self.input_connect = input_connect
         self.has_delay_line = False
         self.delay_line = None
         self.pull = None
+        self.pull_connect = None
     
     def pull_none(self):
         """ Pull() method if input is None. """
-        self.curr_input = [0]*default.BUFFER_LEN
+        self.curr_input[..., :self.master.block_len] = 0
         
     def pull_one(self):
         """ Pull() method if input is len 1. """
-        self.curr_input[:] = self.input_connect[0].curr_output[:]
+        n = self.master.block_len
+        self.curr_input[..., :n] = self.pull_connect[0].curr_output[..., :n]
 
     def pull_many(self):
         """ Pull() method if input len > 1. """
-        inputs = [x.curr_output for x in self.input_connect]
-        self.curr_input[:] = [sum(x) for x in zip(*inputs)]
+        n = self.master.block_len
+        self.curr_input[..., :n] = self.pull_connect[0].curr_output[..., :n]
+        for x in self.pull_connect[1:]:
+            self.curr_input[..., :n] += x.curr_output[..., :n]
             
-    def set_pull(self):
+    def set_pull(self, connect=None):
         """
         Sets the proper pull() method for this Component.
         
+        Arguments:
+            connect (None, or list of Component(s)) -- Components to pull 
+                from. If None, the input_connect. The synth passes only the
+                active ones, see Phase_Mod_Synth.update_activity().
+        
         pull() methods come in three flavors - none, one, and many, for,
         respectively, no, one, and more than one Component in the
         input_connect. This assigns the correct method to this Component's
         pull(). More efficient than running a check every time! Should be
         called inside of this synth's Algorithm's run_wires() method. 
         """
-        if self.input_connect == None:
+        if connect is None:
+            connect = self.input_connect
+        self.pull_connect = connect
+        if connect == None or len(connect) == 0:
             self.pull = self.pull_none
-        elif len(self.input_connect) == 1:
+        elif len(connect) == 1:
             self.pull = self.pull_one
         else:
             self.pull = self.pull_many
@@ -321,9 +916,16 @@ class Component(object):
         
         Arguments:
             delay_len (int) -- length of delay line in samples.
+            
+        If the synth keeps its delay lines in files (see Synthesizer doc
+        string), the delay line is at least LONG_DELAY_LEN long, and lives in
+        a file in master.delay_dir.
         """
+        file_dir = self.master.delay_dir
+        if file_dir is not None:
+            delay_len = max(delay_len, default.LONG_DELAY_LEN)
         self.delay_line = Delay_Line(master=self.master, input_connect=[self],
-                                     delay_len=delay_len)
+                                     delay_len=delay_len, file_dir=file_dir)
         
     def process(self):
         """ Should be filled in by the child class definition. """
@@ -341,11 +943,11 @@ class Operator(Component):
         input_connect -- see Component doc string.
         
     Attributes:
-        curr_freq (list) -- buffer containing oscillator input frequency values 
+        curr_freq (array) -- buffer containing oscillator input frequency values 
             for each sample in the buffer.
-        curr_phase (list) -- buffer containing phase values for each sample
+        curr_phase (array) -- buffer containing phase values for each sample
             in the buffer.
-        phase_inc (list) -- buffer containing phase increments derived from
+        phase_inc (array) -- buffer containing phase increments derived from
             curr_freq for each sample in the buffer.
         amp_amt (float) -- scales the amplitude of the output wave on a scale
             of 0 to 1.
@@ -359,24 +961,54 @@ class Operator(Component):
         number (int) -- unique ID number
         phase_delaylet (list, len 1) -- used to store the final curr_phase
             value, which is needed in each loop of processing. 
-        
-    An Operator is simply a single cosine wave.
+        decimator (None, or Decimator) -- set by the synth if the operator
+            is oversampled, see Phase_Mod_Synth.run_ops().
+        amp_connect (list) -- Components whose outputs scale the amplitude,
+            see Phase_Mod_Synth.route().
+        pitch_connect (list) -- Components whose outputs (in semitones) 
+            shift the frequency, see Phase_Mod_Synth.route().
+        active (boolean) -- if False, the operator can't be heard and isn't
+            run, see Phase_Mod_Synth.update_activity().
+        
+    An Operator is simply a single cosine wave. curr_phase and phase_inc are
+    always float64, whatever master.dtype is, so that phase doesn't drift.
+    All of an Operator's buffers are master.oversample times as long as 
+    other components' buffers.
     """
     def __init__(self, master, number, init_freq=0, input_connect=None):
         Component.__init__(self, master, input_connect)
-        self.curr_freq = [init_freq]*default.BUFFER_LEN
-        self.curr_phase = [0]*default.BUFFER_LEN
-        self.phase_inc = [0]*default.BUFFER_LEN
+        buffer_len = default.MAX_BLOCK_LEN*master.oversample
+        self.curr_input = np.zeros(buffer_len, dtype=master.dtype)
+        self.curr_output = np.zeros(buffer_len, dtype=master.dtype)
+        self.curr_freq = np.full(buffer_len, init_freq, dtype=int)
+        self.curr_phase = np.zeros(buffer_len)
+        self.phase_inc = np.zeros(buffer_len)
         self.amp_amt = 0
         self.integral_freq = False
         self.number = number
         self.phase_delaylet = [0]
+        self.decimator = None
+        self.amp_connect = []
+        self.pitch_connect = []
+        self.active = True
         
     def process(self):
         """ process() method for Operator objects. """
         self.calculate_phase_inc()
         self.render()
     
+    def skip(self):
+        """ 
+        Stands in for run() while the operator is idle.
+        
+        Nothing is rendered, but the phase still moves on by the block's 
+        phase increments, so that the operator is in tune with the others 
+        when it becomes active again.
+        """
+        n = self.master.block_len
+        self.calculate_phase_inc()
+        self.phase_delaylet[0] = (self.phase_delaylet[0] + np.sum(self.phase_inc[:n])) % (2*np.pi)
+    
     def calculate_phase_inc(self):
         """
         Calculates phase increment for Operator.
@@ -385,27 +1017,75 @@ class Operator(Component):
         corresponding phase increment to the current frequency. If
         integral_freq is True, the current frequency value is treated as an 
         integer multiplier of the current master frequency, and the phase
-        increment is calculated accordingly. 
+        increment is calculated accordingly. Anything in pitch_connect then
+        shifts the pitch.
+        """
+        n = self.master.block_len
+        if len(self.pitch_connect) > 0:
+            if self.integral_freq == False:
+                pitch = self.curr_freq[:n].astype(float)
+            else:
+                pitch = self.master.master_pitch[:n] + self.curr_freq[:n]*12
+            for modulator in self.pitch_connect:
+                pitch += self.modulation(modulator)
+            self.phase_inc[:n] = self.master.pitch_to_phase_inc(pitch)
+        elif self.integral_freq == False:
+            self.phase_inc[:n] = self.master.phase_incs[self.curr_freq[:n]]
+        else:
+            self.phase_inc[:n] = self.master.pitch_to_phase_inc(self.master.master_pitch[:n] + self.curr_freq[:n]*12)
+            
+    def modulation(self, modulator):
+        """ 
+        A modulator's output for this block, at the operator's rate. 
+        
+        Modulators run at fs, so if the operators are oversampled, each 
+        modulator sample is simply held for oversample samples.
         """
-        if self.integral_freq == False:
-            self.phase_inc[:] = [self.master.phase_incs[x] for x in self.curr_freq][:]
-        if self.integral_freq == True:
-            self.phase_inc[:] = [self.master.phase_incs[self.master.curr_master_freq+(x*12)] for x in self.curr_freq][:]
+        m = self.master.oversample
+        n = self.master.block_len//m
+        if m == 1:
+            return(modulator.curr_output[:n])
+        return(np.repeat(modulator.curr_output[:n], m))
 
     def render(self):
         """
-        Loops through range(BUFFER_LEN), calculating phase.
-        
-        At each point in the phase buffer, calculates current phase based on
-        past phase, current phase increment, and the output of any Operators
-        connected to it through input_connect. Then, calculates the output of
-        each phase value with math.cos().
+        Calculates phase for the whole block, then the output.
+        
+        Each point in the phase buffer is the past phase plus the current phase
+        increment and the output of any Operators connected to it through 
+        input_connect, which is just a running sum (np.cumsum) starting from
+        the last phase of the previous block. The last phase is wrapped to 
+        [0, 2*pi) before being stored so that phase doesn't lose precision
+        over long renders. Then, calculates the output of each phase value 
+        with np.cos(), scaled by amp_amt and anything in amp_connect. If
+        master.lut_osc is set (see Load_Governor), master.cos_table is 
+        interpolated linearly instead. That is good to about 2e-8 (-150 dB)
+        and faster than np.cos() in long blocks, but slower in short ones, 
+        where the extra NumPy calls cost more than they save. The error is 
+        fed on to any operators this one modulates, and long chains of 
+        operators modulating each other make it grow, like any rounding 
+        error (see ENGINES in pm_synth_golden.py).
         """
-        self.curr_phase[0] = self.phase_delaylet[0] + self.phase_inc[0] + self.curr_input[0]
-        for j in range(1, int(default.BUFFER_LEN)):
-            self.curr_phase[j] = self.curr_phase[j-1] + self.phase_inc[j] + self.curr_input[j]
-        self.phase_delaylet[0] = self.curr_phase[-1]
-        self.curr_output[:] = [math.cos(x)*self.amp_amt for x in self.curr_phase][:]
+        n = self.master.block_len
+        phase = self.curr_phase[:n]
+        np.add(self.phase_inc[:n], self.curr_input[:n], out=phase)
+        np.cumsum(phase, out=phase)
+        phase += self.phase_delaylet[0]
+        self.phase_delaylet[0] = phase[-1] % (2*np.pi)
+        if self.master.lut_osc:
+            table = self.master.cos_table
+            position = phase*(len(table)/(2*np.pi))
+            index = np.floor(position).astype(np.int64)
+            position -= index
+            index &= len(table) - 1
+            np.take(table, index, out=self.curr_output[:n])
+            position *= self.master.cos_slopes[index]
+            self.curr_output[:n] += position
+        else:
+            np.cos(phase, out=self.curr_output[:n])
+        self.curr_output[:n] *= self.amp_amt
+        for modulator in self.amp_connect:
+            self.curr_output[:n] *= self.modulation(modulator)
 
     def set_integral_freq(self, boolean):
         self.integral_freq = boolean
@@ -415,20 +1095,189 @@ class Output(Component):
     """ 
     Output component.
     
-    Writes the output of whatever is connected to its input_connect to the 
-    synth-level output. Only this class should reference the master output.
+    Writes the output of whatever is connected to its input_connect, scaled
+    by the synth's curr_gain buffer, to the synth-level output (the synth's 
+    curr_target). Only this class should reference the master output. Has
+    one channel per output channel of the synth, so mono inputs (e.g. 
+    operators) play equally in every channel.
     """
     def __init__(self, master, input_connect=None):
+        Component.__init__(self, master, input_connect,
+                           n_channels=master.n_channels)
+        
+    def process(self):
+        n = self.master.block_len
+        np.multiply(self.curr_input[:, :n], self.master.curr_gain[:n], out=self.master.curr_target)
+        
+
+        
+class Sample_Source(Component):
+    """
+    Sample file source component, plays a WAV file on a loop.
+    
+    Arguments:
+        master -- see Component doc string.
+        path (str) -- path to a PCM (8, 16, or 32-bit) or float (32 or 
+            64-bit) WAV file, with any number of channels.
+        
+    Attributes:
+        delay_line (Sample_Line object) -- the file, read through the same
+            interface as a Delay_Line.
+        
+    A Sample_Source's output is the file (mixed down to mono), playing from
+    the start and looping forever, so it can be listened to like any other
+    Component. But mostly, it's there so that Grain_Generators can take 
+    grains out of recorded audio: its delay_line looks to a generator just
+    like an operator's delay line, except that the file is never overwritten,
+    so grains can lag anywhere up to the length of the file. The file is
+    memory-mapped and never decoded as a whole, see Sample_Line.
+    """
+    def __init__(self, master, path, input_connect=None):
         Component.__init__(self, master, input_connect)
+        self.delay_line = Sample_Line(master, input_connect=[self], path=path)
+        self.pull = self.pull_none
         
     def process(self):
-        self.master.curr_output[:] = self.curr_input[:]
+        n = self.master.block_len
+        self.curr_output[:n] = self.delay_line.read(self.delay_line.n_written, n)
         
-     
-#class LFO(Component):
-#    
-#    def __init__(self, master, input_connect=None):
-#        Component.__init__(self, master, input_connect)
+
+        
+class Envelope(Component):
+    """
+    Multi-stage rate/level envelope generator, ala DX7.
+    
+    Arguments:
+        master -- see Component doc string.
+        input_connect -- see Component doc string (not used).
+        
+    Attributes:
+        curr_rates (list, len 4) -- how fast each stage moves, in levels per
+            second (levels are 0 to 1, see curr_curve). A stage with rate 0
+            never ends.
+        curr_levels (list, len 4) -- level each stage moves to. 
+        curr_curve (str) -- "exponential" to move in dB (between 
+            ENV_FLOOR_DB and 0 dB, like a DX7), or "linear" to move in 
+            amplitude.
+        stage (int) -- current stage, see below.
+        level (float) -- level at the end of the last block, on the curve.
+        prev_gate (float) -- gate at the end of the last block.
+        
+    When a note starts, the envelope moves from wherever it is to level 1 at
+    rate 1, then to level 2 at rate 2, then to level 3 at rate 3, and holds 
+    there (stages 0 to 3). When the gate closes, it moves to level 4 at rate
+    4 and stays there (stages 4 and 5). 
+    
+    A block is filled in one go rather than sample by sample: the block is
+    split at the few samples where notes start or stop, and for each piece,
+    the times at which the envelope will reach each of its remaining stage
+    levels are worked out. Then np.interp() fills the whole piece between 
+    those breakpoints, and np.searchsorted() finds which stage the envelope
+    has got to by the end of it.
+    """
+    def __init__(self, master, input_connect=None):
+        Component.__init__(self, master, input_connect)
+        self.curr_rates = list(default.ENV_RATES)
+        self.curr_levels = list(default.ENV_LEVELS)
+        self.curr_curve = default.ENV_CURVE
+        self.stage = 5
+        self.level = self.curr_levels[3]
+        self.prev_gate = 0
+        self.curve = np.zeros(default.MAX_BLOCK_LEN)
+        
+    def process(self):
+        n = self.master.block_len
+        gate = self.master.gate[:n]
+        
+        # Split the block wherever the gate opens or closes, or a note starts
+        events = set((np.flatnonzero(gate[1:] != gate[:-1]) + 1).tolist())
+        if gate[0] != self.prev_gate:
+            events.add(0)
+        events.update(self.master.note_ons)
+        bounds = sorted(events | {0, n})
+        for a, b in zip(bounds[:-1], bounds[1:]):
+            if a in events:
+                if gate[a] > 0:
+                    self.stage = 0
+                else:
+                    self.stage = 4
+            self.fill(self.curve[a:b])
+        self.prev_gate = gate[n - 1]
+        
+        # Convert from the curve to amplitude
+        if self.curr_curve == "exponential":
+            db = (1 - self.curve[:n])*default.ENV_FLOOR_DB
+            self.curr_output[:n] = np.where(self.curve[:n] > 0, 10**(db/20), 0)
+        else:
+            self.curr_output[:n] = self.curve[:n]
+            
+    def fill(self, out):
+        """ Fills out with the envelope, from the current stage and level. """
+        if self.stage < 3:
+            stages = range(self.stage, 3)
+        elif self.stage == 4:
+            stages = [3]
+        else:
+            stages = []
+        times = [0]
+        levels = [self.level]
+        for stage in stages:
+            if self.curr_rates[stage] <= 0:
+                break
+            distance = abs(self.curr_levels[stage] - levels[-1])
+            times.append(times[-1] + distance/self.curr_rates[stage]*self.master.fs)
+            levels.append(self.curr_levels[stage])
+        out[:] = np.interp(np.arange(1, len(out) + 1), times, levels)
+        self.stage = self.stage + int(np.searchsorted(times[1:], len(out),
+                                                      side="right"))
+        self.level = out[-1]
+        
+        
+class LFO(Component):
+    """
+    Low frequency oscillator.
+    
+    Arguments:
+        master -- see Component doc string.
+        input_connect -- see Component doc string (not used).
+        
+    Attributes:
+        curr_freq (float) -- frequency in Hz.
+        curr_waveform (str) -- "sine", "triangle", "saw", or "square".
+        curr_depth (float) -- amount the output swings up and down.
+        curr_center (float) -- value the output swings around, e.g. 0 for
+            vibrato (in semitones) or 1 for tremolo.
+        key_sync (boolean) -- if True, the LFO restarts from the beginning of 
+            its cycle whenever a note starts.
+        phase (float) -- phase at the start of the next block, in cycles.
+    """
+    def __init__(self, master, input_connect=None):
+        Component.__init__(self, master, input_connect)
+        self.curr_freq = default.LFO_FREQ
+        self.curr_waveform = default.LFO_WAVEFORM
+        self.curr_depth = 1
+        self.curr_center = 0
+        self.key_sync = False
+        self.phase = 0
+        
+    def process(self):
+        n = self.master.block_len
+        inc = self.curr_freq/self.master.fs
+        phase = self.phase + inc*np.arange(n)
+        if self.key_sync:
+            for offset in self.master.note_ons:
+                phase[offset:] = inc*np.arange(n - offset)
+        self.phase = (phase[-1] + inc) % 1
+        phase %= 1
+        if self.curr_waveform == "sine":
+            wave = np.sin(2*np.pi*phase)
+        elif self.curr_waveform == "triangle":
+            wave = 1 - 4*np.abs(phase - 0.5)
+        elif self.curr_waveform == "saw":
+            wave = 2*phase - 1
+        else:
+            wave = np.where(phase < 0.5, 1, -1)
+        self.curr_output[:n] = self.curr_center + self.curr_depth*wave
         
         
 # ----- THE REALM OF GRAIN -----
@@ -441,133 +1290,806 @@ class Grain_Generator(Component):
     Arguments:
         master -- see Component doc string.
         input_connect -- see Component doc string.
+        seed (None, int, or SeedSequence) -- seed for this generator's random
+            numbers. If None, a seed is spawned from master, see 
+            Synthesizer.spawn_seed().
         
     Attributes:
-        progeny (list) -- list of generated grains that are still being
-            processed.
+        n_grains (int) -- number of this generator's grains that are still 
+            being processed.
+        engine (Grain_Engine object) -- holds and mixes this generator's 
+            grains, possibly along with other generators' grains.
+        gen_id (int) -- this generator's index in engine.gens.
         dur_since_last_birth (int) -- time since last generated grain, in
             samples.
         curr_period (int) -- duration between grain generations in samples.
         curr_dur (int) -- duration of generated grains in samples.
         curr_lag (int) -- how far back into the delay line to grab grains from
             in samples.
+        curr_rate (float) -- playback rate of generated grains, where 1 plays
+            the delay line back at its original pitch, 2 an octave up, etc.
+        curr_reverse_prob (float) -- probability (0 to 1) that a generated 
+            grain plays its content backwards.
         curr_XXXX_jitter -- amount of random jitter to be applied to curr_XXXX
-            in samples. Works for period and lag, but not dur yet!
+            in samples (in semitones, up or down, for rate). 
+        curr_amp_jitter (float) -- each grain's amplitude is 1 minus a random
+            amount up to curr_amp_jitter (0 to 1).
+        curr_pan (float) -- pan position of generated grains, from -1 (first
+            channel) to 1 (last channel).
+        curr_pan_jitter (float) -- random spread of pan positions around
+            curr_pan, up or down.
+        rng (numpy Generator) -- this generator's random number generator.
+        random_batch (array) -- RANDOM_BATCH_LEN pre-drawn uniform random 
+            numbers for each of RANDOM_KEYS, one column per grain.
+        interpolation (str) -- "linear" or "hermite", how the delay line is
+            read between samples when grains play back at other rates.
         envelope_generator (function) -- really should be a method... what was
             I doing?
+        envelope (array) -- window table, ENVELOPE_TABLE_LEN samples long,
+            which is stretched to the duration of each grain.
             
     Generates grains, which are tiny snippets of audio, by sampling audio
     from the delay_line on the single component in its input_connect. 
+    
+    The generator only decides when grains are born and what they sound 
+    like. The grains themselves live in its engine, see Grain_Engine. On its
+    own, a generator has an engine to itself, but when an Algorithm is 
+    implemented, all generators reading from the same delay line are given 
+    one shared engine, which mixes all of their grains at once.
+    
+    The generator's output has one row per output channel of the synth. 
+    Each grain is panned across the channels with constant power, see 
+    pan_gains().
+    
+    Random numbers aren't drawn one at a time. Instead, a batch of them is
+    drawn from rng up front and each new grain takes the next column, so 
+    there's one NumPy call every RANDOM_BATCH_LEN grains, and a generator 
+    with a fixed seed always makes the same grains.
     """
-    def __init__(self, master, input_connect=None):
-        Component.__init__(self, master, input_connect)
+    RANDOM_KEYS = ["period", "lag", "dur", "amp", "rate", "reverse", "pan"]
+    
+    def __init__(self, master, input_connect=None, seed=None):
+        Component.__init__(self, master, input_connect,
+                           n_channels=master.n_channels)
         self.master = master
-        self.progeny = []
         self.dur_since_last_birth = 0
         self.curr_period = default.CURR_GEN_PERIOD
         self.curr_dur = default.CURR_GRAIN_LEN
         self.curr_lag = default.CURR_GEN_LAG
+        self.curr_rate = default.CURR_GRAIN_RATE
+        self.curr_reverse_prob = default.CURR_GRAIN_REVERSE_PROB
         self.curr_period_jitter = default.CURR_GEN_PERIOD_JITTER
         self.curr_dur_jitter = default.CURR_GRAIN_LEN_JITTER
         self.curr_lag_jitter = default.CURR_LAG_JITTER
+        self.curr_rate_jitter = default.CURR_GRAIN_RATE_JITTER
+        self.curr_amp_jitter = default.CURR_GRAIN_AMP_JITTER
+        self.curr_pan = default.CURR_GRAIN_PAN
+        self.curr_pan_jitter = default.CURR_GRAIN_PAN_JITTER
+        self.interpolation = default.GRAIN_INTERP
         
         def generate_envelope(length):
             """ Generates hamming windowing function. """
-            envelope = list(np.hamming(length))
+            envelope = np.hamming(length)
             return(envelope)
         self.envelope_generator = generate_envelope
+        self.envelope = self.envelope_generator(default.ENVELOPE_TABLE_LEN).astype(master.dtype)
+        
+        # Grains
+        self.n_grains = 0
+        self.engine = Grain_Engine(master, [self])
+        self.gen_id = 0
+        
+        # Random numbers
+        if seed is None:
+            seed = master.spawn_seed()
+        self.seed(seed)
+        
+    def seed(self, seed):
+        """ Restarts this generator's random numbers from seed. """
+        self.rng = np.random.default_rng(seed)
+        self.random_batch = np.zeros((len(self.RANDOM_KEYS),
+                                      default.RANDOM_BATCH_LEN))
+        self.random_index = default.RANDOM_BATCH_LEN
+        self.next_draw = self.draw()
+        
+    def draw(self):
+        """ 
+        Returns the next column of random_batch as a dict of uniform random
+        numbers (0 to 1) keyed by RANDOM_KEYS, drawing a new batch if needed.
+        """
+        if self.random_index == default.RANDOM_BATCH_LEN:
+            self.rng.random(out=self.random_batch)
+            self.random_index = 0
+        column = self.random_batch[:, self.random_index].tolist()
+        self.random_index = self.random_index + 1
+        return(dict(zip(self.RANDOM_KEYS, column)))
 
-    def generate_grain(self):
-        """ Generates a single grain. """
-        if len(self.progeny) < default.MAX_GRAINS_PER_GEN:
-            if self.curr_lag_jitter != 0:
-                lag = self.curr_lag + random.randrange(0, self.curr_lag_jitter)
+    def generate_grain(self, offset=0):
+        """ 
+        Generates a single grain, born offset samples into the current block.
+        
+        Grains don't copy anything out of the delay line when they are born.
+        Instead, each grain just remembers the position in the delay line
+        where its content starts and reads from there as it plays. The 
+        delay line already holds the whole current block, so the position is
+        measured back from the grain's birth sample rather than from the end
+        of the block. That way grains keep their timing no matter how long 
+        the blocks are. 
+        
+        A grain of duration dur at rate r reads dur*r samples of the delay 
+        line, which end lag samples before its birth. Forwards grains start
+        at the beginning of that stretch, reversed grains at the end. The lag
+        is limited so that the grain's content can't be overwritten before 
+        the grain is done playing.
+        
+        The grain's random numbers are next_draw, which was drawn when the
+        previous grain was born, since it also set the period until this one.
+        """
+        if self.n_grains < self.master.max_grains:
+            u = self.next_draw
+            self.next_draw = self.draw()
+            lag = self.curr_lag + int(u["lag"]*self.curr_lag_jitter)
+            dur = self.curr_dur + int(u["dur"]*self.curr_dur_jitter)
+            amp = 1 - u["amp"]*self.curr_amp_jitter
+            rate = self.curr_rate*2**((2*u["rate"] - 1)*self.curr_rate_jitter/12)
+            reverse = u["reverse"] < self.curr_reverse_prob
+            pan = self.curr_pan + (2*u["pan"] - 1)*self.curr_pan_jitter
+            gains = pan_gains(pan, self.master.n_channels)
+            span = dur*rate
+            delay_line = self.input_connect[0].delay_line
+            if reverse:
+                # Reversed grains start right at the lag, and Hermite reads
+                # one sample past the one it's interpolating
+                if self.interpolation == "hermite":
+                    lag = max(lag, 1)
+                lag = min(lag, delay_line.max_lag(int(np.ceil(dur + span))))
             else:
-                lag = self.curr_lag
-            content = self.input_connect[0].delay_line.get_segment(lag=lag,
-                                                            duration=self.curr_dur)
-            envelope = self.envelope_generator(self.curr_dur)
-            self.progeny.append(Grain(generator=self, content=content, 
-                                      envelope=envelope, id_number = len(self.progeny)))
+                lag = min(lag, delay_line.max_lag(int(np.ceil(max(dur, span)))))
+            birth = delay_line.n_written - self.master.block_len + offset
+            if reverse:
+                self.engine.add_grain(self.gen_id, birth - lag, -rate, dur,
+                                      amp, gains, offset)
+            else:
+                self.engine.add_grain(self.gen_id, birth - lag - span, rate,
+                                      dur, amp, gains, offset)
+            self.n_grains = self.n_grains + 1
             self.dur_since_last_birth = 0
         
     def process(self):
         """ 
         process() method for Generator objects.
         
-        Calculates its own output as the sum of all of its progeny grains' 
-        outputs. Then, if the max number of grains has not been exceeded, it
-        checks if its an appropriate time to generate a grain.
+        First, works out at which samples of this block grains are due to be
+        born (a grain is born once more than a period has passed since the 
+        last one, where each period gets its own jitter) and generates them,
+        until the max number of grains is reached. Then, tells its engine that
+        it's ready. Once every generator sharing the engine is ready, the 
+        engine mixes all of their grains, including grains born partway 
+        through this block, into each generator's output, see 
+        Grain_Engine.mix().
         """
-        if len(self.progeny) > 0:
-            progeny_outputs = [grain.run() for grain in self.progeny]
-            self.curr_output[:] = [sum(output) for output in zip(*progeny_outputs)]
+        n = self.master.block_len
+        last_birth = None
+        while self.n_grains < self.master.max_grains:
+            period = self.curr_period + int(self.next_draw["period"]*self.curr_period_jitter)
+            offset = max(period - self.dur_since_last_birth, 0)
+            if last_birth is not None:
+                offset = last_birth + period + 1
+            if offset >= n:
+                break
+            self.generate_grain(offset=offset)
+            last_birth = offset
+        if last_birth is None:
+            self.dur_since_last_birth = self.dur_since_last_birth + n
         else:
-            self.curr_output[:] = [0]*default.BUFFER_LEN
-        for i in range(default.BUFFER_LEN):
-            self.dur_since_last_birth = self.dur_since_last_birth + 1
-            if self.curr_period_jitter != 0:
-                period = self.curr_period + random.randrange(0, self.curr_period_jitter)
-            else:
-                period = self.curr_period
-            if self.dur_since_last_birth > period:
-                self.generate_grain() 
+            self.dur_since_last_birth = n - 1 - last_birth
+        self.engine.ready()
         
-    def notify_death(self, id_number):
-        """ Notifies Generator that a grain has come to its final sample. """
-        self.progeny.pop(id_number)
-        for i in range(len(self.progeny)):
-            self.progeny[i].id_number = i
         
-            
-class Grain(object):
+class Grain_Engine(object):
     """
-    A grain.
+    Grain engine, holds and mixes the grains of one or more generators.
     
     Arguments:
-        generator (Generator object) -- parent Generator.
-        content (list) -- audio content of grain.
-        envelope (list) -- envelope values (len should match len of content).
-        id_number (int) -- unique ID number for grain.
-        
+        master -- although this is not a Component, see Component doc string.
+        gens (list of Grain_Generator objects) -- generators whose grains
+            this engine holds. They must all read from the same delay line.
+    
     Attributes:
-        curr_output (list) -- output buffer
-        curr_index (int) -- current "playback" position, used to keep track
-            of how long the grain has been playing back and, therefore, when
-            it needs to die.
-        duration (int) -- length of content in samples.
-    """
-    def __init__(self, generator, content, envelope, id_number):
-        self.generator = generator
-        self.content = content
-        self.duration = len(content)
-        self.envelope = envelope
-        self.curr_output = [0]*default.BUFFER_LEN
-        self.curr_index = 0
-        self.id_number = id_number
+        n_grains (int) -- number of grains that are still being processed.
+        grain_XXXX (array) -- the grain pool, see below.
+        envelopes (array) -- each generator's envelope table, one per row.
+        
+    Grains aren't objects. Instead, all of the grains live in a pool of 
+    arrays, with one entry per grain: grain_gen (index of the generator the
+    grain belongs to), grain_anchor (position in the delay line, see 
+    Delay_Line.read(), that the grain starts reading from), grain_rate
+    (negative if reversed), grain_dur, grain_amp, grain_gain (the grain's
+    gain in each output channel, one row per channel), grain_index (how many
+    samples the grain has played), and grain_start (sample in the current 
+    block at which the grain starts playing). grain_anchor and grain_rate
+    are float64, since delay line positions keep growing, and everything 
+    else that holds audio is master.dtype. Living grains are always kept
+    at the front of the pool. That way, the whole pool can be mixed at once
+    with a handful of NumPy operations, however many grains (and 
+    generators) there are.
+    """
+    def __init__(self, master, gens):
+        self.master = master
+        self.gens = gens
+        self.n_ready = 0
+        self.envelopes = np.zeros((len(gens), default.ENVELOPE_TABLE_LEN),
+                                  dtype=master.dtype)
+        
+        # Grain pool
+        pool_len = len(gens)*default.MAX_GRAINS_PER_GEN
+        self.n_grains = 0
+        self.grain_gen = np.zeros(pool_len, dtype=int)
+        self.grain_anchor = np.zeros(pool_len)
+        self.grain_rate = np.zeros(pool_len)
+        self.grain_dur = np.zeros(pool_len, dtype=int)
+        self.grain_amp = np.zeros(pool_len, dtype=master.dtype)
+        self.grain_gain = np.zeros((master.n_channels, pool_len),
+                                   dtype=master.dtype)
+        self.grain_index = np.zeros(pool_len, dtype=int)
+        self.grain_start = np.zeros(pool_len, dtype=int)
+        
+    def add_grain(self, gen_id, anchor, rate, dur, amp, gains, offset):
+        """ Adds a grain to the pool, see doc string above. """
+        i = self.n_grains
+        self.grain_gen[i] = gen_id
+        self.grain_anchor[i] = anchor
+        self.grain_rate[i] = rate
+        self.grain_dur[i] = dur
+        self.grain_amp[i] = amp
+        self.grain_gain[:, i] = gains
+        self.grain_index[i] = 0
+        self.grain_start[i] = offset
+        self.n_grains = i + 1
+        
+    def ready(self):
+        """ Called by each generator once its block's grains are born. """
+        self.n_ready = self.n_ready + 1
+        if self.n_ready == len(self.gens):
+            self.n_ready = 0
+            self.mix()
+        
+    def mix(self):
+        """
+        Mixes every grain in the pool into its generator's output, all at 
+        once.
+        
+        Works out which samples of this block each grain covers, and lays
+        them all end to end in flat arrays: owner (which grain), j (how far
+        into the grain) and offset (where in the block). From those, the 
+        delay line is read at every grain's fractional position in a single
+        gather, the envelope is looked up the same way, and the results are
+        scaled by each grain's channel gains and summed with np.bincount into
+        one row per generator and channel, at index 
+        (gen*n_channels + channel)*block_len + offset. So the cost is 
+        proportional to the number of grain samples actually playing, and 
+        doesn't involve a Python loop over grains. Finally, grains which have
+        finished are dropped from the pool.
+        """
+        n = self.master.block_len
+        n_gens = len(self.gens)
+        n_channels = self.master.n_channels
+        g = self.n_grains
+        if g == 0:
+            for gen in self.gens:
+                gen.curr_output[:, :n] = 0
+            return
+        start = self.grain_start[:g]
+        index = self.grain_index[:g]
+        dur = self.grain_dur[:g]
+        count = np.minimum(n - start, dur - index)
+        if self.silent(index, count):
+            for gen in self.gens:
+                gen.curr_output[:, :n] = 0
+            self.advance(count)
+            return
+        ends = np.cumsum(count)
+        owner = np.repeat(np.arange(g), count)
+        k = np.arange(ends[-1]) - np.repeat(ends - count, count)
+        j = index[owner] + k
+        gen = self.grain_gen[owner]
+        positions = self.grain_anchor[owner] + j*self.grain_rate[owner]
+        content = self.read(positions, gen)
+        for i in range(n_gens):
+            self.envelopes[i] = self.gens[i].envelope
+        table_len = self.envelopes.shape[1]
+        table_positions = j*((table_len - 1)/np.maximum(dur[owner] - 1, 1))
+        envelope = lookup_table(self.envelopes.reshape(-1),
+                                gen*table_len + table_positions)
+        weights = content*envelope*self.grain_amp[owner]
+        panned = self.grain_gain[:, owner]*weights
+        rows = gen*n_channels + np.arange(n_channels)[:, np.newaxis]
+        mixed = np.bincount((rows*n + start[owner] + k).reshape(-1),
+                            weights=panned.reshape(-1),
+                            minlength=n_gens*n_channels*n)
+        mixed = mixed.reshape(n_gens, n_channels, n)
+        for i in range(n_gens):
+            self.gens[i].curr_output[:, :n] = mixed[i]
+        self.advance(count)
+        
+    def advance(self, count):
+        """ Advances grains by count samples and drops the finished ones. """
+        g = self.n_grains
+        index = self.grain_index[:g]
+        index += count
+        self.grain_start[:g] = 0
+        alive = np.flatnonzero(index < self.grain_dur[:g])
+        if len(alive) < g:
+            self.keep(alive)
+            
+    def steal(self, limit):
+        """
+        Drops the quietest grains of any generator with more than limit 
+        grains, and returns how many were dropped.
         
-    def run(self):
+        How loud a grain is right now is its amp times its envelope where 
+        it has got to. Sorting by generator and then by loudness puts each
+        generator's grains in a run, loudest first, so the ones to keep are
+        the first limit of each run.
         """
-        Processes grain. 
+        g = self.n_grains
+        if g == 0:
+            return(0)
+        gen = self.grain_gen[:g]
+        table_len = self.envelopes.shape[1]
+        position = self.grain_index[:g]*((table_len - 1)/np.maximum(self.grain_dur[:g] - 1, 1))
+        envelope = lookup_table(self.envelopes.reshape(-1),
+                                gen*table_len + np.minimum(position, table_len - 1))
+        loudness = self.grain_amp[:g]*envelope
+        order = np.lexsort((-loudness, gen))
+        first = np.searchsorted(gen[order], np.arange(len(self.gens)))
+        rank = np.arange(g) - first[gen[order]]
+        keep = np.sort(order[rank < limit])
+        if len(keep) == g:
+            return(0)
+        self.keep(keep)
+        return(g - len(keep))
+        
+    def keep(self, alive):
+        """ Keeps only the grains at indices alive, at the pool's front. """
+        n_gens = len(self.gens)
+        self.n_grains = len(alive)
+        for pool in [self.grain_gen, self.grain_anchor, self.grain_rate,
+                     self.grain_dur, self.grain_amp, self.grain_index,
+                     self.grain_start]:
+            pool[:len(alive)] = pool[alive]
+        self.grain_gain[:, :len(alive)] = self.grain_gain[:, alive]
+        counts = np.bincount(self.grain_gen[:len(alive)], minlength=n_gens)
+        for i in range(n_gens):
+            self.gens[i].n_grains = int(counts[i])
+            
+    def silent(self, index, count):
+        """
+        Whether every grain only reads silence this block, so the mix can be
+        skipped.
         
-        If curr_index has reached duration, then the grain self-terminates
-        using its kill() method. Otherwise, it outputs its content.
+        That's the case if the delay line has been silent (see 
+        Delay_Line.sample_silence()) for longer than it is long, or if every
+        position any grain reads this block (give or take a couple of 
+        samples, for interpolation) was written while it was silent.
         """
-        self.curr_output = [0]*default.BUFFER_LEN
-        for i in range(default.BUFFER_LEN):
-            if self.curr_index == self.duration-1:
-                self.kill()
-                return(self.curr_output)
-            self.curr_output[i] = self.content[self.curr_index]
-            self.curr_index = self.curr_index + 1
-        return(self.curr_output)
+        delay_line = self.gens[0].input_connect[0].delay_line
+        if delay_line.n_silent == 0:
+            return(False)
+        if delay_line.n_silent >= len(delay_line):
+            return(True)
+        g = self.n_grains
+        anchor = self.grain_anchor[:g]
+        rate = self.grain_rate[:g]
+        first = anchor + index*rate
+        last = anchor + (index + count - 1)*rate
+        lowest = min(np.min(first), np.min(last)) - 2
+        highest = max(np.max(first), np.max(last)) + 2
+        return(lowest >= delay_line.n_written - delay_line.n_silent and
+               highest < delay_line.n_written)
+        
+    def read(self, positions, gen):
+        """ 
+        Reads the delay line at positions, using each grain's generator's 
+        interpolation (one gather per interpolation mode in use).
+        """
+        delay_line = self.gens[0].input_connect[0].delay_line
+        modes = [x.interpolation for x in self.gens]
+        if len(set(modes)) == 1:
+            return(delay_line.interpolate(positions, modes[0]))
+        content = np.zeros(len(positions), dtype=self.master.dtype)
+        for mode in set(modes):
+            ids = [i for i in range(len(modes)) if modes[i] == mode]
+            mask = np.isin(gen, ids)
+            content[mask] = delay_line.interpolate(positions[mask], mode)
+        return(content)
+        
+        
+def fuse_generators(gens):
+    """
+    Gives generators which read from the same delay line one shared 
+    Grain_Engine, and returns the list of engines.
+    
+    Generators with nothing in their input_connect aren't run, and keep the
+    engine they have.
+    """
+    groups = {}
+    for gen in gens:
+        if gen.input_connect is not None:
+            key = id(gen.input_connect[0].delay_line)
+            groups.setdefault(key, []).append(gen)
+    engines = []
+    for group in groups.values():
+        engine = Grain_Engine(group[0].master, group)
+        for i in range(len(group)):
+            group[i].engine = engine
+            group[i].gen_id = i
+            group[i].n_grains = 0
+        engines.append(engine)
+    return(engines)
+    
+    
+# ----- EVERYTHING ELSE -----
+
+
+def pan_gains(pan, n_channels):
+    """ 
+    Constant-power gains in each of n_channels channels for pan position pan
+    (-1 to 1, clipped). The position is spread evenly across the channels,
+    and panned between the two channels on either side of it with a sine
+    law, so the gains' squares always sum to 1. With one channel, the gain
+    is always 1.
+    """
+    gains = np.zeros(n_channels)
+    if n_channels == 1:
+        gains[0] = 1
+        return(gains)
+    x = (min(max(pan, -1), 1) + 1)/2*(n_channels - 1)
+    i = min(int(x), n_channels - 2)
+    gains[i] = np.cos((x - i)*np.pi/2)
+    gains[i + 1] = np.sin((x - i)*np.pi/2)
+    return(gains)
+    
+    
+class Decimator(object):
+    """
+    Polyphase FIR decimator, for bringing oversampled audio back down.
+    
+    Arguments:
+        factor (int) -- decimation factor.
+        taps_per_phase (int) -- filter length is factor*taps_per_phase.
+        dtype (str) -- type of the audio.
+        
+    The filter is a Blackman-windowed sinc lowpass, cut off at 0.45 of the
+    output sampling rate so that almost nothing folds back down into the 
+    audible band. Only every factor-th output of the filter is kept, so 
+    only those are computed (which is what a polyphase decimator does): a
+    strided, zero-copy view of the input holds the window of input samples
+    behind each kept output, one per row, and a single matrix-vector 
+    product filters the whole block. The last few input samples are kept 
+    between blocks, so blocks join up seamlessly.
+    """
+    def __init__(self, factor, taps_per_phase=default.OVERSAMPLE_TAPS,
+                 dtype=default.DTYPE):
+        self.factor = factor
+        n_taps = factor*taps_per_phase
+        t = np.arange(n_taps) - (n_taps - 1)/2
+        cutoff = 0.45/factor
+        kernel = 2*cutoff*np.sinc(2*cutoff*t)*np.blackman(n_taps)
+        self.kernel = (kernel/np.sum(kernel))[::-1].astype(dtype)
+        self.buffer = np.zeros(n_taps - 1 + factor*default.MAX_BLOCK_LEN,
+                               dtype=dtype)
+        
+    def process(self, signal, out):
+        """ Filters and decimates signal (factor*len(out) long) into out. """
+        n_taps = len(self.kernel)
+        m = len(signal)
+        padded = self.buffer[:n_taps - 1 + m]
+        padded[n_taps - 1:] = signal
+        windows = np.lib.stride_tricks.sliding_window_view(padded, n_taps)
+        np.matmul(windows[::self.factor], self.kernel, out=out)
+        padded[:n_taps - 1] = padded[m:]
+        
+    def ringing(self):
+        """ Whether input from earlier blocks is still in the filter. """
+        return(self.buffer[:len(self.kernel) - 1].any())
+        
+        
+class Operator_Cache(object):
+    """
+    Plays the operators back from a table while none of their settings 
+    change.
+    
+    Arguments:
+        master -- although this is not a Component, see Component doc string.
+        
+    Attributes:
+        key (None, or tuple) -- the settings the operators last had, see
+            Phase_Mod_Synth.op_cache_key().
+        n_held (int) -- number of blocks in a row the key has stayed the same.
+        built (boolean) -- whether a table has been tried for this key. 
+        tables (None, or array) -- one period of the output of each operator
+            in out_ops, one per row, or None if there's nothing to play.
+        devs (array) -- how far the phase of each active operator is from 
+            ratio times the base phase, over the same period.
+        theta (float) -- base phase at the last sample played.
+        n_hits, n_misses (int) -- number of blocks played from the table, 
+            and rendered.
+        
+    When a note is held and nothing is moving, the operators are all 
+    running at fixed frequencies. If those are all whole multiples of the
+    slowest one (the base frequency), which is the case for operators an 
+    octave or more apart and for integral_freq operators, then everything
+    the operators do is periodic in the phase of the base frequency. So 
+    once the key has held for OP_CACHE_HOLD blocks, one period of the 
+    operators is rendered into a table (at OP_CACHE_RES points per cycle of
+    the fastest operator, and at most OP_CACHE_MAX_LEN points in all), as a
+    function of the base phase. After that, each block is just a table 
+    lookup with a phase pointer for the operators whose output is used 
+    outside of the operators, and nothing is rendered at all. 
+    
+    render() adds an operator's input to its phase with a running sum, one
+    sample at a time. A running sum of a harmonic of the base frequency is
+    the same harmonic scaled by 1/(1 - exp(-i*harmonic*base increment)), 
+    so the tables are made with an FFT of each operator's input, which 
+    gives exactly what render() would at every sample, rather than an 
+    integral, which would be off by half a sample. Modulation with a 
+    component at a multiple of the sampling rate (e.g. the DC that a 
+    modulated modulator passes on) makes an operator's phase drift from one
+    period to the next, so if it drifts by more than OP_CACHE_TOL radians,
+    there's no period, no table is made and the operators are rendered as 
+    usual.
+    As soon as the key changes, the table is dropped and every operator's
+    phase is put back where it would have been, so rendering carries on 
+    without a click. Making a table takes a few milliseconds (around 10 for
+    three stacks with 64k point tables), once per held setting, which is 
+    why the cache is off by default for small real-time blocks.
+    """
+    def __init__(self, master):
+        self.master = master
+        self.key = None
+        self.n_held = 0
+        self.built = False
+        self.tables = None
+        self.out_ops = []
+        self.theta = 0
+        self.n_hits = 0
+        self.n_misses = 0
+        
+    def run(self, key):
+        """ Plays the block from the table if it can, returns if it did. """
+        if self.try_play(key):
+            self.n_hits = self.n_hits + 1
+            return(True)
+        self.n_misses = self.n_misses + 1
+        return(False)
+        
+    def try_play(self, key):
+        """ See run(). """
+        if key is None or key != self.key:
+            if self.tables is not None:
+                self.restore()
+            self.key = key
+            self.n_held = 0
+            self.built = False
+            self.tables = None
+            return(False)
+        if not self.built:
+            self.n_held = self.n_held + 1
+            if self.n_held < default.OP_CACHE_HOLD:
+                return(False)
+            self.build()
+            self.built = True
+        if self.tables is None:
+            return(False)
+        self.play()
+        return(True)
+        
+    def build(self):
+        """ Renders one period of the operators into tables, if periodic. """
+        master = self.master
+        ops = [master.ops[i] for i in master.algorithm.order 
+               if master.ops[i].active]
+        if len(ops) == 0:
+            return
+        incs = np.array([op.phase_inc[0] for op in ops])
+        base = np.min(incs)
+        ratios = incs/base
+        if np.any(np.abs(ratios - np.round(ratios)) > 1e-9):
+            return
+        ratios = np.round(ratios)
+        length = 2**int(np.ceil(np.log2(np.max(ratios)*default.OP_CACHE_RES)))
+        if length > default.OP_CACHE_MAX_LEN:
+            return
+        
+        # How a running sum of each harmonic of the base frequency, one 
+        # sample at a time, scales it 
+        harmonics = np.arange(length//2 + 1)
+        denominator = 1 - np.exp(-1j*harmonics*base)
+        singular = np.abs(denominator) < 1e-12
+        gains = np.zeros(len(harmonics), dtype=complex)
+        gains[~singular] = 1/denominator[~singular]
+        
+        theta = 2*np.pi/length*np.arange(length)
+        outputs = {}
+        devs = np.zeros((len(ops), length + 1))
+        for j in range(len(ops)):
+            op = ops[j]
+            if op.pull_connect is not None and len(op.pull_connect) > 0:
+                spectrum = np.fft.rfft(sum(outputs[x] for x in op.pull_connect))
+                drift = np.abs(spectrum[singular])*2*np.pi/(base*length)
+                if np.any(drift > default.OP_CACHE_TOL):
+                    return
+                dev = np.fft.irfft(spectrum*gains, n=length)
+                devs[j, :-1] = dev - dev[0]
+                devs[j, -1] = 0
+            outputs[op] = op.amp_amt*np.cos(op.phase_delaylet[0] + 
+                                            ratios[j]*theta + devs[j, :-1])
+        outside = master.outside_ops()
+        self.out_ops = [op for op in ops if op.has_delay_line or op in outside]
+        self.tables = np.zeros((len(self.out_ops), length + 1))
+        for j in range(len(self.out_ops)):
+            self.tables[j, :-1] = outputs[self.out_ops[j]]
+            self.tables[j, -1] = self.tables[j, 0]
+        self.ops = ops
+        self.ratios = ratios
+        self.devs = devs
+        self.starts = [op.phase_delaylet[0] for op in ops]
+        self.base = base
+        self.step = 2*np.pi/length
+        self.theta = 0
+        
+    def play(self):
+        """ Writes this block of every operator in out_ops from the tables. """
+        n = self.master.block_len
+        length = self.tables.shape[1] - 1
+        positions = (self.theta + self.base*np.arange(1, n + 1))/self.step
+        positions %= length
+        self.theta = (self.theta + n*self.base) % (2*np.pi)
+        for j in range(len(self.out_ops)):
+            self.out_ops[j].curr_output[:n] = lookup_table(self.tables[j], positions)
+            
+    def restore(self):
+        """ Puts each operator's phase where rendering would have left it. """
+        position = np.array([self.theta/self.step])
+        for j in range(len(self.ops)):
+            dev = lookup_table(self.devs[j], position)[0]
+            phase = self.starts[j] + self.ratios[j]*self.theta + dev
+            self.ops[j].phase_delaylet[0] = phase % (2*np.pi)
+            
+            
+class Load_Governor(object):
+    """
+    Lowers the synth's quality when it can't keep up, and raises it again
+    when it can.
+    
+    Arguments:
+        master -- although this is not a Component, see Component doc string.
         
-    def kill(self):
-        """ Kills this grain. """
-        self.generator.notify_death(self.id_number)
+    Attributes:
+        level (int) -- current quality level, 0 is full quality, see below.
+        load (float) -- ratio of the time blocks take to render to the time
+            they last (n_frames/fs), smoothed with an exponential moving 
+            average in which each block has weight GOVERNOR_SMOOTHING.
+        n_degrades, n_restores (int) -- number of times the level has gone
+            up and down.
+        n_stolen (int) -- number of grains dropped to get under a lower cap.
+        level_blocks (array) -- number of blocks rendered at each level.
+        
+    After every block, the synth tells the governor how long the block took
+    (see Phase_Mod_Synth.synthesize()). If the load goes over GOVERNOR_HIGH,
+    the level goes up by one, but only once every GOVERNOR_HOLD blocks, so 
+    the new level has time to show in the load. Only once the load has 
+    stayed under GOVERNOR_LOW for GOVERNOR_RECOVER blocks in a row does the
+    level come back down by one. The gap between the two, and the wait, 
+    stop the governor from flapping between levels. 
+    
+    At each level, every generator may only have GOVERNOR_GRAIN_SCALE of
+    MAX_GRAINS_PER_GEN grains playing, and grains over the new cap are 
+    stolen straight away, quietest first (see Grain_Engine.steal()). From
+    GOVERNOR_LUT_LEVEL up, operators use the cheaper table oscillator (see
+    Operator.render()). Since the governor goes by the time actually 
+    taken, it should only be used when rendering in real time.
+    """
+    def __init__(self, master):
+        self.master = master
+        self.level = 0
+        self.load = 0
+        self.n_degrades = 0
+        self.n_restores = 0
+        self.n_stolen = 0
+        self.n_since_change = 0
+        self.n_under = 0
+        self.level_blocks = np.zeros(len(default.GOVERNOR_GRAIN_SCALE), 
+                                     dtype=np.int64)
+        
+    def update(self, elapsed, n_frames):
+        """ Takes the time the last block took, changes level if need be. """
+        alpha = default.GOVERNOR_SMOOTHING
+        self.load = (1 - alpha)*self.load + alpha*elapsed*self.master.fs/n_frames
+        self.level_blocks[self.level] += 1
+        self.n_since_change = self.n_since_change + 1
+        if self.load < default.GOVERNOR_LOW:
+            self.n_under = self.n_under + 1
+        else:
+            self.n_under = 0
+        if (self.load > default.GOVERNOR_HIGH and 
+                self.n_since_change >= default.GOVERNOR_HOLD and
+                self.level < len(self.level_blocks) - 1):
+            self.n_degrades = self.n_degrades + 1
+            self.set_level(self.level + 1)
+        elif self.n_under >= default.GOVERNOR_RECOVER and self.level > 0:
+            self.n_restores = self.n_restores + 1
+            self.set_level(self.level - 1)
+            
+    def set_level(self, level):
+        """ Applies the settings for quality level level. """
+        master = self.master
+        self.level = level
+        self.n_since_change = 0
+        self.n_under = 0
+        master.max_grains = max(1, int(default.MAX_GRAINS_PER_GEN*
+                                       default.GOVERNOR_GRAIN_SCALE[level]))
+        master.lut_osc = level >= default.GOVERNOR_LUT_LEVEL
+        for engine in master.algorithm.engines:
+            self.n_stolen = self.n_stolen + engine.steal(master.max_grains)
+            
+    def metrics(self):
+        """ Returns the governor's state as a dict. """
+        return({"level": self.level, "load": self.load,
+                "max_grains": self.master.max_grains,
+                "lut_osc": self.master.lut_osc,
+                "n_degrades": self.n_degrades, "n_restores": self.n_restores,
+                "n_stolen": self.n_stolen,
+                "level_blocks": self.level_blocks.tolist()})
         
         
-# ----- EVERYTHING ELSE -----
+def read_wav_header(path):
+    """
+    Finds the audio in a WAV file, without reading it.
+    
+    Returns (fs, n_channels, dtype, offset, n_frames), where dtype is the 
+    NumPy type of one sample and offset is where the first sample is, in 
+    bytes from the start of the file. 
+    """
+    with open(path, "rb") as f:
+        riff, size, wave = struct.unpack("<4sI4s", f.read(12))
+        if riff != b"RIFF" or wave != b"WAVE":
+            raise ValueError(str(path) + " is not a WAV file")
+        fmt = None
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                raise ValueError(str(path) + " has no audio in it")
+            chunk, chunk_size = struct.unpack("<4sI", header)
+            if chunk == b"fmt ":
+                fmt = f.read(chunk_size + chunk_size % 2)
+            elif chunk == b"data":
+                offset = f.tell()
+                break
+            else:
+                f.seek(chunk_size + chunk_size % 2, 1)
+    if fmt is None:
+        raise ValueError(str(path) + " has no format chunk")
+    tag, n_channels, fs = struct.unpack_from("<HHI", fmt, 0)
+    bits = struct.unpack_from("<H", fmt, 14)[0]
+    if tag == 0xFFFE:
+        # WAVE_FORMAT_EXTENSIBLE, the real tag starts the sub-format GUID
+        tag = struct.unpack_from("<H", fmt, 24)[0]
+    dtypes = {(1, 8): "u1", (1, 16): "<i2", (1, 32): "<i4", (3, 32): "<f4",
+              (3, 64): "<f8"}
+    if (tag, bits) not in dtypes:
+        raise ValueError(str(path) + " has an unsupported sample format")
+    dtype = np.dtype(dtypes[(tag, bits)])
+    n_frames = chunk_size//(dtype.itemsize*n_channels)
+    return((fs, n_channels, dtype, offset, n_frames))
+    
+    
+def lookup_table(table, positions):
+    """ Reads table at fractional positions (0 to len(table)-1), linearly. """
+    i = np.minimum(positions.astype(int), len(table) - 2)
+    frac = (positions - i).astype(table.dtype)
+    return(table[i] + frac*(table[i + 1] - table[i]))
     
     
 class Delay_Line(object):
@@ -578,31 +2100,276 @@ class Delay_Line(object):
         master -- although this is not a Component, see Component doc string.
         input_connect -- same as above.
         delay_len (int) -- length of delay line in samples.
+        file_dir (None, or str) -- if None, the bank is kept in RAM. 
+            Otherwise, it is memory-mapped from a temporary file in file_dir,
+            see below.
     
     Can sample a Component's current output and return either a single sample
-    or a segment of the delay line. Uses deques instead of lists because
-    deques have faster pop and append methods.
+    or a segment of the delay line. The bank is a ring buffer: write_index
+    points at the oldest sample, which is the next one to be overwritten, so
+    nothing ever has to be shifted around. 
+    
+    Samples can also be read by position, which counts samples from the 
+    very first one ever written (so the newest sample is at n_written-1). A
+    position stays the same while the delay line moves on, which lets grains
+    keep a pointer into the delay line instead of a copy of it.
+    
+    A delay line minutes long would take up a lot of RAM, most of it for 
+    audio that is rarely (if ever) read. So the bank can instead be a 
+    memory map of a file, which the OS pages in only when it's read. Every 
+    DELAY_RELEASE_LEN samples, everything older than the newest 
+    DELAY_HOT_LEN samples is flushed to the file and let go of (with
+    madvise), so the part of the bank that stays in RAM is the recent audio
+    plus whatever old audio grains have read since it was let go of. Reads
+    work exactly the same either way, and the temporary file is deleted when
+    the delay line is.
     """
-    def __init__(self, master, input_connect=None, delay_len=10):
-        self.bank = deque([0]*round(delay_len))
+    def __init__(self, master, input_connect=None, delay_len=10,
+                 file_dir=None):
+        self.master = master
         self._length = round(delay_len)
+        self.file = None
+        self.map = None
+        if file_dir is None:
+            self.bank = np.zeros(self._length, dtype=master.dtype)
+        else:
+            nbytes = self._length*master.dtype.itemsize
+            import tempfile
+            self.file = tempfile.TemporaryFile(dir=file_dir)
+            self.file.truncate(nbytes)
+            self.map = mmap.mmap(self.file.fileno(), nbytes)
+            self.bank = np.frombuffer(self.map, dtype=master.dtype)
+        self.n_released = 0
+        self.write_index = 0
+        self.n_written = 0
+        self.n_silent = 0
         self.input_connect = input_connect
         self.input_connect[0].has_delay_line = True
 
     def sample(self):
         """ Samples connected Component's current output. """
-        [self.bank.popleft() for x in range(int(default.BUFFER_LEN))]
-        [self.bank.append(self.input_connect[0].curr_output[x]) for x in range(int(default.BUFFER_LEN))]
+        n = self.master.block_len
+        source = self.input_connect[0].curr_output
+        first = min(n, self._length - self.write_index)
+        self.bank[self.write_index:self.write_index+first] = source[:first]
+        self.bank[:n-first] = source[first:n]
+        self.write_index = (self.write_index + n) % self._length
+        self.n_written = self.n_written + n
+        self.n_silent = 0
+        self.check_release()
+        
+    def sample_silence(self):
+        """
+        Stands in for sample() when the connected Component is idle, and its
+        output is known to be zero.
+        
+        n_silent counts how many of the newest samples are zeros. Once it
+        reaches the length of the delay line, the whole bank is zeros, so
+        there's nothing left to write and only the write index moves on.
+        """
+        n = self.master.block_len
+        if self.n_silent < self._length:
+            first = min(n, self._length - self.write_index)
+            self.bank[self.write_index:self.write_index+first] = 0
+            self.bank[:n-first] = 0
+        self.write_index = (self.write_index + n) % self._length
+        self.n_written = self.n_written + n
+        self.n_silent = self.n_silent + n
+        self.check_release()
+        
+    def check_release(self):
+        """ Releases old samples of file-backed delay lines, see above. """
+        if self.map is not None:
+            old = self.n_written - default.DELAY_HOT_LEN
+            if old - self.n_released >= default.DELAY_RELEASE_LEN:
+                self.release(self.n_released, old)
+                self.n_released = old
+            
+    def release(self, start, stop):
+        """ 
+        Flushes positions start to stop (see read()) to the file and lets the
+        OS take them out of RAM, for file-backed delay lines. 
+        """
+        itemsize = self.bank.dtype.itemsize
+        start = max(start, stop - self._length)
+        for left, right in self.ring_ranges(start, stop - start):
+            # madvise() needs whole pages, so only the pages entirely inside
+            # the range are let go of
+            first = -(-left*itemsize//mmap.PAGESIZE)*mmap.PAGESIZE
+            last = right*itemsize//mmap.PAGESIZE*mmap.PAGESIZE
+            if last > first:
+                self.map.flush(first, last - first)
+                if hasattr(mmap, "MADV_DONTNEED"):
+                    self.map.madvise(mmap.MADV_DONTNEED, first, last - first)
+                    
+    def ring_ranges(self, position, duration):
+        """ Index ranges in the bank of duration samples from position. """
+        left_index = position % self._length
+        if left_index + duration <= self._length:
+            return([(left_index, left_index + duration)])
+        return([(left_index, self._length),
+                (0, left_index + duration - self._length)])
         
     def get_sample(self, n_taps):
         """ Gets sample from n_taps samples in the past. """
-        return(self.bank[-(n_taps)])
+        return(self.bank[(self.write_index - n_taps) % self._length])
         
     def get_segment(self, lag, duration):
-        """ Gets segment starting lag samples in the past of duration samples. """
-        left_index = self._length - lag - duration
-        return([self.bank[x] for x in range(left_index, left_index+duration)])
+        """ 
+        Gets segment starting lag samples in the past of duration samples.
+        
+        Like read(), returns a view into the bank unless the segment wraps, 
+        so copy it if you need to keep it.
+        """
+        return(self.read(self.n_written - lag - duration, duration))
+                               
+    def read(self, position, duration):
+        """ 
+        Gets duration samples starting at position (see doc string above).
+        
+        Returns a view into the bank (no copy) unless the segment wraps 
+        around the end of the ring.
+        """
+        ranges = self.ring_ranges(position, duration)
+        if len(ranges) == 1:
+            return(self.bank[ranges[0][0]:ranges[0][1]])
+        return(np.concatenate([self.bank[left:right] for left, right in ranges]))
+                               
+    def gather(self, indices):
+        """ Samples at an array of indices into the bank. """
+        return(self.bank[indices])
+        
+    def interpolate(self, positions, mode="linear"):
+        """
+        Reads the delay line at an array of fractional positions.
+        
+        Arguments:
+            positions (array) -- positions (see read()) to read at.
+            mode (str) -- "linear" for linear interpolation between the two
+                nearest samples, or "hermite" for 4-point, 3rd-order Hermite 
+                interpolation, which sounds smoother but costs more.
+        """
+        base = np.floor(positions)
+        frac = (positions - base).astype(self.master.dtype)
+        i = base.astype(int) % self._length
+        y0 = self.gather(i)
+        y1 = self.gather((i + 1) % self._length)
+        if mode == "linear":
+            return(y0 + frac*(y1 - y0))
+        ym1 = self.gather(i - 1)
+        y2 = self.gather((i + 2) % self._length)
+        c1 = 0.5*(y1 - ym1)
+        c2 = ym1 - 2.5*y0 + 2*y1 - 0.5*y2
+        c3 = 0.5*(y2 - ym1) + 1.5*(y0 - y1)
+        return(((c3*frac + c2)*frac + c1)*frac + y0)
+                               
+    def max_lag(self, reach):
+        """
+        Longest lag a grain can have.
+        
+        Arguments:
+            reach (int) -- how much further than its lag the grain reads 
+                behind the newest sample at its furthest point (its duration,
+                for a grain playing at the original rate).
+        
+        That distance, plus the length of a block and a couple of samples
+        for interpolation, has to fit in the delay line, or the content would
+        be overwritten before the grain finished playing it.
+        """
+        return(max(0, self._length - reach - default.MAX_BLOCK_LEN - 2))
         
     def __len__(self):
         """ Custom __len__ method so that len(Delay_Line) returns correctly. """
-        return(self._length)
\ No newline at end of file
+        return(self._length)
+        
+        
+class Sample_Line(Delay_Line):
+    """
+    A WAV file, read as if it were a Delay_Line.
+    
+    Arguments:
+        master -- see Delay_Line doc string.
+        input_connect -- see Delay_Line doc string.
+        path (str) -- path to the WAV file, see Sample_Source doc string.
+        
+    Attributes:
+        bank (memmap) -- the file's samples, n_frames x n_channels, exactly
+            as they are stored in the file.
+        fs (int) -- sampling rate of the file.
+        ratio (float) -- file samples per synth sample.
+        
+    The file is memory-mapped read-only, so opening even a very long file is
+    instant and takes no RAM up front: the OS pages in only the parts that
+    are actually read, and can drop them again whenever it likes since 
+    they're never written. Samples are converted to master.dtype (and mixed
+    down to mono) only as they are read, a block or a grain at a time.
+    
+    Nothing is ever written. Instead, sample() just moves the play head on 
+    by one block, which is what n_written counts, and positions wrap around 
+    the end of the file, so the file plays as a loop. Positions are in synth
+    samples, and are converted to file samples when they are read, so the
+    file plays at its own pitch whatever its sampling rate.
+    """
+    def __init__(self, master, input_connect=None, path=None):
+        self.master = master
+        self.fs, self.n_channels, dtype, offset, n_frames = read_wav_header(path)
+        self.bank = np.memmap(path, dtype=dtype, mode="r", offset=offset,
+                              shape=(n_frames, self.n_channels))
+        if dtype.kind == "f":
+            self.scale = 1
+            self.zero = 0
+        elif dtype.kind == "u":
+            self.scale = 1/2**(8*dtype.itemsize - 1)
+            self.zero = 2**(8*dtype.itemsize - 1)
+        else:
+            self.scale = 1/2**(8*dtype.itemsize - 1)
+            self.zero = 0
+        self.ratio = self.fs/master.fs
+        self._length = n_frames
+        self.write_index = 0
+        self.n_written = 0
+        self.n_silent = 0
+        self.map = None
+        self.input_connect = input_connect
+        self.input_connect[0].has_delay_line = True
+        
+    def sample(self):
+        """ Moves the play head on by one block. """
+        self.n_written = self.n_written + self.master.block_len
+        self.write_index = int(self.n_written*self.ratio) % self._length
+        
+    def to_audio(self, frames):
+        """ Converts frames read from the file to mono master.dtype. """
+        if self.n_channels == 1:
+            audio = frames[:, 0].astype(self.master.dtype)
+        else:
+            audio = frames.mean(axis=1, dtype=self.master.dtype)
+        if self.zero != 0:
+            audio -= self.zero
+        if self.scale != 1:
+            audio *= self.scale
+        return(audio)
+        
+    def get_sample(self, n_taps):
+        return(self.read(self.n_written - n_taps, 1)[0])
+        
+    def gather(self, indices):
+        return(self.to_audio(self.bank[indices]))
+        
+    def interpolate(self, positions, mode="linear"):
+        return(Delay_Line.interpolate(self, positions*self.ratio, mode))
+        
+    def read(self, position, duration):
+        """ 
+        Gets duration samples starting at position, converted (see 
+        to_audio()) from just that part of the file. 
+        """
+        if self.ratio != 1 or duration > self._length:
+            return(self.interpolate(position + np.arange(duration)))
+        ranges = self.ring_ranges(position, duration)
+        return(np.concatenate([self.to_audio(self.bank[left:right])
+                               for left, right in ranges]))
+                               
+    def max_lag(self, reach):
+        """ Longest lag a grain can have without wrapping around the file. """
+        return(max(0, int(self._length/self.ratio) - reach - 2))
@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@title: pm_synth_audio.py
+@date: 10/19/2026
+@author: Daniel Guest
+@purpose: Audio backends for pm_synth. Every backend calls the same kind of
+          callback that sounddevice does, callback(outdata, frames, time,
+          status), with outdata a frames x channels float32 buffer to fill,
+          and times every call the same way. Sounddevice_Backend plays on
+          a real device. Null_Backend is a virtual device with its own
+          clock, which asks for blocks at the pace a real device would,
+          and flags an underrun whenever a block isn't ready in time, so
+          callback scheduling, underruns and latency can be reproduced on a
+          machine without a sound card. Wav_Backend is a Null_Backend which
+          also writes everything it plays (including the gaps) to a WAV
+          file.
+
+          Usage: python pm_synth_audio.py [backend] [seconds] [patch file]
+"""
+import sys
+import time
+import threading
+import numpy as np
+import pm_synth_defaults as default
+
+
+class Callback_Status(object):
+    """
+    Status passed to callbacks by the virtual backends, like sounddevice's
+    CallbackFlags. True if anything went wrong since the last block.
+    """
+    def __init__(self):
+        self.output_underflow = False
+
+    def __bool__(self):
+        return(self.output_underflow)
+
+
+class Stream_Time(object):
+    """
+    Times passed to callbacks by the virtual backends, like sounddevice's,
+    in seconds of the backend's clock: currentTime when the callback was
+    called, and outputBufferDacTime when its first frame will be heard.
+    """
+    def __init__(self):
+        self.currentTime = 0.0
+        self.outputBufferDacTime = 0.0
+
+
+class Audio_Backend(object):
+    """
+    Top-level parent class for audio backends.
+
+    Arguments:
+        callback (function) -- called for every block, as
+            callback(outdata, frames, time, status), see above.
+        fs (int) -- sampling rate in Hz.
+        block_len (int) -- frames per block.
+        n_channels (int) -- number of output channels.
+        history_len (int) -- number of blocks of timing kept.
+
+    Attributes:
+        n_blocks (int) -- number of blocks the callback has been called for.
+        n_underruns (int) -- number of blocks whose status flagged an
+            underrun.
+        latency (float) -- seconds between a block being asked for and it
+            being heard, if nothing is late.
+        durations (array) -- seconds each callback took, as a ring buffer
+            indexed by block number.
+
+    Child classes start the stream in start(), stop it in stop(), and call
+    call() (rather than the callback itself) for every block, so every
+    backend times the callback the same way.
+    """
+    def __init__(self, callback, fs=default.FS, block_len=default.BLOCK_LEN,
+                 n_channels=default.N_CHANNELS,
+                 history_len=default.AUDIO_HISTORY_LEN):
+        self.callback = callback
+        self.fs = fs
+        self.block_len = block_len
+        self.n_channels = n_channels
+        self.durations = np.zeros(history_len)
+        self.n_blocks = 0
+        self.n_underruns = 0
+        self.latency = 0.0
+
+    def call(self, outdata, frames, time_info, status):
+        """ Calls the callback, and returns how long it took in seconds. """
+        start = time.perf_counter()
+        self.callback(outdata, frames, time_info, status)
+        duration = time.perf_counter() - start
+        self.durations[self.n_blocks % len(self.durations)] = duration
+        self.n_blocks = self.n_blocks + 1
+        if status and status.output_underflow:
+            self.n_underruns = self.n_underruns + 1
+        return(duration)
+
+    def start(self):
+        """ Starts calling the callback, should be filled in by the child. """
+        pass
+
+    def stop(self):
+        """ Stops calling the callback, should be filled in by the child. """
+        pass
+
+    def report(self):
+        """ Returns a dict of timing statistics over the blocks in history. """
+        n = min(self.n_blocks, len(self.durations))
+        report = {"n_blocks": self.n_blocks, "n_underruns": self.n_underruns,
+                  "latency": self.latency}
+        if n > 0:
+            load = self.durations[:n]*self.fs/self.block_len
+            report["mean_load"] = float(np.mean(load))
+            report["p99_load"] = float(np.percentile(load, 99))
+            report["max_load"] = float(np.max(load))
+        return(report)
+
+    def summary(self):
+        """ Returns report() as printable lines. """
+        return("\n".join(key + ": " + str(value)
+                         for key, value in self.report().items()))
+
+
+class Sounddevice_Backend(Audio_Backend):
+    """
+    Plays on the default sound device, through a sounddevice OutputStream.
+
+    Arguments: see Audio_Backend doc string.
+
+    sounddevice is only imported when the stream starts. The callback runs
+    on sounddevice's audio thread, and its status comes from the device.
+    """
+    def __init__(self, callback, **kwargs):
+        Audio_Backend.__init__(self, callback, **kwargs)
+        self.stream = None
+
+    def start(self):
+        import sounddevice as sd
+        self.stream = sd.OutputStream(samplerate=self.fs,
+                                      blocksize=self.block_len,
+                                      channels=self.n_channels,
+                                      callback=self.call)
+        self.stream.start()
+        self.latency = self.stream.latency
+
+    def stop(self):
+        if self.stream is not None:
+            self.stream.stop()
+            self.stream.close()
+            self.stream = None
+
+
+class Null_Backend(Audio_Backend):
+    """
+    Virtual sound device, which plays blocks to nowhere on its own clock.
+
+    Arguments:
+        callback, fs, block_len, n_channels, history_len -- see
+            Audio_Backend doc string.
+        n_buffers (int) -- number of blocks the device holds, which sets its
+            latency.
+        realtime (boolean) -- if True, the clock is the real one, and blocks
+            are asked for at the sampling rate. If False, the clock only
+            moves as far as the blocks played and the callbacks took, and
+            blocks are asked for as fast as they are made, e.g. for tests.
+        time_scale (float) -- callbacks count as taking this many times as
+            long as they really did, to act like a slower machine. Only
+            used if not realtime.
+
+    Attributes:
+        clock (float) -- the device's time in seconds, since it started.
+        n_gap_frames (int) -- total frames of silence played because blocks
+            were late.
+
+    The device plays block i at i*block_len/fs + latency (plus however far
+    the device has slipped, see below), and asks for it as soon as its
+    buffer has room, i.e. one latency before then, but not before the
+    previous callback has returned. A block that isn't ready by the time it
+    should be played is an underrun, just as on a real device: silence is
+    played until it is, every later block slips by as much, and the next
+    callback's status has output_underflow set.
+    """
+    def __init__(self, callback, fs=default.FS, block_len=default.BLOCK_LEN,
+                 n_channels=default.N_CHANNELS,
+                 history_len=default.AUDIO_HISTORY_LEN,
+                 n_buffers=default.AUDIO_BUFFERS, realtime=True,
+                 time_scale=1.0):
+        Audio_Backend.__init__(self, callback, fs=fs, block_len=block_len,
+                               n_channels=n_channels, history_len=history_len)
+        self.n_buffers = n_buffers
+        self.realtime = realtime
+        self.time_scale = time_scale
+        self.latency = n_buffers*block_len/fs
+        self.outdata = np.zeros((block_len, n_channels), dtype="float32")
+        self.status = Callback_Status()
+        self.time_info = Stream_Time()
+        self.clock = 0.0
+        self.slip = 0.0
+        self.n_gap_frames = 0
+        self.stopping = threading.Event()
+        self.thread = None
+
+    def run(self, n_blocks=None):
+        """
+        Plays n_blocks blocks (or until stop() is called, if None) on the
+        calling thread.
+        """
+        block_dur = self.block_len/self.fs
+        start = time.perf_counter() - self.clock
+        late = False
+        i = 0
+        while (n_blocks is None or i < n_blocks) and not self.stopping.is_set():
+            due = self.n_blocks*block_dur + self.slip
+            self.clock = max(self.clock, due)
+            if self.realtime:
+                wait = start + self.clock - time.perf_counter()
+                if wait > 0:
+                    time.sleep(wait)
+                self.clock = time.perf_counter() - start
+            self.status.output_underflow = late
+            self.time_info.currentTime = self.clock
+            self.time_info.outputBufferDacTime = due + self.latency
+            duration = self.call(self.outdata, self.block_len, self.time_info,
+                                 self.status)
+            if self.realtime:
+                self.clock = time.perf_counter() - start
+            else:
+                self.clock = self.clock + duration*self.time_scale
+            gap = self.clock - (due + self.latency)
+            late = gap > 0
+            if late:
+                self.slip = self.slip + gap
+                self.gap(int(round(gap*self.fs)))
+            self.play(self.outdata)
+            i = i + 1
+        if late:
+            self.n_underruns = self.n_underruns + 1
+
+    def gap(self, n_frames):
+        """ Plays n_frames of silence, because a block was late. """
+        self.n_gap_frames = self.n_gap_frames + n_frames
+
+    def play(self, outdata):
+        """ Plays a block, which for a Null_Backend means nothing. """
+        pass
+
+    def start(self):
+        """ Starts playing on a thread of its own. """
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def report(self):
+        report = Audio_Backend.report(self)
+        report["gap_seconds"] = self.n_gap_frames/self.fs
+        return(report)
+
+
+class Wav_Backend(Null_Backend):
+    """
+    Virtual sound device which writes what it plays to a WAV file.
+
+    Arguments:
+        callback -- see Audio_Backend doc string.
+        path (str) -- WAV file to write.
+        realtime (boolean) -- see Null_Backend doc string, but defaults to
+            False, so files are written as fast as possible.
+        kwargs -- passed on to Null_Backend.
+
+    Gaps from late blocks are written as silence, so the file sounds like
+    the device would have. The file is finished by stop().
+    """
+    def __init__(self, callback, path=default.AUDIO_WAV_PATH, realtime=False,
+                 **kwargs):
+        Null_Backend.__init__(self, callback, realtime=realtime, **kwargs)
+        import pm_synth_render
+        self.writer = pm_synth_render.Wav_Writer(path, self.fs,
+                                                 n_channels=self.n_channels)
+        self.silence = np.zeros((self.n_channels, default.MAX_BLOCK_LEN),
+                                dtype="float32")
+
+    def gap(self, n_frames):
+        Null_Backend.gap(self, n_frames)
+        while n_frames > 0:
+            n = min(n_frames, default.MAX_BLOCK_LEN)
+            self.writer.write(self.silence[:, :n])
+            n_frames = n_frames - n
+
+    def play(self, outdata):
+        self.writer.write(outdata.T)
+
+    def stop(self):
+        Null_Backend.stop(self)
+        self.writer.close()
+
+
+BACKENDS = {"sounddevice": Sounddevice_Backend, "null": Null_Backend,
+            "wav": Wav_Backend}
+
+
+def make_backend(name, callback, **kwargs):
+    """ Builds the backend called name in BACKENDS. """
+    if name not in BACKENDS:
+        raise ValueError("Unknown audio backend: " + str(name))
+    return(BACKENDS[name](callback, **kwargs))
+
+
+def synth_callback(synth):
+    """ The callback for playing synth, writing into outdata's transpose. """
+    def callback(outdata, frames, time_info, status):
+        synth.synthesize(frames, out=outdata.T)
+    return(callback)
+
+
+if __name__ == "__main__":
+    import pm_synth
+    synth = pm_synth.Phase_Mod_Synth(fs=default.FS)
+    if len(sys.argv) > 3:
+        import pm_synth_patch
+        synth.load_patch(pm_synth_patch.Patch.load(sys.argv[3]).prepare(synth))
+    name = default.AUDIO_BACKEND
+    if len(sys.argv) > 1:
+        name = sys.argv[1]
+    seconds = 5
+    if len(sys.argv) > 2:
+        seconds = float(sys.argv[2])
+    backend = make_backend(name, synth_callback(synth), fs=synth.fs,
+                           n_channels=synth.n_channels)
+    if name == "sounddevice":
+        backend.start()
+        time.sleep(seconds)
+    else:
+        backend.run(int(seconds*synth.fs/backend.block_len))
+    backend.stop()
+    print(backend.summary())
@@ -6,23 +6,158 @@
 @author: Daniel Guest
 @purpose: Provide controller system for pm_synth.
 """
+import time
+import threading
 import pm_synth_defaults as default
 
 
+class Control_Queue(object):
+    """
+    Latest-value-wins, rate-limited queue of parameter changes for a synth.
+    
+    Arguments:
+        interval (float) -- seconds a parameter's changes are held back 
+            for after one has been queued, one block by default.
+    
+    Attributes:
+        pending (dict) -- for each parameter with a change waiting for the
+            synth, its (apply, value), where apply(value) makes the change.
+        held (dict) -- for each parameter changed again within interval of
+            its last queued change, its latest (apply, value).
+        n_posted (int) -- number of changes posted.
+        n_queued (int) -- number of changes that made it into pending.
+        n_applied (int) -- number of changes actually applied.
+        
+    Dragging a dial makes the GUI post a change for every step it moves, 
+    hundreds of times a second. A change to a parameter whose last change 
+    was queued less than interval ago is only held, replacing whatever was
+    held for it, and flush() (run by a timer on the GUI thread, about once
+    a block) queues whatever has been held long enough, so the last value 
+    of a drag is never lost. Queued changes go into pending, again 
+    replacing whatever that parameter already had waiting, so the GUI 
+    thread never touches the synth. Then the synth calls dispatch() once 
+    before each block, which applies the latest value of each parameter 
+    that changed, so every parameter changes at most once per block, and 
+    never partway through one. 
+    
+    Only one thread (the GUI) should post and flush, and one (the audio 
+    thread) dispatch. held is only used by the GUI thread. pending is
+    shared, so it is guarded by a lock, but the lock is only ever held for
+    a dict assignment or a swap of two references, so the audio thread 
+    never waits on the GUI for longer than that.
+    """
+    def __init__(self, interval=default.BLOCK_LEN/default.FS):
+        self.interval = interval
+        self.pending = {}
+        self.spare = {}
+        self.held = {}
+        self.last_queued = {}
+        self.lock = threading.Lock()
+        self.n_posted = 0
+        self.n_queued = 0
+        self.n_applied = 0
+        
+    def post(self, key, apply, value):
+        """ Queues apply(value), replacing anything queued for key. """
+        self.n_posted = self.n_posted + 1
+        now = time.perf_counter()
+        if now - self.last_queued.get(key, -self.interval) < self.interval:
+            self.held[key] = (apply, value)
+            return
+        self.held.pop(key, None)
+        self.queue(key, apply, value, now)
+        
+    def queue(self, key, apply, value, now):
+        """ Puts a change in pending, for the synth to pick up. """
+        self.last_queued[key] = now
+        with self.lock:
+            self.pending[key] = (apply, value)
+        self.n_queued = self.n_queued + 1
+        
+    def flush(self):
+        """ Queues every held change whose interval is up. """
+        if not self.held:
+            return
+        now = time.perf_counter()
+        for key, (apply, value) in list(self.held.items()):
+            if now - self.last_queued[key] >= self.interval:
+                del self.held[key]
+                self.queue(key, apply, value, now)
+        
+    def dispatch(self):
+        """ 
+        Applies every change queued before it was called. Changes queued 
+        while it runs wait for the next block.
+        """
+        if not self.pending:
+            return
+        with self.lock:
+            pending, self.pending = self.pending, self.spare
+        for apply, value in pending.values():
+            apply(value)
+            self.n_applied = self.n_applied + 1
+        pending.clear()
+        self.spare = pending
+
+
 class Controller(object):
     """
     Controller object master class.
     
+    Arguments:
+        master (Phase_Mod_Synth object) -- synth the controlled parameters
+            belong to.
+    
     Each major section of the pm_synth and a corresponding section of
     pm_synth_widgets are assigned to a controller. Each controller has the 
     appropriate methods to bind the interfaces within the widgets to the
     appropriate parameters in the synth. 
     
+    Changes made with a widget are sent through the master's control_queue
+    if it has one (see Control_Queue), so they are rate limited and applied 
+    by the audio thread between blocks, or applied right away if it 
+    doesn't. Widget 
+    signals carry their value, so the widgets are only ever read on the GUI
+    thread.
+    
     TODO -- do doc strings for Operator_Controller, Generator_Controller, and
         Synth_Controller.
     """
-    def __init__(self):
+    def __init__(self, master=None):
         self.name = "Controller"
+        self.master = master
+        
+    def send(self, key, apply, value):
+        """ Applies apply(value), through master's control_queue if set. """
+        if self.master.control_queue is None:
+            apply(value)
+        else:
+            self.master.control_queue.post(key, apply, value)
+            
+    def bind(self, widget, name, apply, signal=None):
+        """
+        Connects a widget to apply(), through send(), and applies the 
+        widget's current value right away.
+        
+        Arguments:
+            widget -- a slider, dial, or checkbox.
+            name (str) -- name of the parameter, unique within this 
+                controller, so that queued changes to it replace each other.
+            apply (function) -- apply(value) makes the change.
+            signal (None, or signal) -- widget's signal which carries its 
+                new value. If None, widget.valueChanged (for a checkbox, 
+                pass its stateChanged).
+        """
+        key = (self, name)
+        def post(value):
+            self.send(key, apply, value)
+        if signal is None:
+            signal = widget.valueChanged
+            value = widget.value()
+        else:
+            value = widget.checkState()
+        signal.connect(post)
+        apply(value)
         
         
 class Operator_Controller(Controller):
@@ -39,37 +174,35 @@ class Operator_Controller(Controller):
     the proper parameters in the Operator.
     """
     def __init__(self, operator):
-        Controller.__init__(self)
+        Controller.__init__(self, operator.master)
         self.op = operator
         self.freq_slider = None
         self.amp_slider = None
         
     def bind_freq(self, slider):
         self.freq_slider = slider
-        def change_freq():
-            self.op.curr_freq[:] = [self.freq_slider.value()]*default.BUFFER_LEN
-        self.freq_slider.valueChanged.connect(change_freq)
-        change_freq()
+        def change_freq(value):
+            self.op.curr_freq[:] = value
+        self.bind(slider, "freq", change_freq)
         
     def bind_amp(self, slider):
         self.amp_slider = slider
-        def change_amp():
-            self.op.amp_amt = self.amp_slider.value()/100
-        self.amp_slider.valueChanged.connect(change_amp)
-        change_amp()
+        def change_amp(value):
+            self.op.amp_amt = value/100
+        self.bind(slider, "amp", change_amp)
         
     def bind_integral(self, checkbox):
         self.integral_checkbox = checkbox
-        def set_integral_freq():
-            boolean = None
-            if self.integral_checkbox.checkState() == 0:
-                boolean = False
-            elif self.integral_checkbox.checkState() == 1 or 2:
-                boolean = True
+        def set_integral_freq(state):
+            boolean = state != 0
             self.op.set_integral_freq(boolean=boolean)
-            self.freq_slider.set_integral_freq(boolean=boolean)
-        self.integral_checkbox.stateChanged.connect(set_integral_freq)
-        set_integral_freq()
+        def set_integral_knob(state):
+            # The knob is a widget, so it's changed here on the GUI thread
+            self.freq_slider.set_integral_freq(boolean=(state != 0))
+        self.bind(checkbox, "integral", set_integral_freq,
+                  checkbox.stateChanged)
+        checkbox.stateChanged.connect(set_integral_knob)
+        set_integral_knob(checkbox.checkState())
         
     def bind_interface(self, OperatorGroup):
         freq_slider = OperatorGroup.freqSlider
@@ -94,7 +227,7 @@ class Generator_Controller(Controller):
     the proper parameters in the Generator.
     """    
     def __init__(self, generator):
-        Controller.__init__(self)
+        Controller.__init__(self, generator.master)
         self.gen = generator
         self.period_slider = None
         self.dur_slider = None
@@ -102,38 +235,69 @@ class Generator_Controller(Controller):
     def bind_period(self, slider, jitter_slider):
         self.period_slider = slider
         self.period_jitter_slider = jitter_slider
-        def change_period():
-            self.gen.curr_period = self.period_slider.value()
-        def change_period_jitter():
-            self.gen.curr_period_jitter = self.period_jitter_slider.value()
-        self.period_slider.valueChanged.connect(change_period)
-        self.period_jitter_slider.valueChanged.connect(change_period_jitter)
-        change_period()
-        change_period_jitter()
+        def change_period(value):
+            self.gen.curr_period = value
+        def change_period_jitter(value):
+            self.gen.curr_period_jitter = value
+        self.bind(slider, "period", change_period)
+        self.bind(jitter_slider, "period_jitter", change_period_jitter)
         
     def bind_dur(self, slider, jitter_slider):
         self.dur_slider = slider
         self.dur_jitter_slider = jitter_slider
-        def change_dur():
-            self.gen.curr_dur = self.dur_slider.value()
-        def change_dur_jitter():
-            self.gen.curr_dur_jitter = self.dur_jitter_slider.value()
-        self.dur_slider.valueChanged.connect(change_dur)
-        self.dur_jitter_slider.valueChanged.connect(change_dur_jitter)
-        change_dur()
-        change_dur_jitter()
+        def change_dur(value):
+            self.gen.curr_dur = value
+        def change_dur_jitter(value):
+            self.gen.curr_dur_jitter = value
+        self.bind(slider, "dur", change_dur)
+        self.bind(jitter_slider, "dur_jitter", change_dur_jitter)
         
     def bind_lag(self, slider, jitter_slider):
         self.lag_slider = slider
         self.lag_jitter_slider = jitter_slider
-        def change_lag():
-            self.gen.curr_lag = self.lag_slider.value()
-        def change_lag_jitter():
-            self.gen.curr_lag_jitter = self.lag_jitter_slider.value()
-        self.lag_slider.valueChanged.connect(change_lag)
-        self.lag_jitter_slider.valueChanged.connect(change_lag_jitter)
-        change_lag()
-        change_lag_jitter()
+        # Let the lag reach as far back as the delay line goes, which is
+        # minutes if the synth keeps its delay lines in files
+        if self.gen.input_connect:
+            delay_line = self.gen.input_connect[0].delay_line
+            slider.setMaximum(delay_line.max_lag(default.MAX_GRAIN_LEN))
+        def change_lag(value):
+            self.gen.curr_lag = value
+        def change_lag_jitter(value):
+            self.gen.curr_lag_jitter = value
+        self.bind(slider, "lag", change_lag)
+        self.bind(jitter_slider, "lag_jitter", change_lag_jitter)
+        
+    def bind_pitch(self, slider, jitter_slider):
+        self.pitch_slider = slider
+        self.pitch_jitter_slider = jitter_slider
+        def change_pitch(value):
+            self.gen.curr_rate = 2**(value/12)
+        def change_pitch_jitter(value):
+            self.gen.curr_rate_jitter = value
+        self.bind(slider, "pitch", change_pitch)
+        self.bind(jitter_slider, "pitch_jitter", change_pitch_jitter)
+        
+    def bind_reverse(self, slider):
+        self.reverse_slider = slider
+        def change_reverse(value):
+            self.gen.curr_reverse_prob = value/100
+        self.bind(slider, "reverse", change_reverse)
+        
+    def bind_amp_jitter(self, slider):
+        self.amp_jitter_slider = slider
+        def change_amp_jitter(value):
+            self.gen.curr_amp_jitter = value/100
+        self.bind(slider, "amp_jitter", change_amp_jitter)
+        
+    def bind_pan(self, slider, jitter_slider):
+        self.pan_slider = slider
+        self.pan_jitter_slider = jitter_slider
+        def change_pan(value):
+            self.gen.curr_pan = value/100
+        def change_pan_jitter(value):
+            self.gen.curr_pan_jitter = value/100
+        self.bind(slider, "pan", change_pan)
+        self.bind(jitter_slider, "pan_jitter", change_pan_jitter)
         
     def bind_interface(self, GeneratorGroup):
         period_slider = GeneratorGroup.periodSlider
@@ -145,6 +309,11 @@ class Generator_Controller(Controller):
         self.bind_period(period_slider, period_jitter_slider)
         self.bind_dur(dur_slider, dur_jitter_slider)
         self.bind_lag(lag_slider, lag_jitter_slider)
+        self.bind_pitch(GeneratorGroup.pitchSlider,
+                        GeneratorGroup.pitchJitterSlider)
+        self.bind_reverse(GeneratorGroup.reverseSlider)
+        self.bind_amp_jitter(GeneratorGroup.ampJitterSlider)
+        self.bind_pan(GeneratorGroup.panSlider, GeneratorGroup.panJitterSlider)
             
         
 class Synth_Controller(Controller):
@@ -161,15 +330,14 @@ class Synth_Controller(Controller):
     the proper parameters in the Synthesizer.
     """        
     def __init__(self, synth):
-        Controller.__init__(self)
+        Controller.__init__(self, synth)
         self.synth = synth
         
     def bind_master_freq(self, slider):
         self.master_freq_slider = slider
-        def change_master_freq():
-            self.synth.curr_master_freq = self.master_freq_slider.value()
-        self.master_freq_slider.valueChanged.connect(change_master_freq)
-        change_master_freq()
+        def change_master_freq(value):
+            self.synth.curr_master_freq = value
+        self.bind(slider, "master_freq", change_master_freq)
         
     def bind_interface(self, CenterWidget):
         master_freq_slider = CenterWidget.masterFreqSlider
@@ -15,20 +15,33 @@ BLOCK_LEN = 50
 FS = 20000
 N_OP = 2
 N_GEN = 1
+N_CHANNELS = 2
+DTYPE = "float32"
 
 # ----- BUFFER PARAMETERS -----
 BUFFER_LEN = 50
+MAX_BLOCK_LEN = 4096
 
 # ----- OP PARAMETERS ----- 
 OP_DELAY_LEN = FS*2
+DELAY_DIR = None
+LONG_DELAY_LEN = FS*60*5
+DELAY_HOT_LEN = FS*10
+DELAY_RELEASE_LEN = FS*5
 LFO_FREQ = 5
+LFO_WAVEFORM = "sine"
 
 # ----- GENERATOR PARAMETERS -----
 WINDOW_TYPE = "hamming"
+ENVELOPE_TABLE_LEN = 1024
+GRAIN_INTERP = "linear"
 MAX_GRAINS_PER_GEN = 50
+RANDOM_BATCH_LEN = 256
 
 CURR_GEN_LAG = 0
-MAX_LAG_LEN = OP_DELAY_LEN*0.5
+MAX_LAG_LEN = OP_DELAY_LEN//2
+if DELAY_DIR is not None:
+    MAX_LAG_LEN = LONG_DELAY_LEN//2
 
 CURR_LAG_JITTER = 0
 MIN_LAG_JITTER = 0
@@ -46,4 +59,88 @@ MIN_GEN_PERIOD_JITTER = 0
 MAX_GEN_PERIOD_JITTER = 500
 CURR_GEN_PERIOD = 500
 MIN_GEN_PERIOD = 10
-MAX_GEN_PERIOD = 5000
\ No newline at end of file
+MAX_GEN_PERIOD = 5000
+
+CURR_GRAIN_RATE = 1.0
+MIN_GRAIN_PITCH = -24
+MAX_GRAIN_PITCH = 24
+
+CURR_GRAIN_RATE_JITTER = 0
+MIN_GRAIN_RATE_JITTER = 0
+MAX_GRAIN_RATE_JITTER = 12
+
+CURR_GRAIN_REVERSE_PROB = 0
+
+CURR_GRAIN_AMP_JITTER = 0
+
+CURR_GRAIN_PAN = 0
+CURR_GRAIN_PAN_JITTER = 0
+
+# ----- MIDI PARAMETERS -----
+MIDI_QUEUE_LEN = 1024
+MIDI_LATENCY = BLOCK_LEN
+PITCH_BEND_RANGE = 2
+
+# ----- SERVER PARAMETERS -----
+SERVER_PORT = 8765
+SERVER_BLOCK_LEN = 1000
+SERVER_RING_LEN = 32
+
+# ----- OVERSAMPLING PARAMETERS -----
+OVERSAMPLE = 1
+OVERSAMPLE_TAPS = 16
+
+# ----- ENVELOPE PARAMETERS -----
+ENV_RATES = [10, 2, 1, 1]
+ENV_LEVELS = [1, 0.8, 0.7, 0]
+ENV_CURVE = "exponential"
+ENV_FLOOR_DB = -96
+
+# ----- OPERATOR CACHE PARAMETERS -----
+OP_CACHE = False
+OP_CACHE_HOLD = 8
+OP_CACHE_RES = 8192
+OP_CACHE_MAX_LEN = 2**18
+OP_CACHE_TOL = 1e-6
+LUT_OSC_LEN = 2**14
+
+# ----- REAL-TIME CHECK PARAMETERS -----
+RT_CHECK = False
+RT_FREEZE_GC = False
+RT_HISTORY_LEN = 4096
+RT_SNAPSHOT_EVERY = 500
+RT_COLLECT_EVERY = 200
+RT_COLLECT_HEADROOM = 0.5
+
+# ----- LOAD GOVERNOR PARAMETERS -----
+GOVERNOR = False
+GOVERNOR_GRAIN_SCALE = [1, 0.5, 0.25, 0.125]
+GOVERNOR_LUT_LEVEL = 2
+GOVERNOR_HIGH = 0.8
+GOVERNOR_LOW = 0.4
+GOVERNOR_SMOOTHING = 0.1
+GOVERNOR_HOLD = 20
+GOVERNOR_RECOVER = 400
+
+# ----- METRICS PARAMETERS -----
+METRICS_PORT = None
+METRICS_CAPACITY = 256
+METRICS_BUCKETS = [0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1]
+METRICS_SNAPSHOT_EVERY = 10
+
+# ----- GOLDEN OUTPUT PARAMETERS -----
+GOLDEN_PATH = "pm_synth_golden.json"
+GOLDEN_SEED = 1234
+GOLDEN_SECONDS = 1.0
+GOLDEN_EXCERPT_LEN = 256
+GOLDEN_FFT_LEN = 1024
+GOLDEN_BANDS = 64
+GOLDEN_FLOOR_DB = -100
+GOLDEN_RANGE_DB = 60
+
+# ----- AUDIO BACKEND PARAMETERS -----
+AUDIO_BACKEND = "sounddevice"
+AUDIO_BUFFERS = 2
+AUDIO_WAV_PATH = "pm_synth_out.wav"
+AUDIO_HISTORY_LEN = 4096
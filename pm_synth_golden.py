@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@title: pm_synth_golden.py
+@date: 10/19/2026
+@author: Daniel Guest
+@purpose: Golden-output regression checks for pm_synth. A fixed corpus of
+          patches, covering every Algorithm, is rendered with seeded random
+          numbers, and a compact fingerprint of each (a hash of the samples,
+          a short excerpt of them, and a downsampled spectrum) is stored in
+          a golden file. Each engine configuration (float32 buffers, the
+          operator cache, long blocks, table-lookup oscillators, ...) is then
+          rendered again and compared against the golden file, exactly if
+          it can be and within its tolerances if not, so that optimizations
+          can be checked to not change the sound.
+
+          Usage: python pm_synth_golden.py record [golden file]
+                 python pm_synth_golden.py check [golden file] [engine ...]
+"""
+import sys
+import json
+import hashlib
+import numpy as np
+import pm_synth
+import pm_synth_patch
+import pm_synth_render
+import pm_synth_defaults as default
+
+
+def op_settings(*ops):
+    """ Operator dicts for a Patch from (freq, amp_amt) pairs. """
+    return([{"freq": freq, "amp_amt": amp_amt, "integral_freq": True}
+            for freq, amp_amt in ops])
+
+
+def gen_settings(**settings):
+    """ Generator dict for a Patch, DEFAULT_GEN with settings changed. """
+    gen = dict(pm_synth_patch.DEFAULT_GEN)
+    gen.update(settings)
+    return(gen)
+
+
+# Each case is rendered from a fresh synth with n_gen generators, into which
+# the patch is swapped before the first block. A case with an "envelope"
+# also has an Envelope, with those rates and levels, routed to the amp of
+# operator op, and a case with "events" is played from those MIDI events by
+# the offline renderer instead of as one held note.
+CORPUS = {
+    "a1_2op": {
+        "patch": pm_synth_patch.Patch("a1_2op", 60, op_settings((1, 0.5), (0, 0.8)),
+                                      [gen_settings()]),
+        "n_gen": 1},
+    "a1_2op_1gen": {
+        "patch": pm_synth_patch.Patch("a1_2op_1gen", 68, op_settings((1, 0.5), (0, 0.8)),
+                                      [gen_settings(curr_period=100, curr_dur=400)]),
+        "n_gen": 1},
+    "a1_2op_1gen_jitter": {
+        "patch": pm_synth_patch.Patch("a1_2op_1gen", 64, op_settings((2, 0.7), (0, 0.9)),
+                                      [gen_settings(curr_period=60, curr_dur=800,
+                                                    curr_lag=300,
+                                                    curr_period_jitter=40,
+                                                    curr_dur_jitter=200,
+                                                    curr_lag_jitter=200,
+                                                    curr_rate=1.5,
+                                                    curr_rate_jitter=2.0,
+                                                    curr_reverse_prob=0.3,
+                                                    curr_amp_jitter=0.5,
+                                                    curr_pan_jitter=1.0)]),
+        "n_gen": 1},
+    "a1_2op_Xgen": {
+        "patch": pm_synth_patch.Patch("a1_2op_Xgen", 57, op_settings((1, 0.6), (0, 0.8)),
+                                      [gen_settings(curr_period=150, curr_dur=600,
+                                                    curr_rate=0.5, curr_pan=-0.8),
+                                       gen_settings(curr_period=90, curr_dur=300,
+                                                    curr_rate=2.0, curr_pan=0.8),
+                                       gen_settings(curr_period=200, curr_dur=1200,
+                                                    curr_reverse_prob=1.0,
+                                                    curr_pan_jitter=0.5)]),
+        "n_gen": 3},
+    "a1_6op": {
+        "patch": pm_synth_patch.Patch("a1_6op", 62,
+                                      op_settings((1, 0.4), (0, 0.5), (2, 0.3),
+                                                  (1, 0.5), (3, 0.2), (0, 0.5)),
+                                      [gen_settings()]),
+        "n_gen": 1},
+    "a2_6op_1gen": {
+        "patch": pm_synth_patch.Patch("a2_6op_1gen", 66,
+                                      op_settings((0, 0.8), (1, 0.6), (2, 0.4),
+                                                  (1, 0.3), (3, 0.2), (0, 0.1)),
+                                      [gen_settings(curr_period=120, curr_dur=500,
+                                                    curr_rate=0.75)]),
+        "n_gen": 1},
+    "a2_6op": {
+        "patch": pm_synth_patch.Patch("a2_6op", 55,
+                                      op_settings((0, 0.8), (1, 0.6), (0, 0.5),
+                                                  (2, 0.4), (1, 0.3), (0, 0.2)),
+                                      [gen_settings(), gen_settings()]),
+        "n_gen": 2},
+    "a1_2op_repeat": {
+        "patch": pm_synth_patch.Patch("a1_2op", 64, op_settings((1, 0.5), (0, 0.8)),
+                                      [gen_settings()]),
+        "n_gen": 1,
+        "envelope": {"op": 1, "rates": [50, 8, 1, 4],
+                     "levels": [1, 0.1, 0.1, 0]},
+        "events": [(0.0, 0x90, 64, 100), (0.25, 0x90, 64, 100),
+                   (0.5, 0x90, 64, 100), (0.75, 0x90, 64, 100)]},
+}
+
+# Engine configurations to check. "synth" is passed to Phase_Mod_Synth,
+# "lut_osc" is set on the synth, and "block_len" is the length of each
+# block. An engine passes a case if its hash matches the golden one, or
+# failing that, if its excerpt is within sample_tol of the golden one (None
+# to skip) and its spectrum within spectrum_tol dB. Long chains of operators
+# modulating each other turn tiny rounding differences into much larger
+# sample errors, which is why float32 and lut_osc get looser sample_tols
+# than their errors on a single operator would suggest.
+ENGINES = {
+    "reference": {"synth": {"dtype": "float64"}, "sample_tol": 1e-6,
+                  "spectrum_tol": 0.01},
+    "float32": {"synth": {"dtype": "float32"}, "sample_tol": 0.02,
+                "spectrum_tol": 0.1},
+    "op_cache": {"synth": {"dtype": "float64", "op_cache": True},
+                 "sample_tol": 1e-4, "spectrum_tol": 0.1},
+    "long_blocks": {"synth": {"dtype": "float64"}, "block_len": 1000,
+                    "sample_tol": 1e-6, "spectrum_tol": 0.01},
+    "lut_osc": {"synth": {"dtype": "float64"}, "lut_osc": True,
+                "sample_tol": 0.002, "spectrum_tol": 0.1},
+}
+
+
+class Block_Collector(object):
+    """ Stands in for a Wav_Writer, keeping a copy of every block. """
+    def __init__(self):
+        self.blocks = []
+
+    def write(self, block):
+        self.blocks.append(np.array(block, dtype=float))
+
+
+def render(case, engine=ENGINES["reference"], seconds=default.GOLDEN_SECONDS):
+    """
+    Renders a case of CORPUS with an engine of ENGINES.
+
+    Returns an n_channels x (seconds*FS) float64 array. The synth is seeded
+    with GOLDEN_SEED, so the same case and engine always make the same
+    grains.
+    """
+    synth = pm_synth.Phase_Mod_Synth(fs=default.FS, n_gen=case["n_gen"],
+                                     seed=default.GOLDEN_SEED,
+                                     **engine["synth"])
+    synth.load_patch(case["patch"].prepare(synth))
+    synth.lut_osc = engine.get("lut_osc", False)
+    block_len = engine.get("block_len", default.BUFFER_LEN)
+    n_frames = int(seconds*default.FS)
+    if "envelope" in case:
+        synth.swap_patch()
+        envelope = pm_synth.Envelope(synth)
+        envelope.curr_rates = list(case["envelope"]["rates"])
+        envelope.curr_levels = list(case["envelope"]["levels"])
+        synth.route(envelope, synth.ops[case["envelope"]["op"]])
+    if "events" in case:
+        collector = Block_Collector()
+        pm_synth_render.render_events(synth, case["events"], collector,
+                                      tail=seconds - case["events"][-1][0],
+                                      chunk_len=block_len)
+        return(np.concatenate(collector.blocks, axis=1))
+    audio = np.zeros((synth.n_channels, n_frames))
+    for start in range(0, n_frames, block_len):
+        n = min(block_len, n_frames - start)
+        audio[:, start:start+n] = synth.synthesize(n)
+    return(audio)
+
+
+def spectrum(audio):
+    """
+    Downsampled spectrum of audio (summed over channels), in dB.
+
+    The power spectrum is averaged over Hann-windowed frames of
+    GOLDEN_FFT_LEN samples, then averaged into GOLDEN_BANDS equal bands.
+    Levels are floored at GOLDEN_FLOOR_DB.
+    """
+    mono = np.sum(audio, axis=0)
+    n_fft = default.GOLDEN_FFT_LEN
+    frames = mono[:len(mono)//n_fft*n_fft].reshape(-1, n_fft)*np.hanning(n_fft)
+    power = np.mean(np.abs(np.fft.rfft(frames, axis=1))**2, axis=0)/n_fft
+    bands = np.mean(power[1:].reshape(default.GOLDEN_BANDS, -1), axis=1)
+    return(np.maximum(10*np.log10(bands + 1e-30), default.GOLDEN_FLOOR_DB))
+
+
+def excerpt(audio):
+    """ The middle GOLDEN_EXCERPT_LEN samples of every channel of audio. """
+    start = (audio.shape[1] - default.GOLDEN_EXCERPT_LEN)//2
+    return(audio[:, start:start+default.GOLDEN_EXCERPT_LEN])
+
+
+def fingerprint(audio):
+    """ Compact, JSON-friendly description of audio, see compare(). """
+    return({"hash": hashlib.sha256(np.ascontiguousarray(audio, dtype="<f8")).hexdigest(),
+            "shape": list(audio.shape),
+            "peak": float(np.max(np.abs(audio))),
+            "excerpt": np.round(excerpt(audio), 7).tolist(),
+            "spectrum": np.round(spectrum(audio), 3).tolist()})
+
+
+def diff(a, b):
+    """
+    Sample-level difference between two renders of the same length.
+
+    Returns (max_error, snr), the largest absolute difference between
+    samples, and the ratio of the power of a to the power of the difference,
+    in dB (inf if they are identical).
+    """
+    error = a - b
+    noise = np.mean(error**2)
+    if noise == 0:
+        return((0.0, np.inf))
+    return((float(np.max(np.abs(error))),
+            float(10*np.log10(np.mean(a**2)/noise))))
+
+
+def compare(golden, audio, sample_tol, spectrum_tol):
+    """
+    Compares audio against a golden fingerprint.
+
+    Returns (status, sample_error, spectrum_error), where status is "exact"
+    if the hashes match, "close" if the excerpt is within sample_tol (or
+    sample_tol is None) and the spectrum within spectrum_tol dB (the mean
+    absolute difference over bands either of which is within
+    GOLDEN_RANGE_DB of the loudest band), and "FAIL" otherwise.
+    """
+    if list(audio.shape) != golden["shape"]:
+        return(("FAIL", np.inf, np.inf))
+    ours = fingerprint(audio)
+    if ours["hash"] == golden["hash"]:
+        return(("exact", 0.0, 0.0))
+    sample_error = float(np.max(np.abs(excerpt(audio) - np.array(golden["excerpt"]))))
+    golden_spectrum = np.array(golden["spectrum"])
+    our_spectrum = spectrum(audio)
+    loudest = np.maximum(golden_spectrum, our_spectrum)
+    audible = loudest > max(np.max(loudest) - default.GOLDEN_RANGE_DB,
+                            default.GOLDEN_FLOOR_DB)
+    spectrum_error = 0.0
+    if np.any(audible):
+        spectrum_error = float(np.mean(np.abs(golden_spectrum - our_spectrum)[audible]))
+    if ((sample_tol is None or sample_error <= sample_tol) and
+            spectrum_error <= spectrum_tol):
+        return(("close", sample_error, spectrum_error))
+    return(("FAIL", sample_error, spectrum_error))
+
+
+def record(path=default.GOLDEN_PATH):
+    """ Renders every case with the reference engine, and saves the result. """
+    golden = {"fs": default.FS, "seconds": default.GOLDEN_SECONDS,
+              "seed": default.GOLDEN_SEED,
+              "cases": {name: fingerprint(render(case))
+                        for name, case in CORPUS.items()}}
+    with open(path, "w") as f:
+        json.dump(golden, f, indent=1)
+    return(golden)
+
+
+def check(path=default.GOLDEN_PATH, engines=None):
+    """
+    Checks engines (names in ENGINES, all if None) against a golden file.
+
+    Returns a list of (engine, case, status, sample_error, spectrum_error).
+    Every Algorithm must have a case in CORPUS and in the golden file;
+    otherwise its status is "MISSING".
+    """
+    with open(path) as f:
+        golden = json.load(f)
+    if engines is None:
+        engines = list(ENGINES)
+    results = []
+    covered = set(case["patch"].algorithm for name, case in CORPUS.items()
+                  if name in golden["cases"])
+    for algorithm in pm_synth.ALGORITHMS:
+        if algorithm not in covered:
+            results.append(("-", algorithm, "MISSING", np.inf, np.inf))
+    for engine in engines:
+        for name, case in CORPUS.items():
+            if name not in golden["cases"]:
+                continue
+            status = compare(golden["cases"][name], render(case, ENGINES[engine]),
+                             ENGINES[engine]["sample_tol"],
+                             ENGINES[engine]["spectrum_tol"])
+            results.append((engine, name) + status)
+    return(results)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in ["record", "check"]:
+        print(__doc__)
+        sys.exit(2)
+    path = default.GOLDEN_PATH
+    if len(sys.argv) > 2:
+        path = sys.argv[2]
+    if sys.argv[1] == "record":
+        record(path)
+        print("Recorded " + str(len(CORPUS)) + " cases to " + path)
+        sys.exit(0)
+    engines = None
+    if len(sys.argv) > 3:
+        engines = sys.argv[3:]
+    results = check(path, engines)
+    for engine, name, status, sample_error, spectrum_error in results:
+        print(engine.ljust(12) + name.ljust(20) + status.ljust(8) +
+              "max sample error " + format(sample_error, ".2e") +
+              ", spectrum error " + format(spectrum_error, ".3f") + " dB")
+    sys.exit(0 if all(result[2] in ["exact", "close"] for result in results) else 1)
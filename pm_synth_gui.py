@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@title: pm_synth_gui.py
+@date: 08/13/16
+@author: Daniel Guest
+@purpose: Qt front-end for pm_synth, which plays the synth on the default
+          audio device and controls it with the widgets in 
+          pm_synth_widgets.py. Only this module (and the widgets) import 
+          PyQt5, and sounddevice is only imported by its audio backend once
+          the synth thread starts, so the rest of pm_synth runs without a 
+          display or an audio device. Started by main.py.
+@requirements: PyQt5, sounddevice, numpy, python-rtmidi (optional)
+"""
+
+import sys
+from PyQt5.QtCore import *
+from PyQt5.QtWidgets import *
+from PyQt5.QtGui import * 
+from functools import partial
+import pm_synth
+import pm_synth_midi as midi
+import pm_synth_widgets as widg
+import pm_synth_controller as ctrl
+import pm_synth_rtcheck as rtcheck
+import pm_synth_metrics as metrics
+import pm_synth_audio as audio
+import pm_synth_defaults as default
+
+class MainWindow(QMainWindow):
+    """
+    Main window for application.
+    
+    Creates the central widget (containing the proper number of interface
+    groups for the number of operators and generators being used) and then
+    initializes a Synth_Thread with the proper controller callback. Finally the
+    Synth_Thread's begin() method is called.
+    """
+    def __init__(self, parent=None):
+        super(MainWindow, self).__init__(parent)
+        
+        # Set number of operators per voice and central widget
+        self.n_op = default.N_OP
+        self.n_gen = default.N_GEN
+        self.cw = widg.CenterWidget(self, n_op=self.n_op)
+        self.setCentralWidget(self.cw)
+    
+        # Create synth thread and give it the proper control setup callback
+        op_ctrls = []
+        synth_ctrl = None
+        gen_ctrl = []
+        def establish_ctrl(n_op, n_gen):
+            for i in range(n_op):
+                op_ctrls.append(ctrl.Operator_Controller(self.synth.synth_kernel.ops[i]))
+                op_ctrls[i].bind_interface(self.cw.opgs[i])
+            synth_ctrl = ctrl.Synth_Controller(self.synth.synth_kernel)
+            synth_ctrl.bind_interface(self.cw)
+            for i in range(n_gen):
+                gen_ctrl.append(ctrl.Generator_Controller(self.synth.synth_kernel.gens[i]))
+                gen_ctrl[i].bind_interface(self.cw.gengs[i])
+        controller_setup = partial(establish_ctrl, n_op=self.n_op,
+                                   n_gen=self.n_gen)
+        self.synth = Synth_Thread(controller_setup=controller_setup,
+                                  n_op=self.n_op, n_gen=self.n_gen)
+        
+        # Start synth
+        self.synth.begin()
+        
+        # Open MIDI input, if there is one (rtmidi calls back on its thread)
+        try:
+            self.midi = midi.Midi_Input(self.synth.midi_queue)
+        except Exception as e:
+            self.midi = None
+            print("No MIDI input available: " + str(e))
+        
+
+class Synth_Thread(QThread):
+    """
+    Provides a QThread for the synthesizer.
+    
+    Initializes a pm_synth instance with the proper number of operators and
+    generators. Then, when its begin() method is called by the main window
+    __init__(), it sets up the controllers and starts the AUDIO_BACKEND set in
+    pm_synth_defaults.py (the sound device, unless testing without one, see 
+    pm_synth_audio.py), whose timing summary is printed on quitting. MIDI 
+    events pushed into midi_queue are applied by the synth at
+    sample-accurate offsets, see pm_synth_midi.py, and changes made with the
+    widgets are rate limited and applied between blocks, see Control_Queue
+    in pm_synth_controller.py, whose held changes are flushed by a timer 
+    on the GUI thread about once a block. If RT_CHECK is set in 
+    pm_synth_defaults.py, the callback is wrapped in a Realtime_Checker and
+    its summary is printed on quitting, see pm_synth_rtcheck.py. If 
+    METRICS_PORT is set, engine metrics are served on that port, see 
+    pm_synth_metrics.py.
+    """
+    def __init__(self, parent=None, controller_setup=None, n_op=default.N_OP,
+                 n_gen=default.N_GEN):
+        QThread.__init__(self, parent)
+        
+        self.exiting = False
+        self.synth_kernel = pm_synth.Phase_Mod_Synth(fs=default.FS, n_op=n_op,
+                                                     n_gen=n_gen)
+        self.controller_setup = controller_setup
+        self.block_size = default.BLOCK_LEN
+        self.midi_queue = midi.Event_Queue()
+        self.synth_kernel.midi_scheduler = midi.Midi_Scheduler(self.midi_queue,
+                                                               fs=default.FS)
+        self.synth_kernel.control_queue = ctrl.Control_Queue()
+        self.checker = None
+        if default.RT_CHECK:
+            self.checker = rtcheck.Realtime_Checker(default.FS)
+        self.metrics = None
+        if default.METRICS_PORT is not None:
+            self.metrics = metrics.Engine_Metrics(self.synth_kernel)
+        
+    def callback(self, outdata, frames, time, status):
+        # outdata is frames x channels, so its transpose is the channels x
+        # frames layout the synth writes, and no interleaving is needed
+        self.synth_kernel.synthesize(frames, out=outdata.T)
+        if status.output_underflow and self.metrics is not None:
+            self.metrics.count_underrun()
+
+    def begin(self):
+        self.controller_setup()
+        # Created here, so that the timer runs on the GUI thread
+        self.flush_timer = QTimer()
+        self.flush_timer.timeout.connect(self.synth_kernel.control_queue.flush)
+        self.flush_timer.start(max(1, round(1000*self.block_size/default.FS)))
+        self.start()
+    
+    def run(self):
+        callback = self.callback
+        if self.checker is not None:
+            callback = self.checker.wrap(self.callback)
+            self.checker.start()
+        if self.metrics is not None:
+            server = metrics.Metrics_Server(self.metrics.registry,
+                                            port=default.METRICS_PORT)
+            server.start()
+        backend = audio.make_backend(default.AUDIO_BACKEND, callback,
+                                     fs=default.FS, block_len=self.block_size,
+                                     n_channels=self.synth_kernel.n_channels)
+        backend.start()
+        self.synth_kernel.midi_scheduler.start()
+        print("press Return to quit")
+        input()
+        backend.stop()
+        print(backend.summary())
+        if self.checker is not None:
+            self.checker.stop()
+            print(self.checker.summary())
+        if self.metrics is not None:
+            server.stop()
+            
+    
+def main():
+    app = QApplication(sys.argv)
+    app.setApplicationName("Phase Modulation Synthesizer")
+    mainWindow = MainWindow()
+    mainWindow.show()
+    app.exec_()
+
+    
+if __name__ == "__main__":
+    main()
+
@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@title: pm_synth_metrics.py
+@date: 10/19/2026
+@author: Daniel Guest
+@purpose: Metrics for a running pm_synth. Counters, gauges and histograms
+          live in a registry of arrays allocated up front, so the audio
+          thread only ever writes numbers into slots it already has, without
+          locks. Any other thread can read them at any time, and export them
+          in Prometheus text format over a small local HTTP endpoint, or as
+          JSON snapshots written to a file every so often.
+"""
+import os
+import json
+import time
+import bisect
+import threading
+import numpy as np
+import pm_synth_defaults as default
+
+
+class Metrics_Registry(object):
+    """
+    Preallocated registry of metrics.
+
+    Arguments:
+        capacity (int) -- most counter and gauge values the registry holds.
+
+    Attributes:
+        values (array) -- the value of every counter and gauge, one per slot.
+        families (list) -- one dict per metric name, with its "name", "help",
+            "kind" ("counter", "gauge" or "histogram"), and "samples", a list
+            of (labels, slot) pairs, where labels is the Prometheus label
+            string (e.g. 'gen="0"') or "".
+        bounds (list) -- each histogram's bucket upper bounds.
+        counts (list of array) -- each histogram's count per bucket (the
+            last bucket is everything over the last bound).
+        sums (array) -- each histogram's sum of observed values.
+
+    Metrics are registered once, before streaming, which is the only time
+    anything is allocated. Registering returns a slot (or histogram number),
+    and from then on inc(), set() and observe() just write into the arrays.
+    Only one thread (the audio thread) should write a given slot, so there's
+    nothing to lock; readers might see a block old value, which is fine.
+    """
+    def __init__(self, capacity=default.METRICS_CAPACITY):
+        self.values = np.zeros(capacity)
+        self.n_slots = 0
+        self.families = []
+        self.by_name = {}
+        self.bounds = []
+        self.counts = []
+        self.sums = np.zeros(capacity)
+
+    def register(self, name, help, kind, labels=""):
+        """ Adds a sample to the family called name, returns its slot. """
+        if self.n_slots == len(self.values):
+            raise ValueError("Metrics registry is full")
+        if name not in self.by_name:
+            self.by_name[name] = {"name": name, "help": help, "kind": kind,
+                                  "samples": []}
+            self.families.append(self.by_name[name])
+        slot = self.n_slots
+        self.by_name[name]["samples"].append((labels, slot))
+        self.n_slots = slot + 1
+        return(slot)
+
+    def counter(self, name, help, labels=""):
+        return(self.register(name, help, "counter", labels))
+
+    def gauge(self, name, help, labels=""):
+        return(self.register(name, help, "gauge", labels))
+
+    def histogram(self, name, help, buckets=default.METRICS_BUCKETS):
+        """
+        Registers a histogram with the given bucket upper bounds (by
+        default, for block render times in seconds), returns its number.
+        """
+        h = len(self.bounds)
+        self.bounds.append(list(buckets))
+        self.counts.append(np.zeros(len(buckets) + 1, dtype=np.int64))
+        self.register(name, help, "histogram", str(h))
+        return(h)
+
+    def inc(self, slot, amount=1):
+        self.values[slot] += amount
+
+    def set(self, slot, value):
+        self.values[slot] = value
+
+    def observe(self, h, value):
+        """ Adds value to histogram h. """
+        self.counts[h][bisect.bisect_left(self.bounds[h], value)] += 1
+        self.sums[h] += value
+
+    def to_prometheus(self):
+        """ Returns every metric in Prometheus text exposition format. """
+        lines = []
+        for family in self.families:
+            name = family["name"]
+            lines.append("# HELP " + name + " " + family["help"])
+            lines.append("# TYPE " + name + " " + family["kind"])
+            for labels, slot in family["samples"]:
+                if family["kind"] == "histogram":
+                    h = int(labels)
+                    cumulative = np.cumsum(self.counts[h])
+                    les = [repr(bound) for bound in self.bounds[h]] + ["+Inf"]
+                    for le, count in zip(les, cumulative):
+                        lines.append(name + '_bucket{le="' + le + '"} ' + str(count))
+                    lines.append(name + "_sum " + repr(float(self.sums[h])))
+                    lines.append(name + "_count " + str(cumulative[-1]))
+                elif labels == "":
+                    lines.append(name + " " + repr(float(self.values[slot])))
+                else:
+                    lines.append(name + "{" + labels + "} " +
+                                 repr(float(self.values[slot])))
+        return("\n".join(lines) + "\n")
+
+    def to_dict(self):
+        """ Returns every metric as a dict, for JSON. """
+        d = {}
+        for family in self.families:
+            name = family["name"]
+            for labels, slot in family["samples"]:
+                if family["kind"] == "histogram":
+                    h = int(labels)
+                    cumulative = np.cumsum(self.counts[h])
+                    les = [repr(bound) for bound in self.bounds[h]] + ["+Inf"]
+                    d[name] = {"buckets": dict(zip(les, cumulative.tolist())),
+                               "sum": float(self.sums[h]),
+                               "count": int(cumulative[-1])}
+                elif labels == "":
+                    d[name] = float(self.values[slot])
+                else:
+                    d.setdefault(name, {})[labels] = float(self.values[slot])
+        return(d)
+
+
+class Engine_Metrics(object):
+    """
+    The standard set of metrics for a Phase_Mod_Synth.
+
+    Arguments:
+        synth (Phase_Mod_Synth object) -- synth to measure. Setting up an
+            Engine_Metrics sets synth.metrics, so the synth calls update()
+            after every block.
+        registry (None, or Metrics_Registry) -- registry to put the metrics
+            in. If None, a new one is made.
+
+    Metrics (all prefixed pm_synth_): blocks_total, frames_total,
+    late_blocks_total (blocks that took longer to render than they last),
+    underruns_total (see count_underrun()), block_seconds (histogram of
+    render times), load (render time over block duration, last block),
+    grains (per generator, labelled gen), voices (notes held),
+    delay_line_bytes (labelled backing="ram" or "file"), op_cache_hits_total
+    and op_cache_misses_total, and governor_level and grains_stolen_total.
+    Generators are registered for the synth's generators when this is made,
+    so a patch with more generators only reports the first ones. The
+    operator cache and the governor keep running totals of their own, so
+    their counters are increased by how much those totals grew since the
+    last block (or by the whole total, if it went down because the cache or
+    governor was replaced).
+    """
+    def __init__(self, synth, registry=None):
+        if registry is None:
+            registry = Metrics_Registry()
+        self.synth = synth
+        self.registry = registry
+        r = registry
+        self.blocks = r.counter("pm_synth_blocks_total", "Blocks rendered.")
+        self.frames = r.counter("pm_synth_frames_total", "Frames rendered.")
+        self.late = r.counter("pm_synth_late_blocks_total",
+                              "Blocks that took longer to render than they last.")
+        self.underruns = r.counter("pm_synth_underruns_total",
+                                   "Underruns reported by the audio device.")
+        self.block_seconds = r.histogram("pm_synth_block_seconds",
+                                         "Seconds taken to render a block.")
+        self.load = r.gauge("pm_synth_load",
+                            "Render time over block duration, last block.")
+        self.grains = [r.gauge("pm_synth_grains", "Grains playing.",
+                               'gen="' + str(i) + '"')
+                       for i in range(len(synth.gens))]
+        self.voices = r.gauge("pm_synth_voices", "Notes held.")
+        self.ram_bytes = r.gauge("pm_synth_delay_line_bytes",
+                                 "Size of the delay lines.", 'backing="ram"')
+        self.file_bytes = r.gauge("pm_synth_delay_line_bytes",
+                                  "Size of the delay lines.", 'backing="file"')
+        self.cache_hits = r.counter("pm_synth_op_cache_hits_total",
+                                    "Blocks played from the operator cache.")
+        self.cache_misses = r.counter("pm_synth_op_cache_misses_total",
+                                      "Blocks the operator cache couldn't play.")
+        self.level = r.gauge("pm_synth_governor_level",
+                             "Load governor quality level, 0 is full quality.")
+        self.stolen = r.counter("pm_synth_grains_stolen_total",
+                                "Grains dropped by the load governor.")
+        self.last_totals = {}
+        synth.metrics = self
+
+    def update(self, elapsed, n_frames):
+        """ Called by the synth after every block, see above. """
+        r = self.registry
+        synth = self.synth
+        r.inc(self.blocks)
+        r.inc(self.frames, n_frames)
+        load = elapsed*synth.fs/n_frames
+        if load > 1:
+            r.inc(self.late)
+        r.set(self.load, load)
+        r.observe(self.block_seconds, elapsed)
+        for slot, gen in zip(self.grains, synth.gens):
+            r.set(slot, gen.n_grains)
+        r.set(self.voices, len(synth.held_notes))
+        ram = 0
+        disk = 0
+        for op in synth.ops:
+            if op.delay_line is not None:
+                if op.delay_line.map is None:
+                    ram = ram + op.delay_line.bank.nbytes
+                else:
+                    disk = disk + op.delay_line.bank.nbytes
+        r.set(self.ram_bytes, ram)
+        r.set(self.file_bytes, disk)
+        if synth.op_cache is not None:
+            self.inc_to(self.cache_hits, synth.op_cache.n_hits)
+            self.inc_to(self.cache_misses, synth.op_cache.n_misses)
+        if synth.governor is not None:
+            r.set(self.level, synth.governor.level)
+            self.inc_to(self.stolen, synth.governor.n_stolen)
+
+    def inc_to(self, slot, total):
+        """ Increases counter slot by how much total grew since last time. """
+        last = self.last_totals.get(slot, 0)
+        if total < last:
+            last = 0
+        if total > last:
+            self.registry.inc(slot, total - last)
+        self.last_totals[slot] = total
+
+    def count_underrun(self):
+        """ Called by whoever runs the audio device, when it underruns. """
+        self.registry.inc(self.underruns)
+
+
+class Metrics_Server(object):
+    """
+    Small local HTTP endpoint for a Metrics_Registry.
+
+    Arguments:
+        registry (Metrics_Registry object) -- registry to serve.
+        host (str) -- address to listen on.
+        port (int) -- port to listen on (0 picks a free port).
+
+    GET /metrics returns Prometheus text, and GET /metrics.json a JSON
+    snapshot. The server runs on its own daemon thread, and only reads the
+    registry. http.server is only imported once a server is made, since 
+    importing it takes longer than the rest of this module.
+    """
+    def __init__(self, registry, host="127.0.0.1", port=0):
+        import http.server
+        self.registry = registry
+        metrics_server = self
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == "/metrics":
+                    body = metrics_server.registry.to_prometheus().encode("utf-8")
+                    kind = "text/plain; version=0.0.4"
+                elif self.path == "/metrics.json":
+                    body = json.dumps(metrics_server.registry.to_dict()).encode("utf-8")
+                    kind = "application/json"
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", kind)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+        self.server = http.server.ThreadingHTTPServer((host, port), Handler)
+        self.port = self.server.server_address[1]
+        self.thread = None
+
+    def start(self):
+        """ Starts serving, and returns the port actually used. """
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       daemon=True)
+        self.thread.start()
+        return(self.port)
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class Snapshot_Writer(object):
+    """
+    Writes JSON snapshots of a Metrics_Registry to a file every so often.
+
+    Arguments:
+        registry (Metrics_Registry object) -- registry to snapshot.
+        path (str) -- file to write. Each snapshot replaces the last one, and
+            is written to a temporary file first, so the file is never
+            half-written.
+        every (float) -- seconds between snapshots.
+    """
+    def __init__(self, registry, path, every=default.METRICS_SNAPSHOT_EVERY):
+        self.registry = registry
+        self.path = path
+        self.every = every
+        self.stopping = threading.Event()
+        self.thread = None
+        self.n_written = 0
+
+    def write(self):
+        """ Writes one snapshot now. """
+        snapshot = {"time": time.time(), "metrics": self.registry.to_dict()}
+        with open(self.path + ".tmp", "w") as f:
+            json.dump(snapshot, f)
+        os.replace(self.path + ".tmp", self.path)
+        self.n_written = self.n_written + 1
+
+    def run(self):
+        while not self.stopping.wait(self.every):
+            self.write()
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """ Stops, writing one last snapshot. """
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.write()
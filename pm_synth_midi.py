@@ -0,0 +1,380 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@title: pm_synth_midi.py
+@date: 10/19/2026
+@author: Daniel Guest
+@purpose: MIDI input for pm_synth. MIDI messages are timestamped the moment
+          they arrive, passed to the audio thread through a preallocated
+          queue, and applied by the synth at the exact sample they belong to
+          inside of a buffer. A Standard MIDI File player can stand in for a
+          real MIDI device, so that latency and jitter can be measured without
+          any hardware.
+"""
+import time
+import heapq
+import threading
+import pm_synth_defaults as default
+
+
+class Event_Queue(object):
+    """
+    Preallocated single-producer, single-consumer queue of MIDI events.
+
+    Arguments:
+        capacity (int) -- maximum number of events waiting in the queue.
+
+    Attributes:
+        times (list) -- event timestamps in seconds.
+        statuses, data1s, data2s (list) -- MIDI status and data bytes.
+        head (int) -- total number of events popped. Only the consumer (the
+            audio thread) writes this.
+        tail (int) -- total number of events pushed. Only the producer (the
+            MIDI thread) writes this.
+        n_dropped (int) -- number of events dropped because the queue was full.
+
+    All storage is allocated up front, so pushing and popping never allocate
+    memory. Since each index is only written by one side, no lock is needed.
+    """
+    def __init__(self, capacity=default.MIDI_QUEUE_LEN):
+        self.capacity = capacity
+        self.times = [0.0]*capacity
+        self.statuses = [0]*capacity
+        self.data1s = [0]*capacity
+        self.data2s = [0]*capacity
+        self.head = 0
+        self.tail = 0
+        self.n_dropped = 0
+
+    def push(self, timestamp, status, data1=0, data2=0):
+        """ Adds an event, returning False (and dropping it) if full. """
+        if self.tail - self.head >= self.capacity:
+            self.n_dropped = self.n_dropped + 1
+            return(False)
+        i = self.tail % self.capacity
+        self.times[i] = timestamp
+        self.statuses[i] = status
+        self.data1s[i] = data1
+        self.data2s[i] = data2
+        self.tail = self.tail + 1
+        return(True)
+
+    def peek_time(self):
+        """ Timestamp of the oldest event, or None if the queue is empty. """
+        if self.tail == self.head:
+            return(None)
+        return(self.times[self.head % self.capacity])
+
+    def pop(self):
+        """ Removes the oldest event and returns (status, data1, data2). """
+        i = self.head % self.capacity
+        event = (self.statuses[i], self.data1s[i], self.data2s[i])
+        self.head = self.head + 1
+        return(event)
+
+    def __len__(self):
+        return(self.tail - self.head)
+
+
+class Midi_Scheduler(object):
+    """
+    Delivers queued MIDI events to a synth at sample-accurate offsets.
+
+    Arguments:
+        queue (Event_Queue object) -- queue to read events from.
+        fs (int) -- sampling rate in Hz.
+        latency (int) -- fixed delay, in samples, added to every event. This
+            gives events that arrive during a buffer a chance to still be
+            scheduled at the right place in a later buffer.
+        speed (float) -- how many seconds of audio are played per second of
+            timestamp. Only the file player uses anything but 1.
+        clock (function) -- returns the current time in seconds. Must be the
+            same clock used to timestamp the events.
+
+    Attributes:
+        start_time (float) -- timestamp at which sample 0 was played.
+        applied (list) -- sample at which each of the last n events was
+            applied, used to measure latency and jitter.
+        requested (list) -- sample at which each of the last n events should
+            have been applied.
+        n_applied (int) -- number of events applied so far.
+        n_late (int) -- number of events which arrived too late to be placed
+            at the right sample, and were applied at the start of a buffer.
+
+    An event with timestamp t belongs at sample (t - start_time)*fs*speed +
+    latency. Each time the synth calls dispatch(), every event that belongs in
+    the current buffer is popped and handed to the synth's handle_midi(),
+    along with its offset inside of the buffer.
+    """
+    def __init__(self, queue, fs, latency=default.MIDI_LATENCY, speed=1.0,
+                 clock=time.perf_counter, history_len=default.MIDI_QUEUE_LEN):
+        self.queue = queue
+        self.fs = fs
+        self.latency = latency
+        self.speed = speed
+        self.clock = clock
+        self.start_time = clock()
+        self.history_len = history_len
+        self.applied = [0]*history_len
+        self.requested = [0]*history_len
+        self.n_applied = 0
+        self.n_late = 0
+
+    def start(self, start_time=None):
+        """ Marks the moment sample 0 is played, defaulting to now. """
+        if start_time is None:
+            start_time = self.clock()
+        self.start_time = start_time
+
+    def dispatch(self, synth):
+        """ Applies all events that belong in synth's current buffer. """
+        block_start = synth.curr_sample
+        while True:
+            timestamp = self.queue.peek_time()
+            if timestamp is None:
+                break
+            sample = int(round((timestamp - self.start_time)*self.fs*self.speed)) + self.latency
+            offset = sample - block_start
+            if offset >= synth.block_len:
+                break
+            if offset < 0:
+                offset = 0
+                self.n_late = self.n_late + 1
+            status, data1, data2 = self.queue.pop()
+            synth.handle_midi(status, data1, data2, offset)
+            i = self.n_applied % self.history_len
+            self.applied[i] = block_start + offset
+            self.requested[i] = sample
+            self.n_applied = self.n_applied + 1
+
+    def latency_stats(self, file_times=None):
+        """
+        Returns (mean, max, jitter) of scheduling error in milliseconds.
+
+        Arguments:
+            file_times (None, or list) -- if given, the times in seconds at
+                which each event was meant to be played (e.g. from a
+                Midi_File_Player), which makes this an end-to-end measurement
+                that includes any timing error of the sender.
+
+        Scheduling error is how much later than requested an event was
+        applied, over the last history_len events. Jitter is its standard
+        deviation.
+        """
+        n = min(self.n_applied, self.history_len)
+        if n == 0:
+            return((0.0, 0.0, 0.0))
+        errors = []
+        for k in range(self.n_applied - n, self.n_applied):
+            i = k % self.history_len
+            requested = self.requested[i]
+            if file_times is not None:
+                requested = int(round(file_times[k]*self.fs)) + self.latency
+            errors.append((self.applied[i] - requested)/self.fs*1000)
+        mean = sum(errors)/n
+        jitter = (sum([(e - mean)**2 for e in errors])/n)**0.5
+        return((mean, max(errors), jitter))
+
+
+class Midi_Input(object):
+    """
+    Real MIDI input device, using python-rtmidi.
+
+    Arguments:
+        queue (Event_Queue object) -- queue to push events into.
+        port (int) -- index of the MIDI input port to open.
+        clock (function) -- see Midi_Scheduler doc string.
+
+    rtmidi calls back from its own input thread. The callback does nothing but
+    timestamp the message and push it into the queue.
+    """
+    def __init__(self, queue, port=0, clock=time.perf_counter):
+        import rtmidi
+        self.queue = queue
+        self.clock = clock
+        self.midi_in = rtmidi.MidiIn()
+        self.ports = self.midi_in.get_ports()
+        self.midi_in.open_port(port)
+        self.midi_in.set_callback(self.callback)
+
+    def callback(self, event, data=None):
+        timestamp = self.clock()
+        message = event[0]
+        if len(message) == 3:
+            self.queue.push(timestamp, message[0], message[1], message[2])
+        elif len(message) == 2:
+            self.queue.push(timestamp, message[0], message[1], 0)
+
+    def close(self):
+        self.midi_in.cancel_callback()
+        self.midi_in.close_port()
+
+
+class Midi_File_Player(threading.Thread):
+    """
+    Stand-in for a MIDI device which plays back a Standard MIDI File.
+
+    Arguments:
+        queue (Event_Queue object) -- queue to push events into.
+        path (str) -- path to the .mid file.
+        speed (float) -- playback speed relative to real time.
+        clock (function) -- see Midi_Scheduler doc string.
+
+    Attributes:
+        file_times (list) -- file time in seconds of each event sent, so
+            that the played back timing can be compared to the original.
+
+    Just like Midi_Input, the player timestamps each event when it "arrives"
+    (i.e. when the player wakes up to send it), so sleep inaccuracy shows up
+    as jitter exactly like a real device's timing would.
+    """
+    def __init__(self, queue, path, speed=1.0, clock=time.perf_counter):
+        threading.Thread.__init__(self, daemon=True)
+        self.queue = queue
+        self.path = path
+        self.speed = speed
+        self.clock = clock
+        self.start_time = None
+        self.file_times = []
+
+    def run(self):
+        if self.start_time is None:
+            self.start_time = self.clock()
+        for seconds, status, data1, data2 in iter_midi_file(self.path):
+            wait = self.start_time + seconds/self.speed - self.clock()
+            if wait > 0:
+                time.sleep(wait)
+            self.file_times.append(seconds)
+            self.queue.push(self.clock(), status, data1, data2)
+
+
+def run_loopback(synth, path, speed=4.0, latency=default.MIDI_LATENCY):
+    """
+    Plays a MIDI file into synth faster than real time, and measures timing.
+
+    Arguments:
+        synth (Phase_Mod_Synth object) -- synth to drive.
+        path (str) -- path to the .mid file.
+        speed (float) -- playback speed relative to real time.
+        latency (int) -- see Midi_Scheduler doc string.
+
+    The synth is run block by block, paced against the clock at the same
+    speed as the player, just like an audio device would pull blocks. Returns
+    the scheduler, whose latency_stats() give the measured timing.
+    """
+    queue = Event_Queue()
+    scheduler = Midi_Scheduler(queue, fs=synth.fs, latency=latency,
+                               speed=speed)
+    player = Midi_File_Player(queue, path, speed=speed)
+    synth.midi_scheduler = scheduler
+    start_time = time.perf_counter()
+    scheduler.start(start_time)
+    player.start_time = start_time
+    player.start()
+    block_dur = default.BUFFER_LEN/synth.fs/speed
+    while player.is_alive() or len(queue) > 0:
+        wait = start_time + synth.curr_inv*block_dur - time.perf_counter()
+        if wait > 0:
+            time.sleep(wait)
+        synth.synthesize()
+    synth.midi_scheduler = None
+    return(scheduler.latency_stats(file_times=player.file_times))
+
+
+# ----- STANDARD MIDI FILES -----
+
+
+def iter_midi_file(path):
+    """
+    Lazily reads a Standard MIDI File (format 0 or 1).
+
+    Yields (seconds, status, data1, data2) for each channel message, in time
+    order across all tracks. Tempo changes are followed; other meta events and
+    sysex are skipped. Tracks are decoded one event at a time and merged, so
+    no full event list is ever built.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    if data[:4] != b"MThd":
+        raise ValueError(path + " is not a Standard MIDI File")
+    header_len = int.from_bytes(data[4:8], "big")
+    n_tracks = int.from_bytes(data[10:12], "big")
+    division = int.from_bytes(data[12:14], "big")
+
+    # Find the start and end of each track chunk
+    tracks = []
+    pos = 8 + header_len
+    while pos + 8 <= len(data) and len(tracks) < n_tracks:
+        chunk_len = int.from_bytes(data[pos+4:pos+8], "big")
+        if data[pos:pos+4] == b"MTrk":
+            tracks.append(_iter_track(data, pos + 8, pos + 8 + chunk_len, len(tracks)))
+        pos = pos + 8 + chunk_len
+
+    # Ticks to seconds, either by tempo (ticks per quarter) or by SMPTE
+    if division & 0x8000:
+        fps = 256 - (division >> 8)
+        seconds_per_tick = 1/(fps*(division & 0xFF))
+        tempo_based = False
+    else:
+        tempo = 500000
+        seconds_per_tick = tempo/1e6/division
+        tempo_based = True
+    last_tick = 0
+    seconds = 0.0
+    for tick, track, status, data1, data2 in heapq.merge(*tracks):
+        seconds = seconds + (tick - last_tick)*seconds_per_tick
+        last_tick = tick
+        if status == 0xFF:
+            if tempo_based:
+                seconds_per_tick = data1/1e6/division
+            continue
+        yield((seconds, status, data1, data2))
+
+
+def _read_varlen(data, pos):
+    """ Reads a MIDI variable-length quantity, returning (value, new pos). """
+    value = 0
+    while True:
+        byte = data[pos]
+        pos = pos + 1
+        value = (value << 7) | (byte & 0x7F)
+        if not byte & 0x80:
+            return((value, pos))
+
+
+def _iter_track(data, pos, end, track):
+    """
+    Yields (tick, track, status, data1, data2) for one track chunk.
+
+    Tempo changes are yielded with status 0xFF and the tempo in data1; all
+    other non-channel events are skipped.
+    """
+    tick = 0
+    running = 0
+    while pos < end:
+        delta, pos = _read_varlen(data, pos)
+        tick = tick + delta
+        status = data[pos]
+        if status & 0x80:
+            pos = pos + 1
+        else:
+            status = running
+        if status == 0xFF:
+            meta_type = data[pos]
+            length, pos = _read_varlen(data, pos + 1)
+            if meta_type == 0x51:
+                yield((tick, track, 0xFF, int.from_bytes(data[pos:pos+3], "big"), 0))
+            elif meta_type == 0x2F:
+                return
+            pos = pos + length
+        elif status == 0xF0 or status == 0xF7:
+            length, pos = _read_varlen(data, pos)
+            pos = pos + length
+        else:
+            running = status
+            if status & 0xF0 in (0xC0, 0xD0):
+                yield((tick, track, status, data[pos], 0))
+                pos = pos + 1
+            else:
+                yield((tick, track, status, data[pos], data[pos+1]))
+                pos = pos + 2
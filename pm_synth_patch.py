@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@title: pm_synth_patch.py
+@date: 10/19/2026
+@author: Daniel Guest
+@purpose: Save, load, and hot-swap pm_synth patches. A patch is everything
+          about a sound that you would want to recall later: the algorithm,
+          the master frequency, and the settings of every operator and
+          generator. Patches can be stored as JSON (easy to read and edit by
+          hand) or as a packed binary blob (small and fast to parse).
+"""
+import json
+import struct
+import numpy as np
+import pm_synth
+import pm_synth_defaults as default
+
+PATCH_VERSION = 1
+PATCH_MAGIC = b"PMSP"
+
+# Binary layout (little-endian). Header is followed by the algorithm name,
+# then one OP_STRUCT per operator and one GEN_STRUCT per generator.
+HEADER_STRUCT = struct.Struct("<4sHBBBB")  # magic, version, n_op, n_gen,
+                                           # master_freq, len(algorithm)
+OP_STRUCT = struct.Struct("<hd?")          # freq, amp_amt, integral_freq
+GEN_STRUCT = struct.Struct("<6I6d")        # GEN_KEYS, in order
+
+GEN_KEYS = ["curr_period", "curr_dur", "curr_lag", "curr_period_jitter",
+            "curr_dur_jitter", "curr_lag_jitter", "curr_rate",
+            "curr_rate_jitter", "curr_reverse_prob", "curr_amp_jitter",
+            "curr_pan", "curr_pan_jitter"]
+DEFAULT_GEN = {"curr_period": default.CURR_GEN_PERIOD,
+               "curr_dur": default.CURR_GRAIN_LEN,
+               "curr_lag": default.CURR_GEN_LAG,
+               "curr_period_jitter": default.CURR_GEN_PERIOD_JITTER,
+               "curr_dur_jitter": default.CURR_GRAIN_LEN_JITTER,
+               "curr_lag_jitter": default.CURR_LAG_JITTER,
+               "curr_rate": float(default.CURR_GRAIN_RATE),
+               "curr_rate_jitter": float(default.CURR_GRAIN_RATE_JITTER),
+               "curr_reverse_prob": float(default.CURR_GRAIN_REVERSE_PROB),
+               "curr_amp_jitter": float(default.CURR_GRAIN_AMP_JITTER),
+               "curr_pan": float(default.CURR_GRAIN_PAN),
+               "curr_pan_jitter": float(default.CURR_GRAIN_PAN_JITTER)}
+
+
+class Patch(object):
+    """
+    A pm_synth patch.
+
+    Arguments:
+        algorithm (str) -- name of an Algorithm in pm_synth.ALGORITHMS.
+        master_freq (int) -- master frequency on MIDI scale.
+        ops (list of dict) -- one dict per operator, with keys "freq",
+            "amp_amt", and "integral_freq" (see Operator doc string).
+        gens (list of dict) -- one dict per generator, with the keys in
+            GEN_KEYS (see Grain_Generator doc string). Missing keys take their
+            values from DEFAULT_GEN.
+
+    The number of ops must be the number the algorithm wires, and there must
+    be at least as many gens as it reads from, or a ValueError is raised, so
+    that a bad patch is caught when it is built or loaded rather than when
+    it is played. If ops is None, every operator is off.
+
+    A Patch is only a description of a sound and holds no audio buffers. To
+    play a Patch, call its prepare() method to get a Prepared_Patch for a
+    particular synth, and then hand that to the synth's load_patch() method.
+    """
+    def __init__(self, algorithm="a1_2op_1gen", master_freq=68, ops=None,
+                 gens=None):
+        if algorithm not in pm_synth.ALGORITHMS:
+            raise ValueError("Unknown algorithm: " + str(algorithm))
+        wiring = pm_synth.ALGORITHMS[algorithm]
+        self.algorithm = algorithm
+        self.master_freq = int(master_freq)
+        if ops is None:
+            ops = [{"freq": 0, "amp_amt": 0, "integral_freq": False}
+                   for op in range(wiring.n_op)]
+        if gens is None:
+            gens = [DEFAULT_GEN for gen in range(max(default.N_GEN,
+                                                     wiring.min_gen))]
+        if len(ops) != wiring.n_op:
+            raise ValueError("Algorithm " + algorithm + " wires " +
+                             str(wiring.n_op) + " operators, but the patch "
+                             "has " + str(len(ops)))
+        if len(gens) < wiring.min_gen:
+            raise ValueError("Algorithm " + algorithm + " needs at least " +
+                             str(wiring.min_gen) + " generators, but the "
+                             "patch has " + str(len(gens)))
+        self.ops = [{"freq": int(op["freq"]), "amp_amt": float(op["amp_amt"]),
+                     "integral_freq": bool(op["integral_freq"])} for op in ops]
+        self.gens = [{key: type(DEFAULT_GEN[key])(gen.get(key, DEFAULT_GEN[key]))
+                      for key in GEN_KEYS} for gen in gens]
+
+    @classmethod
+    def from_synth(cls, synth):
+        """ Captures the current state of a Phase_Mod_Synth as a Patch. """
+        ops = [{"freq": op.curr_freq[-1], "amp_amt": op.amp_amt,
+                "integral_freq": op.integral_freq} for op in synth.ops]
+        gens = [{key: getattr(gen, key) for key in GEN_KEYS}
+                for gen in synth.gens]
+        return(cls(algorithm=type(synth.algorithm).__name__,
+                   master_freq=synth.curr_master_freq, ops=ops, gens=gens))
+
+    # ----- DICT/JSON -----
+
+    def to_dict(self):
+        return({"version": PATCH_VERSION, "algorithm": self.algorithm,
+                "master_freq": self.master_freq, "ops": self.ops,
+                "gens": self.gens})
+
+    @classmethod
+    def from_dict(cls, d):
+        if d.get("version", PATCH_VERSION) != PATCH_VERSION:
+            raise ValueError("Unknown patch version " + str(d["version"]))
+        return(cls(algorithm=d["algorithm"], master_freq=d["master_freq"],
+                   ops=d["ops"], gens=d["gens"]))
+
+    def to_json(self):
+        return(json.dumps(self.to_dict(), indent=2))
+
+    @classmethod
+    def from_json(cls, text):
+        return(cls.from_dict(json.loads(text)))
+
+    # ----- BINARY -----
+
+    def to_bytes(self):
+        """ Packs the patch into the compact binary format described above. """
+        name = self.algorithm.encode("ascii")
+        chunks = [HEADER_STRUCT.pack(PATCH_MAGIC, PATCH_VERSION, len(self.ops),
+                                     len(self.gens), self.master_freq,
+                                     len(name)), name]
+        for op in self.ops:
+            chunks.append(OP_STRUCT.pack(op["freq"], op["amp_amt"],
+                                         op["integral_freq"]))
+        for gen in self.gens:
+            chunks.append(GEN_STRUCT.pack(*[gen[key] for key in GEN_KEYS]))
+        return(b"".join(chunks))
+
+    @classmethod
+    def from_bytes(cls, data):
+        """ Unpacks a patch made by to_bytes(). """
+        magic, version, n_op, n_gen, master_freq, name_len = \
+            HEADER_STRUCT.unpack_from(data, 0)
+        if magic != PATCH_MAGIC:
+            raise ValueError("Not a pm_synth patch")
+        if version != PATCH_VERSION:
+            raise ValueError("Unknown patch version " + str(version))
+        offset = HEADER_STRUCT.size
+        algorithm = data[offset:offset+name_len].decode("ascii")
+        offset = offset + name_len
+        ops = []
+        for i in range(n_op):
+            freq, amp_amt, integral_freq = OP_STRUCT.unpack_from(data, offset)
+            ops.append({"freq": freq, "amp_amt": amp_amt,
+                        "integral_freq": integral_freq})
+            offset = offset + OP_STRUCT.size
+        gens = []
+        for i in range(n_gen):
+            gens.append(dict(zip(GEN_KEYS, GEN_STRUCT.unpack_from(data, offset))))
+            offset = offset + GEN_STRUCT.size
+        return(cls(algorithm=algorithm, master_freq=master_freq, ops=ops,
+                   gens=gens))
+
+    # ----- FILES -----
+
+    def save(self, path):
+        """ Saves as JSON if path ends in .json, otherwise as binary. """
+        if path.endswith(".json"):
+            with open(path, "w") as f:
+                f.write(self.to_json())
+        else:
+            with open(path, "wb") as f:
+                f.write(self.to_bytes())
+
+    @classmethod
+    def load(cls, path):
+        """ Loads a patch saved by save(), sniffing the format. """
+        with open(path, "rb") as f:
+            data = f.read()
+        if data[:len(PATCH_MAGIC)] == PATCH_MAGIC:
+            return(cls.from_bytes(data))
+        return(cls.from_json(data.decode("utf-8")))
+
+    def prepare(self, synth):
+        """ Returns a Prepared_Patch of this patch for synth. """
+        return(Prepared_Patch(self, synth))
+
+
+class Prepared_Patch(object):
+    """
+    A patch with all of its expensive setup already done for a given synth.
+
+    Arguments:
+        patch (Patch object) -- the patch to prepare.
+        synth (Phase_Mod_Synth object) -- the synth it will be loaded into.
+
+    Attributes:
+        master_freq (int) -- see Phase_Mod_Synth doc string.
+        routing (tuple) -- algorithm name and numbers of ops and gens that
+            the synth will have once this patch is swapped in.
+        op_params (list of dict) -- per-operator curr_freq buffer, amp_amt,
+            and integral_freq, ready to be assigned.
+        gen_params (list of dict) -- per-generator curr_XXXX values.
+        gen_envelopes (list of array) -- per-generator grain envelope tables.
+        ops, gens, output_module, algorithm -- a freshly built and wired
+            component graph if the patch needs a different routing than the
+            synth will have when it is swapped in, otherwise None.
+
+    Preparing a patch can be slow, so it should be done on a thread other
+    than the audio thread (e.g. the GUI thread, or a loader thread). Once it
+    is prepared, the synth's swap_patch() only has to assign references.
+
+    Note that when a new component graph is built, any Controllers bound to
+    the old components will keep controlling the old (now silent) ones.
+    """
+    def __init__(self, patch, synth):
+        self.master_freq = patch.master_freq
+
+        # Compile the routing plan, but only if it differs from the one the
+        # synth will have by the time this is swapped in, which is the
+        # pending patch's if one is waiting
+        self.routing = (patch.algorithm, len(patch.ops), len(patch.gens))
+        pending = synth.pending_patch
+        if pending is not None:
+            routing = pending.routing
+        else:
+            routing = (type(synth.algorithm).__name__, len(synth.ops),
+                       len(synth.gens))
+        self.ops = None
+        self.gens = None
+        self.output_module = None
+        self.algorithm = None
+        if self.routing != routing:
+            self.ops = [pm_synth.Operator(synth, number=(op+1))
+                        for op in range(len(patch.ops))]
+            self.gens = [pm_synth.Grain_Generator(master=synth)
+                         for gen in range(len(patch.gens))]
+            self.output_module = pm_synth.Output(synth)
+            self.algorithm = pm_synth.make_algorithm(patch.algorithm, self.ops,
+                                                     self.gens,
+                                                     self.output_module)
+            self.algorithm.implement()
+
+        # Precompute operator buffers. Phase increments are worked out from
+        # curr_freq by the operator itself at the start of every block.
+        self.op_params = []
+        buffer_len = default.MAX_BLOCK_LEN*synth.oversample
+        for op in patch.ops:
+            curr_freq = np.full(buffer_len, op["freq"], dtype=int)
+            self.op_params.append({"curr_freq": curr_freq,
+                                   "amp_amt": op["amp_amt"],
+                                   "integral_freq": op["integral_freq"]})
+
+        # Precompute generator envelope tables
+        self.gen_params = [dict(gen) for gen in patch.gens]
+        self.gen_envelopes = [np.hamming(default.ENVELOPE_TABLE_LEN).astype(synth.dtype)
+                              for gen in patch.gens]
+
+
+def load_patch_file(synth, path):
+    """
+    Loads, prepares, and queues a patch file in one go.
+
+    Call this from any thread except the audio thread; the swap itself happens
+    in the synth between blocks.
+    """
+    patch = Patch.load(path)
+    synth.load_patch(patch.prepare(synth))
+    return(patch)
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@title: pm_synth_render.py
+@date: 10/19/2026
+@author: Daniel Guest
+@purpose: Offline rendering of Standard MIDI Files through pm_synth, without
+          any GUI or audio device. Events are read lazily from the file, the
+          synth renders everything between two events in as few blocks as
+          possible, and audio is written to disk as it is made, so memory use
+          doesn't grow with the length of the song.
+
+          Usage: python pm_synth_render.py song.mid song.wav [patch file]
+"""
+import sys
+import wave
+import numpy as np
+import pm_synth
+import pm_synth_midi as midi
+import pm_synth_defaults as default
+
+
+class Wav_Writer(object):
+    """
+    Streams 16-bit audio to a WAV file, one block at a time.
+
+    Arguments:
+        path (str) -- path of the WAV file to write.
+        fs (int) -- sampling rate in Hz.
+        gain (float) -- gain applied before conversion to 16-bit.
+        n_channels (int) -- number of channels.
+
+    Attributes:
+        n_clipped (int) -- number of samples that had to be clipped.
+        n_frames (int) -- number of frames written so far.
+
+    Blocks are n_channels x n arrays, as made by the synth. WAV files are
+    interleaved, so each block is scaled straight into the transpose of an
+    n x n_channels scratch buffer, which interleaves it for free.
+    """
+    def __init__(self, path, fs, gain=1.0, n_channels=1):
+        self.file = wave.open(path, "wb")
+        self.file.setnchannels(n_channels)
+        self.file.setsampwidth(2)
+        self.file.setframerate(fs)
+        self.gain = gain
+        self.scratch = np.zeros((default.MAX_BLOCK_LEN, n_channels))
+        self.n_clipped = 0
+        self.n_frames = 0
+
+    def write(self, block):
+        n = block.shape[1]
+        scaled = self.scratch[:n]
+        np.multiply(block.T, self.gain*32767, out=scaled)
+        self.n_clipped = self.n_clipped + int(np.count_nonzero(np.abs(scaled) > 32767))
+        np.clip(scaled, -32767, 32767, out=scaled)
+        self.file.writeframes(scaled.astype("<i2").tobytes())
+        self.n_frames = self.n_frames + n
+
+    def close(self):
+        self.file.close()
+
+
+def render_midi_file(path, out_path, synth=None, gain=1.0, tail=1.0,
+                     chunk_len=default.MAX_BLOCK_LEN):
+    """
+    Renders a Standard MIDI File to a WAV file.
+
+    Arguments:
+        path (str) -- path to the .mid file.
+        out_path (str) -- path to the .wav file to write.
+        synth (None, or Phase_Mod_Synth object) -- synth to render with, e.g.
+            one with a patch loaded. If None, a default synth is made.
+        gain (float) -- see Wav_Writer doc string.
+        tail (float) -- seconds of audio to render after the last event, to
+            let grains and delay lines ring out.
+        chunk_len (int) -- largest block to render at once, at most
+            MAX_BLOCK_LEN.
+
+    Returns the Wav_Writer, which knows how many frames were written and
+    clipped.
+    """
+    if synth is None:
+        synth = pm_synth.Phase_Mod_Synth(fs=default.FS)
+    writer = Wav_Writer(out_path, synth.fs, gain=gain,
+                        n_channels=synth.n_channels)
+    render_events(synth, midi.iter_midi_file(path), writer, tail=tail,
+                  chunk_len=chunk_len)
+    writer.close()
+    return(writer)
+
+
+def render_events(synth, events, writer, tail=1.0,
+                  chunk_len=default.MAX_BLOCK_LEN):
+    """
+    Renders synth, driven by MIDI events, to writer.
+
+    Arguments:
+        synth (Phase_Mod_Synth object) -- synth to render with.
+        events (iterable) -- (seconds, status, data1, data2) for each event,
+            in time order, with seconds counted from the synth's current
+            sample (see iter_midi_file()).
+        writer -- anything with a write(block) method, e.g. a Wav_Writer.
+        tail, chunk_len -- see render_midi_file doc string.
+
+    The synth renders straight up to the sample of the next event (in chunks
+    of at most chunk_len), and carries on from there. Events go through an
+    Event_Queue and a Midi_Scheduler, just like live MIDI does, so each one
+    is applied by synthesize() at the start of the block which begins at
+    its sample. That way, a note starting is seen by the Envelopes and LFOs
+    in that block, so repeated notes retrigger them.
+    """
+    queue = midi.Event_Queue()
+    start = synth.curr_sample
+    scheduler = midi.Midi_Scheduler(queue, fs=synth.fs, latency=start)
+    scheduler.start(0)
+    synth.midi_scheduler = scheduler
+    synth.gate_level = 0
+    for seconds, status, data1, data2 in events:
+        render_until(synth, writer, start + int(round(seconds*synth.fs)),
+                     chunk_len)
+        queue.push(seconds, status, data1, data2)
+    render_until(synth, writer, synth.curr_sample + int(tail*synth.fs),
+                 chunk_len)
+    synth.midi_scheduler = None
+
+
+def render_until(synth, writer, end_sample, chunk_len=default.MAX_BLOCK_LEN):
+    """ Renders synth up to (not including) end_sample, writing to writer. """
+    while synth.curr_sample < end_sample:
+        n = min(end_sample - synth.curr_sample, chunk_len)
+        writer.write(synth.synthesize(n))
+
+
+if __name__ == "__main__":
+    synth = pm_synth.Phase_Mod_Synth(fs=default.FS)
+    if len(sys.argv) > 3:
+        import pm_synth_patch
+        synth.load_patch(pm_synth_patch.Patch.load(sys.argv[3]).prepare(synth))
+    writer = render_midi_file(sys.argv[1], sys.argv[2], synth=synth)
+    print("Wrote " + str(writer.n_frames) + " frames (" +
+          str(writer.n_clipped) + " clipped) to " + sys.argv[2])
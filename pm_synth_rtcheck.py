@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@title: pm_synth_rtcheck.py
+@date: 10/19/2026
+@author: Daniel Guest
+@purpose: Real-time safety checking for pm_synth's audio callback. Anything
+          the callback does besides arithmetic on preallocated buffers (new
+          arrays, garbage collection, waiting on another thread for the GIL)
+          can make it miss its deadline, which is heard as a dropout. A
+          Realtime_Checker wraps the callback and measures, block by block,
+          how long it took against the deadline, how much memory it
+          allocated, and whether the garbage collector ran while it did. It
+          can also freeze the garbage collector while streaming, and collect
+          only at safe points, so that patches can be certified real-time
+          safe. The same check can be run without an audio device.
+
+          Usage: python pm_synth_rtcheck.py [patch file] [seconds]
+"""
+import gc
+import sys
+import time
+import tracemalloc
+import numpy as np
+import pm_synth
+import pm_synth_defaults as default
+
+
+class Realtime_Checker(object):
+    """
+    Wraps an audio callback and checks that it behaves in real time.
+
+    Arguments:
+        fs (int) -- sampling rate in Hz, which with the number of frames
+            asked for gives each block's deadline.
+        freeze_gc (boolean) -- if True, the garbage collector is frozen and
+            disabled while checking, see start(), and only collects at safe
+            points, see below.
+        track_allocations (boolean) -- if True, memory allocated in each block
+            is measured with tracemalloc. This slows the callback down a
+            little.
+        history_len (int) -- number of blocks of measurements kept.
+        snapshot_every (int) -- every this many blocks, the callback is
+            bracketed by tracemalloc snapshots, to find out where memory that
+            outlives the block is allocated. 0 for never.
+        collect_every (int) -- blocks between safe-point collections, if
+            freeze_gc.
+        headroom (float) -- a safe-point collection only happens after a
+            block which took less than this fraction of its deadline.
+
+    Attributes:
+        durations, deadlines (array) -- seconds each block took and had.
+        peaks (array) -- most memory (in bytes) allocated at once during
+            each block, whether or not it was freed again.
+        gc_times (array) -- seconds spent collecting garbage during each
+            block.
+        n_blocks (int) -- number of blocks checked.
+        n_late (int) -- number of blocks that missed their deadline.
+        n_status (int) -- number of blocks whose status flagged a problem
+            (e.g. an underflow reported by the audio device).
+        n_gc (int) -- number of garbage collections during a block.
+        n_safe_collects (int) -- number of safe-point collections.
+        sites (dict) -- for each "file:line", the number of blocks memory
+            allocated there outlived, and the total bytes, from snapshots.
+
+    All of the per-block measurements go into arrays allocated up front, as
+    ring buffers indexed by block number, so that checking doesn't allocate
+    much itself. A safe point is the end of a block that finished well
+    ahead of its deadline: only the young generations are collected there,
+    and everything that existed when checking started has been frozen, so
+    the collection is short.
+    """
+    def __init__(self, fs, freeze_gc=default.RT_FREEZE_GC,
+                 track_allocations=True, history_len=default.RT_HISTORY_LEN,
+                 snapshot_every=default.RT_SNAPSHOT_EVERY,
+                 collect_every=default.RT_COLLECT_EVERY,
+                 headroom=default.RT_COLLECT_HEADROOM):
+        self.fs = fs
+        self.freeze_gc = freeze_gc
+        self.track_allocations = track_allocations
+        self.snapshot_every = snapshot_every
+        self.collect_every = collect_every
+        self.headroom = headroom
+        self.durations = np.zeros(history_len)
+        self.deadlines = np.zeros(history_len)
+        self.peaks = np.zeros(history_len, dtype=np.int64)
+        self.gc_times = np.zeros(history_len)
+        self.n_blocks = 0
+        self.n_late = 0
+        self.n_status = 0
+        self.n_gc = 0
+        self.n_safe_collects = 0
+        self.safe_collect_time = 0
+        self.sites = {}
+        self.in_callback = False
+        self.gc_start = 0
+        self.gc_time = 0
+        self.blocks_since_collect = 0
+        self.started_tracing = False
+        self.gc_was_enabled = True
+
+    def start(self):
+        """ Starts checking, call before the stream starts. """
+        if self.track_allocations and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.started_tracing = True
+        gc.callbacks.append(self.on_gc)
+        if self.freeze_gc:
+            self.gc_was_enabled = gc.isenabled()
+            gc.collect()
+            gc.freeze()
+            gc.disable()
+
+    def stop(self):
+        """ Stops checking and puts the garbage collector back. """
+        if self.on_gc in gc.callbacks:
+            gc.callbacks.remove(self.on_gc)
+        if self.freeze_gc:
+            gc.unfreeze()
+            if self.gc_was_enabled:
+                gc.enable()
+        if self.started_tracing:
+            tracemalloc.stop()
+            self.started_tracing = False
+
+    def on_gc(self, phase, info):
+        """ gc.callbacks hook, times collections that happen in a block. """
+        if not self.in_callback:
+            return
+        if phase == "start":
+            self.gc_start = time.perf_counter()
+        else:
+            self.n_gc = self.n_gc + 1
+            self.gc_time = self.gc_time + time.perf_counter() - self.gc_start
+
+    def wrap(self, callback):
+        """
+        Returns callback wrapped in the checks, with the same arguments as a
+        sounddevice callback (outdata, frames, time, status).
+        """
+        def checked(outdata, frames, time_info, status):
+            i = self.n_blocks % len(self.durations)
+            snapshot = (self.track_allocations and self.snapshot_every > 0 and
+                        self.n_blocks % self.snapshot_every == 0)
+            if snapshot:
+                before = tracemalloc.take_snapshot()
+            if self.track_allocations:
+                tracemalloc.reset_peak()
+                floor = tracemalloc.get_traced_memory()[0]
+            self.gc_time = 0
+            self.in_callback = True
+            start = time.perf_counter()
+            callback(outdata, frames, time_info, status)
+            duration = time.perf_counter() - start
+            self.in_callback = False
+            if self.track_allocations:
+                self.peaks[i] = tracemalloc.get_traced_memory()[1] - floor
+            if snapshot:
+                self.add_sites(before, tracemalloc.take_snapshot())
+            deadline = frames/self.fs
+            self.durations[i] = duration
+            self.deadlines[i] = deadline
+            self.gc_times[i] = self.gc_time
+            if duration > deadline:
+                self.n_late = self.n_late + 1
+            if status:
+                self.n_status = self.n_status + 1
+            self.n_blocks = self.n_blocks + 1
+            self.blocks_since_collect = self.blocks_since_collect + 1
+            if (self.freeze_gc and self.blocks_since_collect >= self.collect_every
+                    and duration < self.headroom*deadline):
+                start = time.perf_counter()
+                gc.collect(1)
+                self.safe_collect_time = self.safe_collect_time + time.perf_counter() - start
+                self.n_safe_collects = self.n_safe_collects + 1
+                self.blocks_since_collect = 0
+        return(checked)
+
+    def add_sites(self, before, after):
+        """ Adds memory that outlived a block to sites, by file and line. """
+        ignore = [tracemalloc.Filter(False, tracemalloc.__file__),
+                  tracemalloc.Filter(False, __file__)]
+        stats = after.filter_traces(ignore).compare_to(
+            before.filter_traces(ignore), "lineno")
+        for stat in stats:
+            if stat.size_diff > 0:
+                frame = stat.traceback[0]
+                site = frame.filename + ":" + str(frame.lineno)
+                count, size = self.sites.get(site, (0, 0))
+                self.sites[site] = (count + 1, size + stat.size_diff)
+
+    def report(self):
+        """ Returns a dict of statistics over the blocks still in history. """
+        n = min(self.n_blocks, len(self.durations))
+        if n == 0:
+            return({"n_blocks": 0})
+        load = self.durations[:n]/self.deadlines[:n]
+        report = {"n_blocks": self.n_blocks,
+                  "n_late": self.n_late,
+                  "n_status": self.n_status,
+                  "mean_load": float(np.mean(load)),
+                  "p99_load": float(np.percentile(load, 99)),
+                  "max_load": float(np.max(load)),
+                  "max_duration": float(np.max(self.durations[:n])),
+                  "n_gc": self.n_gc,
+                  "gc_time": float(np.sum(self.gc_times[:n])),
+                  "n_safe_collects": self.n_safe_collects,
+                  "safe_collect_time": self.safe_collect_time}
+        if self.track_allocations:
+            report["n_allocating"] = int(np.count_nonzero(self.peaks[:n]))
+            report["max_alloc_bytes"] = int(np.max(self.peaks[:n]))
+            report["mean_alloc_bytes"] = float(np.mean(self.peaks[:n]))
+        return(report)
+
+    def certify(self, max_alloc_bytes=None):
+        """
+        Whether the callback was real-time safe, and if not, why not.
+
+        Arguments:
+            max_alloc_bytes (None, or int) -- most memory a block may
+                allocate. If None, allocations aren't held against it (NumPy
+                temporaries are allocated every block, and are usually cheap),
+                only reported.
+
+        Returns (safe, reasons), where reasons is a list of strings.
+        """
+        report = self.report()
+        reasons = []
+        if report["n_blocks"] == 0:
+            reasons.append("no blocks were checked")
+        else:
+            if report["n_late"] > 0:
+                reasons.append(str(report["n_late"]) + " blocks missed their deadline")
+            if report["n_gc"] > 0:
+                reasons.append(str(report["n_gc"]) + " garbage collections during blocks")
+            if report["n_status"] > 0:
+                reasons.append(str(report["n_status"]) + " blocks reported a status problem")
+            if (max_alloc_bytes is not None and self.track_allocations and
+                    report["max_alloc_bytes"] > max_alloc_bytes):
+                reasons.append("a block allocated " + str(report["max_alloc_bytes"]) +
+                               " bytes")
+        return((len(reasons) == 0, reasons))
+
+    def summary(self, n_sites=5):
+        """ Returns a printable summary of report() and the worst sites. """
+        lines = [key + ": " + str(value) for key, value in self.report().items()]
+        safe, reasons = self.certify()
+        if safe:
+            lines.append("real-time safe")
+        else:
+            lines.append("NOT real-time safe: " + "; ".join(reasons))
+        sites = sorted(self.sites.items(), key=lambda x: -x[1][1])[:n_sites]
+        for site, (count, size) in sites:
+            lines.append("  kept " + str(size) + " bytes over " + str(count) +
+                         " snapshots at " + site)
+        return("\n".join(lines))
+
+
+def check_synth(synth, seconds=5, block_len=default.BLOCK_LEN, **kwargs):
+    """
+    Runs synth through a Realtime_Checker without an audio device.
+
+    Arguments:
+        synth (Synthesizer object) -- synth to check, e.g. with a patch
+            loaded.
+        seconds (float) -- seconds of audio to render.
+        block_len (int) -- frames per callback.
+        kwargs -- passed on to Realtime_Checker.
+
+    The callback is the same one pm_synth_gui.py uses, writing into the 
+    transpose of a frames x channels buffer. Blocks are rendered back to 
+    back rather than at the sampling rate, which doesn't change how long 
+    each one takes.
+    Returns the checker.
+    """
+    checker = Realtime_Checker(synth.fs, **kwargs)
+    outdata = np.zeros((block_len, synth.n_channels), dtype="float32")
+    def callback(outdata, frames, time_info, status):
+        synth.synthesize(frames, out=outdata.T)
+    checked = checker.wrap(callback)
+    checker.start()
+    try:
+        for i in range(int(seconds*synth.fs/block_len)):
+            checked(outdata, block_len, None, None)
+    finally:
+        checker.stop()
+    return(checker)
+
+
+if __name__ == "__main__":
+    synth = pm_synth.Phase_Mod_Synth(fs=default.FS)
+    if len(sys.argv) > 1:
+        import pm_synth_patch
+        synth.load_patch(pm_synth_patch.Patch.load(sys.argv[1]).prepare(synth))
+    seconds = 5
+    if len(sys.argv) > 2:
+        seconds = float(sys.argv[2])
+    checker = check_synth(synth, seconds, freeze_gc=True)
+    print(checker.summary())
+    sys.exit(0 if checker.certify()[0] else 1)
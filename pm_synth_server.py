@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@title: pm_synth_server.py
+@date: 10/19/2026
+@author: Daniel Guest
+@purpose: Serve pm_synth's output to any number of listeners over TCP. The
+          synth is run once per block no matter how many clients there are,
+          and every client is sent the same block out of a shared ring
+          buffer. A client that can't keep up falls behind, and eventually
+          skips ahead, on its own without holding up the synth or anyone else.
+
+          Usage: python pm_synth_server.py [port] [patch file]
+
+Wire format: on connect the server sends STREAM_HEADER (magic, sampling rate,
+channels, frames per block). Then each block is sent as FRAME_HEADER (block
+sequence number, length in bytes) followed by that many bytes of
+little-endian 16-bit PCM, with channels interleaved. A gap in the sequence
+numbers means the client was too slow and blocks were dropped.
+"""
+import sys
+import struct
+import asyncio
+import numpy as np
+import pm_synth
+import pm_synth_defaults as default
+
+STREAM_MAGIC = b"PMSS"
+STREAM_HEADER = struct.Struct("<4sIHI")  # magic, fs, channels, block frames
+FRAME_HEADER = struct.Struct("<QI")      # sequence number, n bytes
+
+
+class Block_Ring(object):
+    """
+    Shared, reference-counted ring buffer of PCM blocks.
+
+    Arguments:
+        n_slots (int) -- number of blocks the ring holds.
+        block_frames (int) -- samples per block (per channel).
+        channels (int) -- number of interleaved channels.
+
+    Attributes:
+        slots (array) -- n_slots x (block_frames*channels) 16-bit PCM.
+        payloads (list) -- the bytes of each slot, as sent to clients.
+        refcounts (list) -- number of clients that still have to send each
+            slot.
+        head (int) -- sequence number of the next block to be published.
+        n_overruns (int) -- number of times a slot was overwritten while a
+            client still hadn't sent it.
+
+    Block number seq lives in slot seq % n_slots until it is overwritten
+    n_slots blocks later. Each block is copied into an immutable bytes object
+    once, when it is published, and every client sends that same object, so
+    no client gets its own copy. The transport may hold on to it after the
+    client has moved on (and after the slot has been overwritten), so it
+    must not be a view of the slot.
+    """
+    def __init__(self, n_slots=default.SERVER_RING_LEN,
+                 block_frames=default.SERVER_BLOCK_LEN, channels=1):
+        self.n_slots = n_slots
+        self.slots = np.zeros((n_slots, block_frames*channels), dtype="<i2")
+        self.scratch = np.zeros(block_frames*channels)
+        self.payloads = [b""]*n_slots
+        self.refcounts = [0]*n_slots
+        self.head = 0
+        self.n_overruns = 0
+
+    def publish(self, block, n_readers):
+        """
+        Converts a float block (channels x block_frames) to interleaved PCM in
+        the next slot, for n_readers.
+        """
+        slot = self.head % self.n_slots
+        if self.refcounts[slot] > 0:
+            self.n_overruns = self.n_overruns + 1
+        frames = self.scratch.reshape(block.shape[1], block.shape[0])
+        np.multiply(block.T, 32767, out=frames)
+        np.clip(self.scratch, -32767, 32767, out=self.scratch)
+        self.slots[slot] = self.scratch
+        self.payloads[slot] = self.slots[slot].tobytes()
+        self.refcounts[slot] = n_readers
+        self.head = self.head + 1
+
+    def oldest(self):
+        """ Sequence number of the oldest block still in the ring. """
+        return(max(0, self.head - self.n_slots))
+
+    def payload(self, seq):
+        """ Bytes of block seq, shared by every client. """
+        return(self.payloads[seq % self.n_slots])
+
+    def release(self, seq):
+        """ Marks block seq as sent (or skipped) by one client. """
+        if seq >= self.oldest():
+            slot = seq % self.n_slots
+            self.refcounts[slot] = max(0, self.refcounts[slot] - 1)
+
+
+class Audio_Server(object):
+    """
+    Asyncio TCP server which fans one synth's output out to many clients.
+
+    Arguments:
+        synth (Phase_Mod_Synth object) -- synth to serve.
+        host (str) -- address to listen on.
+        port (int) -- port to listen on (0 picks a free port).
+        block_frames (int) -- samples per block sent to clients.
+        n_slots (int) -- see Block_Ring doc string.
+        realtime (boolean) -- if True, blocks are rendered at the sampling
+            rate. If False, as fast as possible (e.g. for testing).
+
+    Attributes:
+        ring (Block_Ring object) -- shared ring buffer.
+        n_clients (int) -- number of connected clients.
+        n_dropped (int) -- total number of blocks skipped by slow clients.
+    """
+    def __init__(self, synth, host="127.0.0.1", port=default.SERVER_PORT,
+                 block_frames=default.SERVER_BLOCK_LEN,
+                 n_slots=default.SERVER_RING_LEN, realtime=True):
+        self.synth = synth
+        self.host = host
+        self.port = port
+        self.block_frames = block_frames
+        self.realtime = realtime
+        self.channels = synth.n_channels
+        self.ring = Block_Ring(n_slots, block_frames, self.channels)
+        self.n_clients = 0
+        self.n_dropped = 0
+        self.server = None
+        self.new_block = None
+        self.closing = False
+        self.writers = set()
+
+    async def start(self):
+        """ Starts listening, and returns the port actually used. """
+        self.new_block = asyncio.Condition()
+        self.server = await asyncio.start_server(self.handle_client, self.host,
+                                                 self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return(self.port)
+
+    async def render(self, n_blocks=None):
+        """ Runs the synth and publishes each block to all clients. """
+        buffers = [np.zeros((self.channels, self.block_frames))]
+        async for block in self.synth.astream(self.block_frames,
+                                              buffers=buffers,
+                                              n_blocks=n_blocks,
+                                              realtime=self.realtime):
+            self.ring.publish(block, self.n_clients)
+            async with self.new_block:
+                self.new_block.notify_all()
+
+    async def serve(self, n_blocks=None):
+        """ Starts the server (if needed) and renders n_blocks blocks. """
+        if self.server is None:
+            await self.start()
+        await self.render(n_blocks)
+
+    async def close(self):
+        """ Disconnects all clients and stops listening. """
+        self.closing = True
+        async with self.new_block:
+            self.new_block.notify_all()
+        for writer in list(self.writers):
+            writer.transport.abort()
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def handle_client(self, reader, writer):
+        """
+        Sends every new block to one client.
+
+        Starts from the next block to be published. If the client falls so
+        far behind that its next block has been overwritten, it skips ahead
+        to the newest block, releasing everything in between.
+        """
+        writer.write(STREAM_HEADER.pack(STREAM_MAGIC, self.synth.fs,
+                                        self.channels, self.block_frames))
+        seq = self.ring.head
+        self.n_clients = self.n_clients + 1
+        self.writers.add(writer)
+        try:
+            while not self.closing:
+                if seq >= self.ring.head:
+                    async with self.new_block:
+                        await self.new_block.wait_for(lambda: self.ring.head > seq or self.closing)
+                    continue
+                if seq < self.ring.oldest():
+                    newest = self.ring.head - 1
+                    for skipped in range(seq, newest):
+                        self.ring.release(skipped)
+                    self.n_dropped = self.n_dropped + newest - seq
+                    seq = newest
+                data = self.ring.payload(seq)
+                writer.write(FRAME_HEADER.pack(seq, len(data)))
+                writer.write(data)
+                self.ring.release(seq)
+                seq = seq + 1
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            for unsent in range(seq, self.ring.head):
+                self.ring.release(unsent)
+            self.n_clients = self.n_clients - 1
+            self.writers.discard(writer)
+            writer.close()
+
+
+async def receive_blocks(host, port, n_blocks, delay=0):
+    """
+    Local client stub: reads n_blocks blocks from an Audio_Server.
+
+    Arguments:
+        host, port -- address of the server.
+        n_blocks (int) -- number of blocks to read.
+        delay (float) -- seconds to wait after each block, to act like a
+            slow client.
+
+    Returns (header, seqs, blocks), where header is (fs, channels,
+    block_frames), seqs is a list of block sequence numbers, and blocks is a
+    list of int16 arrays.
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    magic, fs, channels, block_frames = STREAM_HEADER.unpack(
+        await reader.readexactly(STREAM_HEADER.size))
+    if magic != STREAM_MAGIC:
+        raise ValueError("Not a pm_synth stream")
+    seqs = []
+    blocks = []
+    for i in range(n_blocks):
+        seq, n_bytes = FRAME_HEADER.unpack(await reader.readexactly(FRAME_HEADER.size))
+        data = await reader.readexactly(n_bytes)
+        seqs.append(seq)
+        blocks.append(np.frombuffer(data, dtype="<i2"))
+        if delay > 0:
+            await asyncio.sleep(delay)
+    writer.close()
+    return(((fs, channels, block_frames), seqs, blocks))
+
+
+if __name__ == "__main__":
+    synth = pm_synth.Phase_Mod_Synth(fs=default.FS)
+    if len(sys.argv) > 2:
+        import pm_synth_patch
+        synth.load_patch(pm_synth_patch.Patch.load(sys.argv[2]).prepare(synth))
+    port = default.SERVER_PORT
+    if len(sys.argv) > 1:
+        port = int(sys.argv[1])
+    server = Audio_Server(synth, port=port)
+    print("Serving on port " + str(port) + ", press Ctrl-C to quit")
+    asyncio.run(server.serve())
@@ -15,7 +15,7 @@ import pm_synth_defaults as default
 
 class CenterWidget(QWidget):
     """
-    Central widget of main.py's MainWidget.
+    Central widget of pm_synth_gui.py's MainWindow.
     
     Contains n_op OperatorGroups and n_gen GeneratorGroups and one master 
     frequency slider.
@@ -93,9 +93,11 @@ class GeneratorGroup(QWidget):
     """
     Collection of control interfaces for generators.
     
-    Contains sliders which control the lag, period, and duration parameters of
-    the generator this Group is connected to, as well as each parameter's 
-    respective jitter.
+    Contains sliders which control the lag, period, duration, and pitch 
+    parameters of the generator this Group is connected to, as well as each 
+    parameter's respective jitter, a slider for the chance of a grain 
+    playing in reverse, and sliders for grain amplitude jitter, pan, and pan
+    spread.
     
     Note that these connections only apply once this group has been passed to
     an appropriate Controller object.
@@ -144,6 +146,39 @@ class GeneratorGroup(QWidget):
                                        orientation=Qt.Horizontal)
         self.durJitterSlider.setValue(default.CURR_GRAIN_LEN_JITTER)
         
+        pitchLabel = QLabel("Grain pitch (semitones)")
+        self.pitchSlider = QSlider(minimum=default.MIN_GRAIN_PITCH,
+                                   maximum=default.MAX_GRAIN_PITCH,
+                                   value=0,
+                                   orientation=Qt.Horizontal)
+        self.pitchSlider.setValue(0)
+        pitchJitterLabel = QLabel("Grain pitch jitter (semitones)")
+        self.pitchJitterSlider = QSlider(minimum=default.MIN_GRAIN_RATE_JITTER,
+                                         maximum=default.MAX_GRAIN_RATE_JITTER,
+                                         value=default.CURR_GRAIN_RATE_JITTER,
+                                         orientation=Qt.Horizontal)
+        self.pitchJitterSlider.setValue(default.CURR_GRAIN_RATE_JITTER)
+        reverseLabel = QLabel("Grain reverse chance (%)")
+        self.reverseSlider = QSlider(minimum=0, maximum=100,
+                                     value=int(default.CURR_GRAIN_REVERSE_PROB*100),
+                                     orientation=Qt.Horizontal)
+        self.reverseSlider.setValue(int(default.CURR_GRAIN_REVERSE_PROB*100))
+        ampJitterLabel = QLabel("Grain amplitude jitter (%)")
+        self.ampJitterSlider = QSlider(minimum=0, maximum=100,
+                                       value=int(default.CURR_GRAIN_AMP_JITTER*100),
+                                       orientation=Qt.Horizontal)
+        self.ampJitterSlider.setValue(int(default.CURR_GRAIN_AMP_JITTER*100))
+        panLabel = QLabel("Grain pan (left to right)")
+        self.panSlider = QSlider(minimum=-100, maximum=100,
+                                 value=int(default.CURR_GRAIN_PAN*100),
+                                 orientation=Qt.Horizontal)
+        self.panSlider.setValue(int(default.CURR_GRAIN_PAN*100))
+        panJitterLabel = QLabel("Grain pan spread")
+        self.panJitterSlider = QSlider(minimum=0, maximum=100,
+                                       value=int(default.CURR_GRAIN_PAN_JITTER*100),
+                                       orientation=Qt.Horizontal)
+        self.panJitterSlider.setValue(int(default.CURR_GRAIN_PAN_JITTER*100))
+        
         box.addWidget(lagLabel)
         box.addWidget(self.lagSlider)
         box.addWidget(lagJitterLabel)
@@ -155,7 +190,19 @@ class GeneratorGroup(QWidget):
         box.addWidget(durLabel)
         box.addWidget(self.durSlider)
         box.addWidget(durJitterLabel)
-        box.addWidget(self.durJitterSlider)        
+        box.addWidget(self.durJitterSlider)
+        box.addWidget(pitchLabel)
+        box.addWidget(self.pitchSlider)
+        box.addWidget(pitchJitterLabel)
+        box.addWidget(self.pitchJitterSlider)
+        box.addWidget(reverseLabel)
+        box.addWidget(self.reverseSlider)
+        box.addWidget(ampJitterLabel)
+        box.addWidget(self.ampJitterSlider)
+        box.addWidget(panLabel)
+        box.addWidget(self.panSlider)
+        box.addWidget(panJitterLabel)
+        box.addWidget(self.panJitterSlider)
         
 class FreqKnob(QDial):
     """
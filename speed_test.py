@@ -1,12 +1,223 @@
 """
 pm_synth speed testing
-"""
 
-import pm_synth_buffer
+Synthesizes a few seconds of audio with each engine dtype, several times
+over, and reports how long it took, the range of float32's speedup, and how
+much memory the synth's arrays take up. Then reports how
+long it takes to import each of the headless modules in a fresh interpreter,
+and checks that none of them pulls in a GUI or audio library. Finally, sweeps
+a few controls from a second thread while the synth plays in real time on a
+virtual device, with changes applied right away, through a Control_Queue, and
+through a rate-limited Control_Queue, and reports how much time the sweeping
+thread spent in the controls (holding the GIL), how many changes reached the
+synth, and the callback timing, over several runs of each.
+
+Usage: python speed_test.py [seconds]
+"""
+import sys
+import time
+import threading
+import subprocess
+import numpy as np
+import pm_synth
+import pm_synth_audio as audio
+import pm_synth_controller as ctrl
 import pm_synth_defaults as default
 
-n_op = 2
-fs = 20000
-synth_kernel = pm_synth_buffer.Phase_Mod_Synth(fs=fs, n_op=n_op)
-output = [synth_kernel.synthesize() for x in range(int(fs*5/default.BUFFER_LEN))] # Synthesize 5 seconds of audio
-print(len(output))
+GUI_MODULES = ["PyQt5", "sounddevice", "rtmidi", "asyncio"]
+HEADLESS_MODULES = ["numpy", "pm_synth", "pm_synth_patch", "pm_synth_render",
+                    "pm_synth_golden", "pm_synth_metrics", "main"]
+
+def make_synth(dtype, n_gen=4):
+    """ Builds a synth with n_gen busy generators sharing one delay line. """
+    synth = pm_synth.Phase_Mod_Synth(fs=default.FS, n_op=2, n_gen=n_gen,
+                                     seed=0, dtype=dtype)
+    synth.algorithm = pm_synth.a1_2op_Xgen(synth.ops, synth.gens,
+                                           synth.output_module)
+    synth.algorithm.implement()
+    synth.ops[0].amp_amt = 0.5
+    synth.ops[1].amp_amt = 0.8
+    for gen in synth.gens:
+        gen.curr_period = 50
+        gen.curr_dur = 1000
+        gen.curr_rate = 1.5
+        gen.curr_pan_jitter = 1
+    return(synth)
+
+
+def synth_nbytes(synth):
+    """ Total size of every NumPy array held by the synth and its parts. """
+    objects = [synth, synth.output_module] + synth.ops + synth.gens + \
+              synth.algorithm.engines
+    objects = objects + [op.delay_line for op in synth.ops
+                         if op.delay_line is not None]
+    arrays = {}
+    for obj in objects:
+        for value in vars(obj).values():
+            if isinstance(value, np.ndarray):
+                arrays[id(value)] = value
+    return(sum(array.nbytes for array in arrays.values()))
+
+
+def time_import(module, n_runs=5):
+    """
+    Fastest time, over n_runs fresh interpreters, to import module, and the 
+    list of GUI or audio modules (in GUI_MODULES) which got imported with it.
+    """
+    code = ("import sys, time; start = time.perf_counter(); import " + module +
+            "; print(time.perf_counter() - start); print(' '.join(m for m in " +
+            repr(GUI_MODULES) + " if m in sys.modules))")
+    times = []
+    for i in range(n_runs):
+        lines = subprocess.run([sys.executable, "-c", code], capture_output=True,
+                               text=True, check=True).stdout.splitlines()
+        times.append(float(lines[0]))
+    return((min(times), lines[1].split()))
+    
+    
+class Fake_Signal(object):
+    """ Stands in for a Qt signal, calling its slots on emit(). """
+    def __init__(self):
+        self.slots = []
+        
+    def connect(self, slot):
+        self.slots.append(slot)
+        
+    def emit(self, value):
+        for slot in self.slots:
+            slot(value)
+            
+            
+class Fake_Slider(object):
+    """ Stands in for a Qt slider, without a display. """
+    def __init__(self, value):
+        self.current = value
+        self.valueChanged = Fake_Signal()
+        
+    def value(self):
+        return(self.current)
+        
+    def move(self, value):
+        self.current = value
+        self.valueChanged.emit(value)
+        
+        
+def sweep_test(mode, seconds, interval=0.0002):
+    """
+    Plays a synth for seconds on a real-time Null_Backend, while another 
+    thread moves an operator's frequency and amplitude, a generator's 
+    period, and the master frequency every interval seconds. 
+    
+    mode is "immediate" (no Control_Queue), "queued" (a Control_Queue that
+    doesn't rate limit) or "limited" (the default Control_Queue, flushed 
+    once a block by the sweeping thread, like the GUI's timer does).
+    
+    Returns (signals, applied, slot_seconds, p99, jitter), the number of 
+    control changes made, how many reached the synth, the seconds the 
+    sweeping thread spent in the controls, and the 99th percentile and 
+    standard deviation of the callback time.
+    """
+    synth = pm_synth.Phase_Mod_Synth(fs=default.FS, seed=0)
+    queue = None
+    if mode == "queued":
+        queue = ctrl.Control_Queue(interval=0)
+    elif mode == "limited":
+        queue = ctrl.Control_Queue()
+    synth.control_queue = queue
+    sliders = [Fake_Slider(1), Fake_Slider(50), Fake_Slider(200),
+               Fake_Slider(60)]
+    ctrl.Operator_Controller(synth.ops[0]).bind_freq(sliders[0])
+    ctrl.Operator_Controller(synth.ops[0]).bind_amp(sliders[1])
+    ctrl.Generator_Controller(synth.gens[0]).bind_period(sliders[2],
+                                                         Fake_Slider(0))
+    ctrl.Synth_Controller(synth).bind_master_freq(sliders[3])
+    stopping = threading.Event()
+    counts = [0, 0]
+    def sweep():
+        i = 0
+        flushed = time.perf_counter()
+        while not stopping.is_set():
+            start = time.perf_counter()
+            for slider, low, span in zip(sliders, [1, 20, 100, 55],
+                                         [3, 60, 300, 20]):
+                slider.move(low + i % span)
+            if queue is not None and start - flushed >= queue.interval:
+                queue.flush()
+                flushed = start
+            counts[1] = counts[1] + time.perf_counter() - start
+            counts[0] = counts[0] + len(sliders)
+            i = i + 1
+            time.sleep(interval)
+    thread = threading.Thread(target=sweep)
+    backend = audio.Null_Backend(audio.synth_callback(synth), fs=synth.fs,
+                                 n_channels=synth.n_channels)
+    thread.start()
+    backend.run(int(seconds*synth.fs/backend.block_len))
+    stopping.set()
+    thread.join()
+    applied = counts[0]
+    if queue is not None:
+        applied = queue.n_applied
+    n = min(backend.n_blocks, len(backend.durations))
+    return((counts[0], applied, counts[1], backend.report()["p99_load"]*
+            backend.block_len/synth.fs, np.std(backend.durations[:n])))
+    
+    
+def time_synth(synth, seconds, block_len):
+    """ Seconds taken to synthesize seconds of audio in block_len blocks. """
+    n_blocks = int(synth.fs*seconds/block_len)
+    start = time.perf_counter()
+    for i in range(n_blocks):
+        synth.synthesize(block_len)
+    return(time.perf_counter() - start)
+
+
+seconds = 5
+if len(sys.argv) > 1:
+    seconds = float(sys.argv[1])
+# Timings are repeated, alternating dtypes, since a single run of either
+# varies by more than the difference between them in real-time blocks.
+n_runs = 5
+results = {}
+for dtype in ["float64", "float32"]:
+    results[dtype] = (synth_nbytes(make_synth(dtype)), [], [])
+for run in range(n_runs):
+    for dtype in ["float64", "float32"]:
+        results[dtype][1].append(time_synth(make_synth(dtype), seconds,
+                                            default.BUFFER_LEN))
+        results[dtype][2].append(time_synth(make_synth(dtype), seconds,
+                                            default.MAX_BLOCK_LEN))
+for dtype in ["float64", "float32"]:
+    print(dtype + ": " + str(round(results[dtype][0]/1e6, 2)) + " MB, " +
+          str(round(np.median(results[dtype][1]), 3)) + " s real-time blocks, " +
+          str(round(np.median(results[dtype][2]), 3)) + " s offline blocks, " +
+          "for " + str(seconds) + " s of audio (median of " + str(n_runs) + ")")
+for index, name in [(1, "real-time"), (2, "offline")]:
+    speedups = np.array(results["float64"][index])/np.array(results["float32"][index])
+    print("float32 speedup (" + name + "): " + str(round(np.min(speedups), 2)) +
+          "x to " + str(round(np.max(speedups), 2)) + "x" +
+          (", within noise" if np.min(speedups) <= 1 <= np.max(speedups) else ""))
+print("float32 saves " +
+      str(round(100*(1 - results["float32"][0]/results["float64"][0]))) +
+      "% memory")
+for module in HEADLESS_MODULES:
+    import_seconds, loaded = time_import(module)
+    print("import " + module + ": " + str(round(import_seconds*1000, 1)) + " ms" +
+          (", also imported " + ", ".join(loaded) if loaded else ""))
+# Callback timing varies a lot from run to run, so each mode is run several
+# times, interleaved, and the range is reported.
+sweeps = {"immediate": [], "queued": [], "limited": []}
+for run in range(n_runs):
+    for mode in sweeps:
+        sweeps[mode].append(sweep_test(mode, seconds))
+for mode, results in sweeps.items():
+    signals, applied, slot_seconds, p99, jitter = np.array(results).T
+    print(mode + " controls: " + str(int(np.median(signals))) + " changes, " +
+          str(int(np.median(applied))) + " applied, " +
+          str(round(np.min(slot_seconds*1e9/signals))) + "-" +
+          str(round(np.max(slot_seconds*1e9/signals))) + " ns per change " +
+          "in the GUI thread, p99 callback " + str(round(np.min(p99)*1e6)) +
+          "-" + str(round(np.max(p99)*1e6)) + " us, callback jitter " +
+          str(round(np.min(jitter)*1e6)) + "-" +
+          str(round(np.max(jitter)*1e6)) + " us (over " + str(n_runs) +
+          " runs)")